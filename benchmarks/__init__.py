@@ -0,0 +1,6 @@
+"""
+Standalone benchmarks for the casy pipeline.
+
+Each module can be run with ``python -m benchmarks.<name>`` from the project
+root and prints its results to stdout.
+"""
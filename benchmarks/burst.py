@@ -0,0 +1,83 @@
+"""
+Process a burst of unread mail, as after an outage or a first sync.
+
+The unread messages are spread over a number of threads in a FakeMailbox
+and handled by one ``EmailProcessor.process_new_emails`` run, with the dummy
+NLP backend by default, so the cost measured is Gmail round trips and
+database work.
+
+Usage:
+    python -m benchmarks.burst --messages 10000 --threads 2000 --gmail-latency 0.005
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.fake_gmail import FakeMailbox
+from benchmarks.harness import (
+    add_common_arguments,
+    add_nlp_argument,
+    benchmark_database,
+    count_queries,
+    make_processor,
+    quota_units,
+    report,
+    setup_django,
+)
+
+
+def run(messages: int, threads: int, gmail_latency: float = 0.0) -> dict:
+    from conversation.models import Message, ScheduledMessage
+
+    random.seed(0)
+    mailbox = FakeMailbox(latency=gmail_latency)
+    for index in range(messages):
+        thread = index % threads
+        mailbox.add_unread(
+            thread_id=f"t{thread:06d}",
+            sender=f"contact{thread}@example.com",
+            body=f"Message {index} in thread {thread}.\n\n" + "Some text. " * 40,
+        )
+
+    processor = make_processor(mailbox)
+    with count_queries() as queries:
+        start = time.perf_counter()
+        processor.process_new_emails()
+        elapsed = time.perf_counter() - start
+
+    stored = Message.objects.filter(message_type="INCOMING").count()
+    return {
+        "elapsed_seconds": elapsed,
+        "messages_per_second": stored / elapsed if elapsed else 0.0,
+        "stored_messages": stored,
+        "scheduled_messages": ScheduledMessage.objects.count(),
+        "left_unread": len(mailbox.unread_ids()),
+        "per_message_queries": queries.count / max(stored, 1),
+        "gmail_requests": sum(mailbox.calls.values()),
+        "quota_units": quota_units(mailbox),
+        "per_message_quota_units": quota_units(mailbox) / max(stored, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--threads", type=int, default=2000)
+    add_common_arguments(parser)
+    add_nlp_argument(parser)
+    args = parser.parse_args(argv)
+
+    setup_django(args)
+    with benchmark_database():
+        metrics = run(args.messages, args.threads, args.gmail_latency)
+        params = {
+            "messages": args.messages,
+            "threads": args.threads,
+            "gmail_latency": args.gmail_latency,
+        }
+        return report("burst", params, metrics, args)
+
+
+if __name__ == "__main__":
+    main()
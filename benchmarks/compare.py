@@ -0,0 +1,106 @@
+"""
+Compare two benchmark results and flag regressions.
+
+The direction of each metric comes from its name: ``*_per_second`` is
+better higher; ``*_seconds``, ``*_queries`` and ``*_units`` are better
+lower. Other metrics are shown but never flagged. Exits with status 1 when
+any metric got worse by more than the threshold.
+
+Usage:
+    python -m benchmarks.compare benchmarks/results/burst-A.json \\
+        benchmarks/results/burst-B.json --threshold 0.1
+"""
+
+import argparse
+import json
+import sys
+
+HIGHER_IS_BETTER = ("_per_second",)
+LOWER_IS_BETTER = ("_seconds", "_queries", "_units")
+
+
+def direction(name: str) -> int:
+    """1 if higher is better, -1 if lower is better, 0 if neither."""
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(base: dict, current: dict, threshold: float = 0.1) -> list:
+    """
+    Compare the metrics of two results.
+
+    Returns ``(name, base, current, change, regressed)`` rows, ``change``
+    being the relative change from base, or None when base is zero.
+    """
+    rows = []
+    for name, old in base["metrics"].items():
+        new = current["metrics"].get(name)
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        change = (new - old) / abs(old) if old else None
+        worse = direction(name)
+        if change is None:
+            regressed = worse < 0 and new > 0
+        else:
+            regressed = worse != 0 and -worse * change > threshold
+        rows.append((name, old, new, change, regressed))
+    return rows
+
+
+def _label(result: dict) -> str:
+    """Revision of a run, with its NLP backend when it recorded one."""
+    backend = result.get("nlp_backend")
+    return f"{result['revision']} ({backend})" if backend else result["revision"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base", help="Result file of the reference run")
+    parser.add_argument("current", help="Result file of the run to check")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative change counted as a regression (default 0.1)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print raw JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if base["scenario"] != current["scenario"]:
+        parser.error(f"{base['scenario']} and {current['scenario']} differ")
+
+    rows = compare(base, current, args.threshold)
+    regressions = [row[0] for row in rows if row[4]]
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "metrics": {
+                        name: {"base": old, "current": new, "change": change}
+                        for name, old, new, change, _ in rows
+                    },
+                    "regressions": regressions,
+                },
+                indent=2,
+            )
+        )
+    else:
+        if base["params"] != current["params"]:
+            print("Warning: the runs used different parameters")
+        print(f"{base['scenario']}: {_label(base)} -> {_label(current)}")
+        for name, old, new, change, regressed in rows:
+            delta = f"{change:+.1%}" if change is not None else "n/a"
+            flag = "  REGRESSION" if regressed else ""
+            print(f"  {name:36} {old:12.4f} {new:12.4f} {delta:>8}{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Measure the compression ratio and per-message overhead of stored bodies.
+
+Runs every codec used by CompressedTextField over the synthetic thread corpus
+from ``benchmarks.quote_stripping``, on both raw bodies (with quoted history)
+and trimmed bodies. The zstd dictionary is trained on a separate sample of
+the same corpus, the way ``train_compression_dictionary`` would.
+
+Usage:
+    python -m benchmarks.compression --threads 200 --length 20
+"""
+
+import argparse
+import json
+import random
+import time
+
+from benchmarks.quote_stripping import make_thread
+from conversation.compression import (
+    compress_text,
+    decompress_text,
+    train_dictionary,
+    zstandard,
+)
+from conversation.services.quote_stripping import strip_quoted_text
+
+
+def measure(corpus, codec, dictionary=None):
+    dictionaries = {dictionary.dict_id(): dictionary} if dictionary else None
+
+    start = time.perf_counter()
+    stored = [
+        compress_text(body, codec=codec, dictionary=dictionary) for body in corpus
+    ]
+    write_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    restored = [decompress_text(value, dictionaries) for value in stored]
+    read_seconds = time.perf_counter() - start
+
+    assert restored == corpus
+    original = sum(len(body.encode("utf-8")) for body in corpus)
+    compressed = sum(len(value) for value in stored)
+    return {
+        "original_bytes": original,
+        "stored_bytes": compressed,
+        "ratio": round(original / compressed, 2),
+        "write_us_per_message": round(1e6 * write_seconds / len(corpus), 2),
+        "read_us_per_message": round(1e6 * read_seconds / len(corpus), 2),
+    }
+
+
+def run(threads: int, length: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    raw = [body for _ in range(threads) for body in make_thread(length, rng)]
+    training = [body for _ in range(50) for body in make_thread(length, rng)]
+    corpora = {"raw": raw, "trimmed": [strip_quoted_text(body) for body in raw]}
+
+    codecs = {"zlib": ("zlib", None)}
+    if zstandard is not None:
+        codecs["zstd"] = ("zstd", None)
+        codecs["zstd+dict"] = ("zstd", train_dictionary(training, 16384))
+
+    results = {}
+    for corpus_name, corpus in corpora.items():
+        for codec_name, (codec, dictionary) in codecs.items():
+            results[f"{corpus_name}/{codec_name}"] = measure(corpus, codec, dictionary)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=200)
+    parser.add_argument("--length", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.threads, args.length, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+
+    print(f"{'':18} {'ratio':>8} {'write us':>10} {'read us':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:18} {result['ratio']:8} "
+            f"{result['write_us_per_message']:10} {result['read_us_per_message']:10}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
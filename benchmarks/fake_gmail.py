@@ -0,0 +1,407 @@
+"""
+In-memory fake of the Gmail API client used by ``GmailService``.
+
+It implements the parts of the ``googleapiclient`` resource interface the
+app calls (``users().messages()`` list/get/modify/batchModify/send and
+attachments, ``drafts()`` create/send, ``threads().get``, ``history().list``,
+``getProfile``, ``watch`` and batch requests), with a configurable latency and error rate
+per request, and counts the requests made per method.
+
+Usage:
+    mailbox = FakeMailbox(latency=0.005)
+    mailbox.add_unread(thread_id="t1", sender="bob@example.com", body="Hi")
+    gmail = GmailService(service=FakeGmailService(mailbox))
+"""
+
+import base64
+import random
+import threading
+import time
+from collections import Counter
+from email.utils import format_datetime
+from datetime import datetime, timezone
+
+from googleapiclient.errors import HttpError
+
+
+class _Response(dict):
+    """Stands in for the httplib2 response attached to an HttpError."""
+
+    def __init__(self, status):
+        super().__init__(status=str(status))
+        self.status = status
+        self.reason = "Fake error"
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+class FakeMailbox:
+    """Messages, drafts and history of one fake Gmail account."""
+
+    def __init__(self, address="me@example.com", latency=0.0, error_rate=0.0, seed=0):
+        self.address = address
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.messages = {}
+        self.order = []
+        self.position = {}
+        self.drafts = {}
+        self.history = []
+        self.history_id = 1
+        # History before this ID has expired, history.list answers 404
+        self.history_floor = 0
+        self.calls = Counter()
+        self._next_id = 1
+
+    def _new_id(self, prefix: str) -> str:
+        value = f"{prefix}{self._next_id:012x}"
+        self._next_id += 1
+        return value
+
+    def _record(self, kind: str, message_id: str):
+        message = self.messages[message_id]
+        self.history_id += 1
+        self.history.append(
+            {
+                "id": str(self.history_id),
+                kind: [
+                    {
+                        "message": {
+                            "id": message_id,
+                            "threadId": message["threadId"],
+                            "labelIds": list(message["labelIds"]),
+                        }
+                    }
+                ],
+            }
+        )
+
+    def add_message(
+        self,
+        thread_id: str,
+        sender: str,
+        body: str,
+        subject: str = "Hello",
+        labels=("INBOX", "UNREAD"),
+        date: datetime = None,
+    ) -> str:
+        """Deliver a message and return its ID."""
+        date = date or datetime.now(timezone.utc)
+        with self.lock:
+            message_id = self._new_id("m")
+            headers = [
+                {"name": "From", "value": sender},
+                {"name": "To", "value": self.address},
+                {"name": "Subject", "value": subject},
+                {"name": "Date", "value": format_datetime(date)},
+                {"name": "Message-ID", "value": f"<{message_id}@fake.example.com>"},
+            ]
+            self.messages[message_id] = {
+                "id": message_id,
+                "threadId": thread_id,
+                "labelIds": list(labels),
+                "internalDate": str(int(date.timestamp() * 1000)),
+                "snippet": body[:100],
+                "payload": {
+                    "mimeType": "text/plain",
+                    "headers": headers,
+                    "body": {"size": len(body), "data": _b64(body)},
+                },
+            }
+            self.position[message_id] = len(self.order)
+            self.order.append(message_id)
+            self._record("messagesAdded", message_id)
+        return message_id
+
+    def add_unread(self, thread_id: str, sender: str, body: str, **kwargs) -> str:
+        return self.add_message(thread_id, sender, body, **kwargs)
+
+    def unread_ids(self):
+        return [m for m in self.order if "UNREAD" in self.messages[m]["labelIds"]]
+
+    def call(self, method: str, func):
+        """Run one API request with the configured latency and error rate."""
+        with self.lock:
+            self.calls[method] += 1
+            fail = self.error_rate and self.rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise HttpError(_Response(503), b'{"error": "backendError"}')
+        with self.lock:
+            return func()
+
+
+class FakeRequest:
+    def __init__(self, mailbox: FakeMailbox, method: str, func):
+        self.mailbox = mailbox
+        self.method = method
+        self.func = func
+
+    def execute(self, num_retries=0):
+        return self.mailbox.call(self.method, self.func)
+
+
+class FakeBatch:
+    """Batch request: one round trip of latency for all sub-requests."""
+
+    def __init__(self, mailbox, callback=None):
+        self.mailbox = mailbox
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id or str(len(self.requests))
+        self.requests.append((request, callback or self.callback, request_id))
+
+    def execute(self):
+        mailbox = self.mailbox
+        with mailbox.lock:
+            mailbox.calls["batch"] += 1
+        if mailbox.latency:
+            time.sleep(mailbox.latency)
+        for request, callback, request_id in self.requests:
+            with mailbox.lock:
+                mailbox.calls[request.method] += 1
+                try:
+                    response, error = request.func(), None
+                except HttpError as e:
+                    response, error = None, e
+            if callback:
+                callback(request_id, response, error)
+
+
+class _Messages:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def _req(self, method, func):
+        return FakeRequest(self.mailbox, method, func)
+
+    def list(self, userId, q="", maxResults=100, pageToken=None, **kwargs):
+        def run():
+            ids = self.mailbox.unread_ids() if "is:unread" in q else self.mailbox.order
+            # The token is the position after the last listed message, so
+            # messages marked read in between do not shift the next page
+            start = int(pageToken or 0)
+            remaining = [m for m in ids if self.mailbox.position[m] >= start]
+            page = remaining[:maxResults]
+            result = {
+                "messages": [
+                    {"id": m, "threadId": self.mailbox.messages[m]["threadId"]}
+                    for m in page
+                ],
+                "resultSizeEstimate": len(ids),
+            }
+            if len(remaining) > maxResults:
+                result["nextPageToken"] = str(self.mailbox.position[page[-1]] + 1)
+            return result
+
+        return self._req("messages.list", run)
+
+    def get(self, userId, id, format="full", metadataHeaders=None, **kwargs):
+        def run():
+            message = self.mailbox.messages.get(id)
+            if message is None:
+                raise HttpError(_Response(404), b'{"error": "notFound"}')
+            if format == "metadata":
+                wanted = {h.lower() for h in metadataHeaders or []}
+                headers = [
+                    h
+                    for h in message["payload"]["headers"]
+                    if not wanted or h["name"].lower() in wanted
+                ]
+                return {**message, "payload": {"headers": headers}}
+            return message
+
+        return self._req("messages.get", run)
+
+    def _modify(self, message_id, body):
+        message = self.mailbox.messages[message_id]
+        labels = [
+            l for l in message["labelIds"] if l not in body.get("removeLabelIds", [])
+        ]
+        labels += [l for l in body.get("addLabelIds", []) if l not in labels]
+        message["labelIds"] = labels
+        self.mailbox._record("labelsRemoved", message_id)
+        return message
+
+    def modify(self, userId, id, body):
+        return self._req("messages.modify", lambda: self._modify(id, body))
+
+    def batchModify(self, userId, body):
+        def run():
+            for message_id in body["ids"]:
+                self._modify(message_id, body)
+            return {}
+
+        return self._req("messages.batchModify", run)
+
+    def send(self, userId, body):
+        def run():
+            message_id = self.mailbox._new_id("s")
+            self.mailbox.messages[message_id] = {
+                "id": message_id,
+                "threadId": body.get("threadId") or message_id,
+                "labelIds": ["SENT"],
+                "raw": body["raw"],
+            }
+            self.mailbox.position[message_id] = len(self.mailbox.order)
+            self.mailbox.order.append(message_id)
+            self.mailbox._record("messagesAdded", message_id)
+            return {"id": message_id, "threadId": body.get("threadId")}
+
+        return self._req("messages.send", run)
+
+    def attachments(self):
+        mailbox = self.mailbox
+
+        class _Attachments:
+            def get(self, userId, messageId, id):
+                return FakeRequest(
+                    mailbox, "messages.attachments.get", lambda: {"data": "", "size": 0}
+                )
+
+        return _Attachments()
+
+
+class _Drafts:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def create(self, userId, body):
+        def run():
+            draft_id = self.mailbox._new_id("d")
+            self.mailbox.drafts[draft_id] = body["message"]
+            return {"id": draft_id, "message": {"id": draft_id}}
+
+        return FakeRequest(self.mailbox, "drafts.create", run)
+
+    def send(self, userId, body):
+        def run():
+            message = self.mailbox.drafts.pop(body["id"])
+            return _Messages(self.mailbox).send(userId, message).func()
+
+        return FakeRequest(self.mailbox, "drafts.send", run)
+
+
+class _Threads:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def get(self, userId, id, format="full", **kwargs):
+        def run():
+            messages = [
+                self.mailbox.messages[m]
+                for m in self.mailbox.order
+                if self.mailbox.messages[m]["threadId"] == id
+            ]
+            if not messages:
+                raise HttpError(_Response(404), b'{"error": "notFound"}')
+            return {"id": id, "messages": messages}
+
+        return FakeRequest(self.mailbox, "threads.get", run)
+
+
+class _History:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def list(
+        self,
+        userId,
+        startHistoryId,
+        pageToken=None,
+        maxResults=500,
+        historyTypes=None,
+        labelId=None,
+        **kwargs,
+    ):
+        # historyTypes values name the record keys in the singular
+        kinds = {
+            t.replace("message", "messages").replace("label", "labels")
+            for t in historyTypes or []
+        }
+
+        def run():
+            if int(startHistoryId) < self.mailbox.history_floor:
+                raise HttpError(_Response(404), b'{"error": "notFound"}')
+            changes = [
+                h
+                for h in self.mailbox.history
+                if int(h["id"]) > int(startHistoryId)
+                and (not kinds or kinds & h.keys())
+                and (
+                    labelId is None
+                    or any(
+                        labelId in c["message"]["labelIds"]
+                        for kind in h.keys() - {"id"}
+                        for c in h[kind]
+                    )
+                )
+            ]
+            start = int(pageToken or 0)
+            result = {
+                "history": changes[start : start + maxResults],
+                "historyId": str(self.mailbox.history_id),
+            }
+            if start + maxResults < len(changes):
+                result["nextPageToken"] = str(start + maxResults)
+            return result
+
+        return FakeRequest(self.mailbox, "history.list", run)
+
+
+class _Users:
+    def __init__(self, mailbox):
+        self.mailbox = mailbox
+
+    def messages(self):
+        return _Messages(self.mailbox)
+
+    def drafts(self):
+        return _Drafts(self.mailbox)
+
+    def threads(self):
+        return _Threads(self.mailbox)
+
+    def history(self):
+        return _History(self.mailbox)
+
+    def getProfile(self, userId):
+        return FakeRequest(
+            self.mailbox,
+            "getProfile",
+            lambda: {
+                "emailAddress": self.mailbox.address,
+                "historyId": str(self.mailbox.history_id),
+                "messagesTotal": len(self.mailbox.messages),
+            },
+        )
+
+    def watch(self, userId, body):
+        return FakeRequest(
+            self.mailbox,
+            "watch",
+            lambda: {
+                "historyId": str(self.mailbox.history_id),
+                "expiration": str(int(time.time() * 1000) + 7 * 86400 * 1000),
+            },
+        )
+
+
+class FakeGmailService:
+    """Drop-in for ``build("gmail", "v1", ...)`` backed by a FakeMailbox."""
+
+    def __init__(self, mailbox: FakeMailbox):
+        self.mailbox = mailbox
+
+    def users(self):
+        return _Users(self.mailbox)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self.mailbox, callback)
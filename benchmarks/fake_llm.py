@@ -0,0 +1,161 @@
+"""
+Fake OpenAI-compatible chat completions server.
+
+Answers ``POST /v1/chat/completions`` after a configurable latency, failing
+a configurable share of requests with HTTP 500. When the request offers
+tools (pydantic-ai structured results), the first tool is called with
+arguments filled in from its JSON schema, otherwise a short text is
+returned. Point ``OPENROUTER_BASE_URL`` at ``server.base_url`` to use it.
+
+Usage:
+    python -m benchmarks.fake_llm --port 8765 --latency 0.5 --error-rate 0.05
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Values for schema fields, by JSON type
+_DEFAULTS = {
+    "integer": 1,
+    "number": 1.0,
+    "boolean": False,
+    "string": "benchmark",
+    "array": [],
+    "object": {},
+}
+
+
+def fill_schema(schema: dict) -> dict:
+    """Build arguments matching the properties of a JSON schema."""
+    return {
+        name: prop.get("default", _DEFAULTS.get(prop.get("type"), None))
+        for name, prop in schema.get("properties", {}).items()
+    }
+
+
+class FakeLLMServer:
+    """Threaded HTTP server, usable as a context manager."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.prompt_chars = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with server.lock:
+                    server.requests += 1
+                    server.prompt_chars += sum(
+                        len(str(m.get("content") or ""))
+                        for m in request.get("messages", [])
+                    )
+                    fail = server.rng.random() < server.error_rate
+                    if fail:
+                        server.errors += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                if server.latency:
+                    time.sleep(server.latency)
+                with server.lock:
+                    server.in_flight -= 1
+                if fail:
+                    self._send(500, {"error": {"message": "Injected failure"}})
+                    return
+                self._send(200, completion(request))
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def completion(request: dict) -> dict:
+    """Build a chat completion answering ``request``."""
+    message = {"role": "assistant", "content": "Thanks for your message."}
+    tools = request.get("tools") or []
+    if tools:
+        function = tools[0]["function"]
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": "call_0",
+                    "type": "function",
+                    "function": {
+                        "name": function["name"],
+                        "arguments": json.dumps(
+                            fill_schema(function.get("parameters", {}))
+                        ),
+                    },
+                }
+            ],
+        }
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "fake"),
+        "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    with FakeLLMServer(
+        port=args.port, latency=args.latency, error_rate=args.error_rate
+    ) as server:
+        print(f"Serving on {server.base_url}")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Shared setup for the end-to-end benchmarks.
+
+The scenarios run the real EmailProcessor against a FakeMailbox, in a
+throwaway test database created from the configured one (SQLite, or
+Postgres when DATABASE_URL is set), and write their results as JSON for
+``benchmarks.compare``.
+
+Scenarios that decide responses take ``--nlp-backend`` to compare the NLP
+backends; for ``openrouter`` point OPENROUTER_BASE_URL at a
+``benchmarks.fake_llm`` server.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def setup_django(args=None):
+    if getattr(args, "nlp_backend", None):
+        os.environ["NLP_BACKEND"] = args.nlp_backend
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "casy.settings")
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    # Per-message logs would dominate the timings
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # The fake mailbox has no quota, measure the units used instead
+    os.environ.setdefault("GMAIL_MAILBOX_QUOTA_UNITS", "0")
+    # Everything runs in this process, without Redis
+    os.environ.setdefault("CACHE_URL", "locmem://")
+    import django
+
+    django.setup()
+
+
+@contextmanager
+def benchmark_database():
+    """Create a fresh test database for the duration of the block."""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+class QueryCounter:
+    """Count the SQL queries run through a connection."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    from django.db import connection
+
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+def make_processor(mailbox):
+    """An EmailProcessor talking to a FakeMailbox."""
+    from benchmarks.fake_gmail import FakeGmailService
+    from conversation.services.email_processor import EmailProcessor
+    from conversation.services.gmail_service import GmailService
+
+    return EmailProcessor(gmail=GmailService(service=FakeGmailService(mailbox)))
+
+
+def quota_units(mailbox) -> int:
+    from conversation.metrics import GMAIL_QUOTA_UNITS
+
+    return sum(
+        GMAIL_QUOTA_UNITS.get(method, 0) * count
+        for method, count in mailbox.calls.items()
+    )
+
+
+def distribution(values, prefix: str) -> dict:
+    """p50/p90/p99/max of a list of seconds, as flat result metrics."""
+    from conversation.tracing import percentile
+
+    values = sorted(values)
+    return {
+        f"{prefix}_p50_seconds": percentile(values, 50),
+        f"{prefix}_p90_seconds": percentile(values, 90),
+        f"{prefix}_p99_seconds": percentile(values, 99),
+        f"{prefix}_max_seconds": values[-1] if values else 0.0,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def write_result(scenario: str, params: dict, metrics: dict, output=None) -> Path:
+    """
+    Store a scenario result as JSON.
+
+    Metric names tell ``benchmarks.compare`` which direction is better:
+    ``*_per_second`` higher, ``*_seconds``, ``*_queries`` and ``*_units``
+    lower; anything else is informational.
+    """
+    from django.conf import settings
+    from django.db import connection
+
+    result = {
+        "scenario": scenario,
+        "params": params,
+        "nlp_backend": settings.NLP_BACKEND,
+        "metrics": metrics,
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "database": connection.vendor,
+        "python": platform.python_version(),
+    }
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        output = RESULTS_DIR / f"{scenario}-{stamp}.json"
+    output = Path(output)
+    output.write_text(json.dumps(result, indent=2))
+    return output
+
+
+def add_common_arguments(parser):
+    parser.add_argument(
+        "--gmail-latency",
+        type=float,
+        default=0.0,
+        help="Seconds added to each fake Gmail API request",
+    )
+    parser.add_argument("--output", help="Result file, default benchmarks/results/")
+    parser.add_argument("--json", action="store_true", help="Print raw JSON")
+
+
+def add_nlp_argument(parser):
+    parser.add_argument(
+        "--nlp-backend",
+        help="NLP backend deciding the responses, default NLP_BACKEND",
+    )
+
+
+def report(scenario: str, params: dict, metrics: dict, args):
+    path = write_result(scenario, params, metrics, args.output)
+    if args.json:
+        print(json.dumps(metrics, indent=2))
+        return metrics
+    for key, value in metrics.items():
+        print(
+            f"  {key:36} {value:.4f}"
+            if isinstance(value, float)
+            else f"  {key:36} {value}"
+        )
+    print(f"Result written to {path}")
+    return metrics
@@ -0,0 +1,109 @@
+"""
+Time latency decisions on conversations with long histories.
+
+Threads of ``--length`` messages are bulk-loaded, then the latest message of
+each is passed to ``HumanLatencyAgent.determine_latency``, which sends the
+whole history to a FakeLLMServer. Shows how prompt building and the LLM
+round trip grow with the length of a thread.
+
+Usage:
+    python -m benchmarks.long_threads --threads 20 --length 500 --llm-latency 0.2
+"""
+
+import argparse
+import os
+import time
+from datetime import timedelta
+
+from benchmarks.fake_llm import FakeLLMServer
+from benchmarks.harness import (
+    add_common_arguments,
+    benchmark_database,
+    count_queries,
+    distribution,
+    report,
+    setup_django,
+)
+
+
+def load_threads(threads: int, length: int):
+    """Create the conversations and return the latest message of each."""
+    from django.utils import timezone
+
+    from conversation.models import Contact, Conversation, Message
+
+    start = timezone.now() - timedelta(minutes=length)
+    latest = []
+    for thread in range(threads):
+        contact = Contact.objects.create(email=f"contact{thread}@example.com")
+        conversation = Conversation.objects.create(
+            contact=contact, thread_id=f"t{thread:06d}"
+        )
+        Message.objects.bulk_create(
+            [
+                Message(
+                    conversation=conversation,
+                    message_id=f"m{thread:06d}-{index:06d}",
+                    message_type="INCOMING" if index % 2 == 0 else "OUTGOING",
+                    subject="Long thread",
+                    content=f"Message {index} of the thread. " + "Some text. " * 20,
+                    timestamp=start + timedelta(minutes=index),
+                )
+                for index in range(length)
+            ],
+            batch_size=1000,
+        )
+        latest.append(conversation.messages.order_by("-timestamp").first())
+    return latest
+
+
+def run(threads: int, length: int, server: FakeLLMServer) -> dict:
+    from conversation.services.latency_determination import HumanLatencyAgent
+
+    messages = load_threads(threads, length)
+    agent = HumanLatencyAgent()
+    durations = []
+    with count_queries() as queries:
+        for message in messages:
+            start = time.perf_counter()
+            agent.determine_latency(message)
+            durations.append(time.perf_counter() - start)
+
+    return {
+        **distribution(durations, "decision"),
+        "decisions_per_second": len(durations) / sum(durations) if durations else 0.0,
+        "per_decision_queries": queries.count / max(len(durations), 1),
+        "prompt_chars_per_decision": server.prompt_chars // max(server.requests, 1),
+        "llm_requests": server.requests,
+        "llm_errors": server.errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--length", type=int, default=500, help="Messages per thread")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with FakeLLMServer(
+        latency=args.llm_latency, error_rate=args.llm_error_rate
+    ) as server:
+        # The agent's model reads its endpoint from settings at import time
+        os.environ["OPENROUTER_BASE_URL"] = server.base_url
+        setup_django()
+        with benchmark_database():
+            metrics = run(args.threads, args.length, server)
+            params = {
+                "threads": args.threads,
+                "length": args.length,
+                "llm_latency": args.llm_latency,
+                "llm_error_rate": args.llm_error_rate,
+            }
+            return report("long_threads", params, metrics, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Measure how much quoted-reply stripping saves on a synthetic thread corpus.
+
+Every synthetic reply quotes the whole thread below an attribution line and
+ends with a signature, the way most mail clients write them. The benchmark
+reports the stored bytes and approximate LLM prompt tokens with and without
+stripping, plus the throughput of both stripping implementations.
+
+Usage:
+    python -m benchmarks.quote_stripping --threads 200 --length 20
+"""
+
+import argparse
+import io
+import json
+import random
+import re
+import time
+
+from conversation.services.quote_stripping import (
+    iter_trimmed_lines,
+    strip_quoted_text,
+)
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+_SENTENCES = [
+    "Thanks for getting back to me so quickly.",
+    "Could we move the call to Thursday afternoon?",
+    "I have attached the figures we discussed last week.",
+    "Let me know if anything in the proposal is unclear.",
+    "The team is happy with the new timeline.",
+    "I will be travelling until Monday, so replies may be slow.",
+    "Can you confirm the delivery address for the samples?",
+]
+_SIGNATURES = [
+    "--\nAlex Martin\nHead of Partnerships",
+    "Sent from my iPhone",
+    "Best,\nSam\n\n-- \nSam Chen | +1 555 0100",
+]
+
+
+def count_tokens(text: str) -> int:
+    """Approximate the number of LLM tokens in a text."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def make_thread(length: int, rng: random.Random) -> list:
+    """Build the raw bodies of a thread where every reply quotes the history."""
+    bodies = []
+    history = ""
+    for index in range(length):
+        sender = "alex@example.com" if index % 2 else "sam@example.com"
+        text = " ".join(rng.sample(_SENTENCES, 3))
+        body = f"{text}\n\n{rng.choice(_SIGNATURES)}\n"
+        if history:
+            quoted = "\n".join(f"> {line}" for line in history.splitlines())
+            body += (
+                f"\nOn Mon, 3 Mar 2025 at 10:{index:02d}, {sender} wrote:\n{quoted}\n"
+            )
+        bodies.append(body)
+        history = body
+    return bodies
+
+
+def run(threads: int, length: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    corpus = [body for _ in range(threads) for body in make_thread(length, rng)]
+
+    start = time.perf_counter()
+    trimmed = [strip_quoted_text(body) for body in corpus]
+    regex_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    streamed = [
+        "\n".join(iter_trimmed_lines(io.StringIO(body))).strip() for body in corpus
+    ]
+    streaming_seconds = time.perf_counter() - start
+
+    raw_bytes = sum(len(body.encode("utf-8")) for body in corpus)
+    trimmed_bytes = sum(len(body.encode("utf-8")) for body in trimmed)
+    raw_tokens = sum(count_tokens(body) for body in corpus)
+    trimmed_tokens = sum(count_tokens(body) for body in trimmed)
+
+    return {
+        "messages": len(corpus),
+        "raw_bytes": raw_bytes,
+        "trimmed_bytes": trimmed_bytes,
+        "bytes_saved": raw_bytes - trimmed_bytes,
+        "bytes_saved_pct": round(100 * (raw_bytes - trimmed_bytes) / raw_bytes, 2),
+        "raw_tokens": raw_tokens,
+        "trimmed_tokens": trimmed_tokens,
+        "tokens_saved": raw_tokens - trimmed_tokens,
+        "tokens_saved_pct": round(100 * (raw_tokens - trimmed_tokens) / raw_tokens, 2),
+        "regex_messages_per_second": round(len(corpus) / regex_seconds),
+        "streaming_messages_per_second": round(len(corpus) / streaming_seconds),
+        "implementations_agree": trimmed == streamed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=200)
+    parser.add_argument("--length", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.threads, args.length, args.seed)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+
+    for key, value in results.items():
+        print(f"{key:32} {value}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
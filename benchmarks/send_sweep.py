@@ -0,0 +1,139 @@
+"""
+Sweep a large scheduled_message table for the messages due to be sent.
+
+``--rows`` scheduled messages are bulk-loaded, most of them sent, canceled or
+due in the future, and ``--due-fraction`` of them due now. Times the due
+query on its own (the partial index should keep it independent of the
+table size), then a full ``send_scheduled_messages`` sweep through a
+FakeMailbox.
+
+Usage:
+    python -m benchmarks.send_sweep --rows 1000000 --due-fraction 0.001
+"""
+
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from benchmarks.fake_gmail import FakeMailbox
+from benchmarks.harness import (
+    add_common_arguments,
+    benchmark_database,
+    count_queries,
+    make_processor,
+    quota_units,
+    report,
+    setup_django,
+)
+
+
+def load_rows(rows: int, due_fraction: float, conversations: int, batch_size=5000):
+    from django.utils import timezone
+
+    from conversation.models import Contact, Conversation, ScheduledMessage
+
+    now = timezone.now()
+    contacts = Contact.objects.bulk_create(
+        [Contact(email=f"contact{i}@example.com") for i in range(conversations)]
+    )
+    threads = Conversation.objects.bulk_create(
+        [
+            Conversation(contact=contact, thread_id=f"t{i:06d}")
+            for i, contact in enumerate(contacts)
+        ]
+    )
+    rng = random.Random(0)
+    due = 0
+    for offset in range(0, rows, batch_size):
+        batch = []
+        for index in range(offset, min(offset + batch_size, rows)):
+            roll = rng.random()
+            sent = canceled = False
+            if roll < due_fraction:
+                send_time = now - timedelta(seconds=rng.randint(1, 600))
+                due += 1
+            elif roll < 0.5:
+                send_time = now - timedelta(days=rng.randint(1, 365))
+                sent = True
+            elif roll < 0.6:
+                send_time = now - timedelta(days=rng.randint(1, 365))
+                canceled = True
+            else:
+                send_time = now + timedelta(minutes=rng.randint(1, 7 * 24 * 60))
+            batch.append(
+                ScheduledMessage(
+                    conversation=threads[index % conversations],
+                    draft_content="Thanks for your message.",
+                    draft_subject="Re: Hello",
+                    scheduled_send_time=send_time,
+                    sent=sent,
+                    canceled=canceled,
+                )
+            )
+        ScheduledMessage.objects.bulk_create(batch)
+    return due
+
+
+def run(rows: int, due_fraction: float, conversations: int, gmail_latency=0.0):
+    from django.db import connection
+
+    from conversation.models import ScheduledMessage
+
+    start = time.perf_counter()
+    due = load_rows(rows, due_fraction, conversations)
+    load_seconds = time.perf_counter() - start
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {ScheduledMessage._meta.db_table}")
+
+    mailbox = FakeMailbox(latency=gmail_latency)
+    processor = make_processor(mailbox)
+
+    start = time.perf_counter()
+    found = len(list(processor.due_scheduled_messages().iterator(chunk_size=500)))
+    due_query_seconds = time.perf_counter() - start
+
+    with count_queries() as queries:
+        start = time.perf_counter()
+        processor.send_scheduled_messages()
+        sweep_seconds = time.perf_counter() - start
+
+    sent = mailbox.calls["messages.send"]
+    return {
+        "load_seconds": load_seconds,
+        "due_query_seconds": due_query_seconds,
+        "sweep_seconds": sweep_seconds,
+        "sends_per_second": sent / sweep_seconds if sweep_seconds else 0.0,
+        "per_send_queries": queries.count / max(sent, 1),
+        "per_send_quota_units": quota_units(mailbox) / max(sent, 1),
+        "due_rows": due,
+        "due_found": found,
+        "sent": sent,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--due-fraction", type=float, default=0.001)
+    parser.add_argument("--conversations", type=int, default=1000)
+    add_common_arguments(parser)
+    args = parser.parse_args(argv)
+
+    setup_django()
+    with benchmark_database():
+        metrics = run(
+            args.rows, args.due_fraction, args.conversations, args.gmail_latency
+        )
+        params = {
+            "rows": args.rows,
+            "due_fraction": args.due_fraction,
+            "conversations": args.conversations,
+            "gmail_latency": args.gmail_latency,
+        }
+        return report("send_sweep", params, metrics, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Compare SQLite lock errors and commit latency under concurrent writers.
+
+Several processes run read-then-write transactions against the same file,
+the way the web process, Celery worker and beat do. The default profile
+(rollback journal, deferred transactions, 5 s timeout, as Django uses out of
+the box) is compared with the production profile from ``casy/db.py``
+(WAL, synchronous=NORMAL, BEGIN IMMEDIATE, longer busy timeout).
+
+Usage:
+    python -m benchmarks.sqlite_concurrency --writers 6 --transactions 300
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from casy.db import SQLITE_BUSY_TIMEOUT, SQLITE_PRAGMAS
+
+PROFILES = {
+    "default": {"pragmas": {}, "begin": "BEGIN", "timeout": 5},
+    "production": {
+        "pragmas": SQLITE_PRAGMAS,
+        "begin": "BEGIN IMMEDIATE",
+        "timeout": SQLITE_BUSY_TIMEOUT,
+    },
+}
+
+
+def connect(path, profile):
+    conn = sqlite3.connect(path, timeout=profile["timeout"], isolation_level=None)
+    for name, value in profile["pragmas"].items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def writer(path, profile_name, transactions, results):
+    profile = PROFILES[profile_name]
+    conn = connect(path, profile)
+    errors = 0
+    latencies = []
+    for index in range(transactions):
+        start = time.perf_counter()
+        try:
+            conn.execute(profile["begin"])
+            # Read first, like get_or_create, then write
+            conn.execute("SELECT COUNT(*) FROM message WHERE sent = 0").fetchone()
+            conn.execute(
+                "INSERT INTO message (body, sent) VALUES (?, 0)",
+                (f"body {os.getpid()} {index}" * 10,),
+            )
+            conn.execute("UPDATE message SET sent = 1 WHERE id = last_insert_rowid()")
+            conn.execute("COMMIT")
+            latencies.append(time.perf_counter() - start)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) and "busy" not in str(e):
+                raise
+            errors += 1
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+    conn.close()
+    results.put((errors, latencies))
+
+
+def run_profile(profile_name, writers, transactions):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.sqlite3")
+        conn = connect(path, PROFILES[profile_name])
+        conn.execute(
+            "CREATE TABLE message (id INTEGER PRIMARY KEY, body TEXT, sent INTEGER)"
+        )
+        conn.close()
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=writer, args=(path, profile_name, transactions, results)
+            )
+            for _ in range(writers)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+    errors = sum(e for e, _ in collected)
+    latencies = sorted(l for _, ls in collected for l in ls)
+    return {
+        "lock_errors": errors,
+        "commits": len(latencies),
+        "commits_per_second": round(len(latencies) / elapsed),
+        "commit_p50_ms": round(1000 * statistics.median(latencies), 2),
+        "commit_p99_ms": round(1000 * latencies[int(len(latencies) * 0.99) - 1], 2),
+    }
+
+
+def run(writers: int, transactions: int) -> dict:
+    return {name: run_profile(name, writers, transactions) for name in PROFILES.keys()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, default=6)
+    parser.add_argument("--transactions", type=int, default=300)
+    parser.add_argument("--json", action="store_true", help="Print raw JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args.writers, args.transactions)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+
+    for name, result in results.items():
+        print(name)
+        for key, value in result.items():
+            print(f"  {key:20} {value}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Run the ingest and send cycle against a steady stream of new mail.
+
+Each tick delivers ``--rate`` new messages, then runs one ingest pass and
+one send sweep, as the beat schedule does. Responses are scheduled with no
+latency so every tick also sends the replies to the previous one. Reports
+the distribution of the cycle time per tick.
+
+Usage:
+    python -m benchmarks.steady_stream --ticks 60 --rate 20 --gmail-latency 0.005
+"""
+
+import argparse
+import random
+import time
+from dataclasses import replace
+
+from benchmarks.fake_gmail import FakeMailbox
+from benchmarks.harness import (
+    add_common_arguments,
+    add_nlp_argument,
+    benchmark_database,
+    count_queries,
+    distribution,
+    make_processor,
+    quota_units,
+    report,
+    setup_django,
+)
+
+
+def immediate_nlp():
+    """The configured NLP backend, answering without delay."""
+    from conversation.services.nlp_service import NLPBackend, get_backend
+
+    class ImmediateBackend(NLPBackend):
+        def __init__(self, backend):
+            self.backend = backend
+            self.name = backend.name
+
+        def decide(self, message):
+            return replace(self.backend.decide(message), latency_minutes=0)
+
+    return ImmediateBackend(get_backend())
+
+
+def run(ticks: int, rate: int, threads: int, gmail_latency: float = 0.0) -> dict:
+    from conversation.models import Message
+
+    random.seed(0)
+    mailbox = FakeMailbox(latency=gmail_latency)
+    processor = make_processor(mailbox)
+    processor.nlp = immediate_nlp()
+
+    cycles = []
+    sent = 0
+    with count_queries() as queries:
+        for tick in range(ticks):
+            for index in range(rate):
+                thread = (tick * rate + index) % threads
+                mailbox.add_unread(
+                    thread_id=f"t{thread:06d}",
+                    sender=f"contact{thread}@example.com",
+                    body=f"Tick {tick}, message {index}.",
+                )
+            start = time.perf_counter()
+            processor.process_new_emails()
+            processor.send_scheduled_messages()
+            cycles.append(time.perf_counter() - start)
+        sent = Message.objects.filter(message_type="OUTGOING").count()
+
+    received = ticks * rate
+    return {
+        **distribution(cycles, "cycle"),
+        "messages_per_second": received / sum(cycles) if cycles else 0.0,
+        "sent_messages": sent,
+        "per_message_queries": queries.count / max(received, 1),
+        "per_message_quota_units": quota_units(mailbox) / max(received, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ticks", type=int, default=60)
+    parser.add_argument("--rate", type=int, default=20, help="Messages per tick")
+    parser.add_argument("--threads", type=int, default=200)
+    add_common_arguments(parser)
+    add_nlp_argument(parser)
+    args = parser.parse_args(argv)
+
+    setup_django(args)
+    with benchmark_database():
+        metrics = run(args.ticks, args.rate, args.threads, args.gmail_latency)
+        params = {
+            "ticks": args.ticks,
+            "rate": args.rate,
+            "threads": args.threads,
+            "gmail_latency": args.gmail_latency,
+        }
+        return report("steady_stream", params, metrics, args)
+
+
+if __name__ == "__main__":
+    main()
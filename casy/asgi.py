@@ -3,6 +3,9 @@ ASGI config for casy project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The /events live feed streams for as long as clients stay connected, so it
+must be served by an ASGI server (uvicorn, daphne...), not through WSGI.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
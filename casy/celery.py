@@ -0,0 +1,24 @@
+import os
+
+from celery import Celery
+from celery.signals import worker_init
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "casy.settings")
+
+app = Celery("casy")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
+
+
+@worker_init.connect
+def refuse_local_cache(**kwargs):
+    """Stop a worker whose locks and quota budgets would not be shared"""
+    from django.core.exceptions import ImproperlyConfigured
+
+    from conversation.locks import require_shared_cache
+
+    try:
+        require_shared_cache()
+    except ImproperlyConfigured as e:
+        # Exceptions of signal handlers are only logged
+        raise SystemExit(f"Not starting the worker: {e}")
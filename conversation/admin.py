@@ -1,3 +1,212 @@
-from django.contrib import admin
+# conversation/admin.py
+"""
+Admin of the live tables, built to stay fast on tables of millions of rows.
 
-# Register your models here.
+- Change lists never run an unbounded ``COUNT(*)``: ``EstimatedCountPaginator``
+  reads the planner's estimate for a whole table and counts at most
+  ``exact_count_limit`` rows of a filtered list.
+- Related rows shown in a list (and used by ``__str__``) are joined with
+  ``list_select_related``, and foreign keys are edited by ID.
+- Filters are on indexed columns, and message search uses the full-text
+  index instead of a ``LIKE`` over compressed bodies. It lists the
+  ``search_limit`` best matches and warns when more were left out.
+- Scheduled messages are canceled or rescheduled in bulk with one UPDATE.
+"""
+
+from datetime import timedelta
+
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import F, Subquery
+from django.db.models.functions import Now
+from django.utils.functional import cached_property
+from django.utils.translation import ngettext
+
+from .models import Contact, Conversation, Mailbox, Message, ScheduledMessage
+from .services.search import get_search_backend
+
+
+def estimated_count(queryset):
+    """Approximate number of rows of a model's table, None if unknown"""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table]
+            )
+            row = cursor.fetchone()
+        # -1 until the table is first analyzed
+        return row[0] if row and row[0] >= 0 else None
+    if connection.vendor == "sqlite":
+        # Row counts are only recorded by ANALYZE (or PRAGMA optimize)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                "AND name = 'sqlite_stat1'"
+            )
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+            row = cursor.fetchone()
+        # "<rows> <rows per key>...", the first number is the table's row count
+        return int(row[0].split()[0]) if row else None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator whose count never scans a large table.
+
+    An unfiltered list uses the table estimate once it is above
+    ``exact_count_limit``. Other lists are counted up to the limit, so past
+    it the last pages are not reachable; filter further instead.
+    """
+
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None and estimate > self.exact_count_limit:
+                return estimate
+        return queryset[: self.exact_count_limit].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Do not count the whole table next to the filtered count
+    show_full_result_count = False
+    list_per_page = 100
+
+
+@admin.register(Contact)
+class ContactAdmin(LargeTableAdmin):
+    list_display = ["email", "name", "created_at", "last_contact"]
+    search_fields = ["=email"]
+
+
+@admin.register(Mailbox)
+class MailboxAdmin(admin.ModelAdmin):
+    list_display = ["email_address", "active", "last_synced", "watch_expiration"]
+    list_filter = ["active"]
+    exclude = ["token_json"]
+
+
+@admin.register(Conversation)
+class ConversationAdmin(LargeTableAdmin):
+    list_display = ["__str__", "thread_id", "mailbox", "last_updated", "hydrated_at"]
+    list_select_related = ["contact", "mailbox"]
+    raw_id_fields = ["contact", "mailbox"]
+    search_fields = ["=thread_id", "=contact__email"]
+
+
+@admin.register(Message)
+class MessageAdmin(LargeTableAdmin):
+    list_display = [
+        "message_id",
+        "conversation_id",
+        "message_type",
+        "subject",
+        "timestamp",
+    ]
+    list_filter = ["message_type"]
+    raw_id_fields = ["conversation"]
+    # Subject and content are matched by the full-text index
+    search_fields = ["subject"]
+    search_help_text = "Full-text search of the subject and content"
+    search_limit = 1000
+
+    def get_queryset(self, request):
+        # Bodies are only decompressed on the change page
+        return super().get_queryset(request).defer("content", "raw_content")
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        ranked = get_search_backend(queryset.db).search(
+            search_term, self.search_limit, 0
+        )
+        if len(ranked) >= self.search_limit:
+            self.message_user(
+                request,
+                f"Only the {self.search_limit} best matches are listed, "
+                "refine the search to see the others.",
+                messages.WARNING,
+            )
+        return queryset.filter(pk__in=[pk for pk, _ in ranked]), False
+
+
+@admin.register(ScheduledMessage)
+class ScheduledMessageAdmin(LargeTableAdmin):
+    list_display = [
+        "__str__",
+        "draft_subject",
+        "scheduled_send_time",
+        "created_at",
+        "sent",
+        "canceled",
+    ]
+    list_filter = ["sent", "canceled"]
+    list_select_related = ["conversation__contact"]
+    raw_id_fields = ["conversation"]
+    search_fields = ["=conversation__thread_id", "=conversation__contact__email"]
+    actions = ["cancel", "send_now", "postpone_hour", "postpone_day"]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer("draft_content")
+
+    def _update_pending(self, request, queryset, message, **values):
+        """Update the pending messages of ``queryset`` in one query"""
+        pending = queryset.filter(sent=False, canceled=False)
+        with transaction.atomic():
+            # Touch the conversations so API clients see the change
+            Conversation.objects.filter(
+                pk__in=Subquery(pending.values("conversation_id"))
+            ).update(last_updated=Now())
+            count = pending.update(**values, last_updated=Now())
+        self.message_user(
+            request,
+            ngettext(message[0], message[1], count) % {"count": count},
+            messages.SUCCESS,
+        )
+
+    @admin.action(description="Cancel selected pending messages")
+    def cancel(self, request, queryset):
+        self._update_pending(
+            request,
+            queryset,
+            ("%(count)d message canceled.", "%(count)d messages canceled."),
+            canceled=True,
+        )
+
+    @admin.action(description="Send selected pending messages now")
+    def send_now(self, request, queryset):
+        self._update_pending(
+            request,
+            queryset,
+            (
+                "%(count)d message will be sent now.",
+                "%(count)d messages will be sent now.",
+            ),
+            scheduled_send_time=Now(),
+        )
+
+    def _postpone(self, request, queryset, delta):
+        self._update_pending(
+            request,
+            queryset,
+            ("%(count)d message postponed.", "%(count)d messages postponed."),
+            scheduled_send_time=F("scheduled_send_time") + delta,
+        )
+
+    @admin.action(description="Postpone selected pending messages by an hour")
+    def postpone_hour(self, request, queryset):
+        self._postpone(request, queryset, timedelta(hours=1))
+
+    @admin.action(description="Postpone selected pending messages by a day")
+    def postpone_day(self, request, queryset):
+        self._postpone(request, queryset, timedelta(days=1))
@@ -0,0 +1,169 @@
+# conversation/api.py
+"""
+Read-only API for dashboards, under /api/.
+
+- ``contacts/``
+- ``conversations/``, most recently updated first
+- ``messages/``, ``?conversation=<id>`` for the messages of a conversation
+- ``schedule/``, the pending scheduled messages, next due first
+
+Lists are paginated with cursors, so a page is a range scan from the last
+row of the previous one and never an OFFSET. ``?fields=id,subject`` keeps
+only the given fields, and only their columns are loaded, related rows
+included with a join.
+
+Responses carry an ETag built from the latest ``Conversation.last_updated``,
+which is touched whenever a message is stored in a conversation or one of
+its scheduled messages is created, sent or canceled, and from the time of
+the last archiving, which removes rows. Pollers sending it back in
+``If-None-Match`` get a 304 from one read of the end of an index, without
+the rows being read or serialized.
+"""
+
+import hashlib
+
+from django.db.models import Max
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from .models import Contact, Conversation, Message, ScheduledMessage
+from .services.archive import last_archived
+from .serializers import (
+    ContactSerializer,
+    ConversationSerializer,
+    MessageSerializer,
+    ScheduledMessageSerializer,
+)
+
+
+def cursor_pagination(*ordering):
+    """A cursor pagination class ordered by ``ordering``"""
+    return type(
+        "CursorPagination",
+        (CursorPagination,),
+        {
+            "ordering": ordering,
+            "page_size_query_param": "page_size",
+            "max_page_size": 1000,
+        },
+    )
+
+
+class ReadOnlyViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Loads only the columns of the requested fields and answers 304s.
+
+    Subclasses return from ``version`` what changes whenever the response
+    would, or None to always answer in full.
+    """
+
+    lookup_value_regex = r"\d+"
+
+    def get_queryset(self):
+        columns = self.get_serializer_class().columns(self.request)
+        # The ordering columns are read to build the next cursor
+        ordering = [name.lstrip("-") for name in self.pagination_class.ordering]
+        columns += [name for name in ordering if name not in columns]
+        related = {column.rsplit("__", 1)[0] for column in columns if "__" in column}
+        return super().get_queryset().select_related(*sorted(related)).only(*columns)
+
+    def version(self):
+        return None
+
+    def etag(self):
+        version = self.version()
+        if version is None:
+            return None
+        digest = hashlib.sha1(
+            f"{version!r}\0{self.request.get_full_path()}".encode("utf-8")
+        ).hexdigest()
+        return quote_etag(digest)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, "_etag", None) and response.status_code in (200, 304):
+            response["ETag"] = self._etag
+        return response
+
+    def dispatch_conditional(self, handler, request, *args, **kwargs):
+        self._etag = self.etag()
+        if self._etag and self._etag in parse_etags(
+            request.headers.get("If-None-Match", "")
+        ):
+            return Response(status=304)
+        return handler(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self.dispatch_conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.dispatch_conditional(super().retrieve, request, *args, **kwargs)
+
+
+def conversations_version(queryset=None):
+    """Latest conversation update, changed by any new message or schedule"""
+    queryset = Conversation.objects.all() if queryset is None else queryset
+    # A single MAX is read from the end of the last_updated index
+    updated = queryset.aggregate(updated=Max("last_updated"))["updated"]
+    return updated, last_archived()
+
+
+class ContactViewSet(ReadOnlyViewSet):
+    queryset = Contact.objects.all()
+    serializer_class = ContactSerializer
+    pagination_class = cursor_pagination("id")
+
+    def version(self):
+        # Saving a contact, new ones included, sets last_contact
+        return Contact.objects.aggregate(updated=Max("last_contact"))["updated"]
+
+
+class ConversationViewSet(ReadOnlyViewSet):
+    queryset = Conversation.objects.all()
+    serializer_class = ConversationSerializer
+    pagination_class = cursor_pagination("-last_updated", "-id")
+
+    def version(self):
+        if "pk" in self.kwargs:
+            return conversations_version(
+                Conversation.objects.filter(pk=self.kwargs["pk"])
+            )
+        return conversations_version()
+
+
+class MessageViewSet(ReadOnlyViewSet):
+    queryset = Message.objects.all()
+    serializer_class = MessageSerializer
+    # Stored order, as timestamps can be missing
+    pagination_class = cursor_pagination("id")
+
+    def conversation_id(self):
+        value = self.request.query_params.get("conversation")
+        if value is not None and not value.isdigit():
+            raise ValidationError({"conversation": "Expected a conversation ID"})
+        return value and int(value)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.conversation_id() is not None:
+            queryset = queryset.filter(conversation_id=self.conversation_id())
+        return queryset
+
+    def version(self):
+        if self.conversation_id() is not None:
+            return conversations_version(
+                Conversation.objects.filter(pk=self.conversation_id())
+            )
+        return conversations_version()
+
+
+class ScheduleViewSet(ReadOnlyViewSet):
+    queryset = ScheduledMessage.objects.filter(sent=False, canceled=False)
+    serializer_class = ScheduledMessageSerializer
+    pagination_class = cursor_pagination("scheduled_send_time", "id")
+
+    def version(self):
+        return conversations_version()
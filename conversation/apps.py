@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ConversationConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "conversation"
+
+    def ready(self):
+        from . import signals
+
+        signals.connect_migrate_signals(self)
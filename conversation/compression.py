@@ -0,0 +1,142 @@
+# conversation/compression.py
+"""
+Codecs used by ``CompressedTextField``.
+
+Every stored value starts with a one-byte tag naming its codec, so rows
+written with different codecs or dictionaries can be read side by side and
+recompressed at any time:
+
+- ``\\x00`` raw UTF-8, used for short values where compression does not pay
+- ``z`` zlib
+- ``Z`` zstd, optionally with a trained dictionary whose ID is recorded in
+  the zstd frame header
+
+Only one dictionary is used for writing (``COMPRESSION_DICTIONARY_ID``),
+shared by every mailbox. It is trained on bodies from all mailboxes, so its
+file holds fragments of their mail and should be protected like the
+database. Mailboxes with very different mail compress less well than they
+would with their own dictionary. Per-mailbox dictionaries would need the
+mailbox of each row when compressing, which the field does not have.
+"""
+
+import threading
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # zlib is always available
+    zstandard = None
+
+RAW = b"\x00"
+ZLIB = b"z"
+ZSTD = b"Z"
+
+# Values shorter than this (in bytes) are stored uncompressed
+MIN_COMPRESS_SIZE = 64
+
+_local = threading.local()
+
+
+def compress_text(
+    text: str,
+    codec: str = "zstd",
+    level: int = 3,
+    dictionary: Optional["zstandard.ZstdCompressionDict"] = None,
+) -> bytes:
+    """
+    Compress a string into a tagged byte string.
+
+    Args:
+        text: The text to compress.
+        codec: "zstd" or "zlib". zstd falls back to zlib if the zstandard
+            package is not installed.
+        level: Compression level for the codec.
+        dictionary: Optional trained zstd dictionary.
+
+    Returns:
+        The codec tag followed by the compressed data.
+    """
+    data = text.encode("utf-8")
+    if len(data) < MIN_COMPRESS_SIZE:
+        return RAW + data
+
+    if codec == "zstd" and zstandard is not None:
+        compressed = ZSTD + _zstd_compressor(level, dictionary).compress(data)
+    else:
+        compressed = ZLIB + zlib.compress(data, level)
+
+    # Incompressible text is cheaper to read back raw
+    if len(compressed) >= len(data) + 1:
+        return RAW + data
+    return compressed
+
+
+def decompress_text(value: bytes, dictionaries: Optional[dict] = None) -> str:
+    """
+    Decompress a tagged byte string written by ``compress_text``.
+
+    Args:
+        value: The stored bytes.
+        dictionaries: Mapping of zstd dictionary ID to dictionary, used for
+            values compressed with a dictionary.
+
+    Returns:
+        The original text.
+    """
+    value = bytes(value)
+    if not value:
+        return ""
+
+    tag, data = value[:1], value[1:]
+    if tag == RAW:
+        return data.decode("utf-8")
+    if tag == ZLIB:
+        return zlib.decompress(data).decode("utf-8")
+    if tag == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("The zstandard package is needed to read this value")
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        dictionary = (dictionaries or {}).get(dict_id) if dict_id else None
+        if dict_id and dictionary is None:
+            raise LookupError(f"zstd dictionary {dict_id} is not available")
+        return _zstd_decompressor(dictionary).decompress(data).decode("utf-8")
+    raise ValueError(f"Unknown compression tag {tag!r}")
+
+
+def train_dictionary(samples, size: int = 112640) -> "zstandard.ZstdCompressionDict":
+    """Train a zstd dictionary from an iterable of sample strings."""
+    if zstandard is None:
+        raise RuntimeError("The zstandard package is needed to train dictionaries")
+    return zstandard.train_dictionary(size, [s.encode("utf-8") for s in samples])
+
+
+@lru_cache(maxsize=None)
+def load_dictionaries(directory: str) -> dict:
+    """Load every ``<id>.zdict`` file of a directory, keyed by dictionary ID."""
+    dictionaries = {}
+    if zstandard is None or not directory:
+        return dictionaries
+    for path in Path(directory).glob("*.zdict"):
+        dictionary = zstandard.ZstdCompressionDict(path.read_bytes())
+        dictionaries[dictionary.dict_id()] = dictionary
+    return dictionaries
+
+
+def _zstd_compressor(level, dictionary):
+    # Compressor objects are not thread safe, keep one per thread
+    cache = _local.__dict__.setdefault("compressors", {})
+    key = (level, dictionary.dict_id() if dictionary else 0)
+    if key not in cache:
+        cache[key] = zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+    return cache[key]
+
+
+def _zstd_decompressor(dictionary):
+    cache = _local.__dict__.setdefault("decompressors", {})
+    key = dictionary.dict_id() if dictionary else 0
+    if key not in cache:
+        cache[key] = zstandard.ZstdDecompressor(dict_data=dictionary)
+    return cache[key]
@@ -0,0 +1,158 @@
+# conversation/events.py
+"""
+Live feed of pipeline events, served as Server-Sent Events on /events.
+
+Pipeline stages ``publish`` small JSON events (a mail received, a reply
+scheduled, sent or canceled) once the rows they describe are committed.
+With ``REDIS_URL`` they go to the Redis channel ``LIVE_FEED_CHANNEL``, so
+events of every worker reach every web process; without it they are
+broadcast within the process, which is only enough in development when
+mail is processed by the web process.
+
+Each web process holds a single Redis subscription, whatever the number of
+viewers, and fans the events out to its subscribers. A subscriber has a
+buffer of ``LIVE_FEED_BUFFER`` events: when a slow client lets it fill up
+the oldest events are dropped and counted, so publishers never wait for
+viewers and viewers never query the database.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_redis = {"client": None}
+
+
+def publish(kind: str, **data):
+    """
+    Publish an event of type ``kind`` to the live feed.
+
+    Never raises: the feed is best effort and must not break the pipeline.
+    """
+    event = json.dumps(
+        {"type": kind, "time": timezone.now(), **data}, cls=DjangoJSONEncoder
+    )
+    try:
+        if settings.REDIS_URL:
+            _redis_client().publish(settings.LIVE_FEED_CHANNEL, event)
+        else:
+            hub.dispatch(event)
+    except Exception:
+        logger.warning("Could not publish %s event", kind, exc_info=True)
+
+
+def publish_on_commit(kind: str, **data):
+    """
+    Publish an event once the current transaction commits, so viewers never
+    hear of rows that are rolled back or not yet visible. Outside a
+    transaction it is published at once.
+    """
+    transaction.on_commit(lambda: publish(kind, **data))
+
+
+def _redis_client():
+    if _redis["client"] is None:
+        import redis
+
+        _redis["client"] = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis["client"]
+
+
+class Subscription:
+    """Events waiting for one client, at most ``size``, oldest dropped first"""
+
+    def __init__(self, size: int):
+        self.loop = asyncio.get_running_loop()
+        self.events = deque(maxlen=size)
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def put(self, event: str):
+        """Add an event, from the thread of the subscription's loop"""
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+        self.ready.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Tuple[List[str], int]:
+        """
+        Wait for events, returning them with the number dropped since the
+        last call. Returns nothing if ``timeout`` passes first.
+        """
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return [], 0
+        self.ready.clear()
+        events, dropped = list(self.events), self.dropped
+        self.events.clear()
+        self.dropped = 0
+        return events, dropped
+
+
+class Hub:
+    """Subscribers of this process, and its Redis subscription"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._listener = None
+
+    def subscribe(self, size: Optional[int] = None) -> Subscription:
+        """Subscribe from a coroutine, starting the Redis listener if needed"""
+        subscription = Subscription(size or settings.LIVE_FEED_BUFFER)
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if settings.REDIS_URL and (self._listener is None or self._listener.done()):
+                self._listener = subscription.loop.create_task(self._listen())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+            if not self._subscriptions and self._listener is not None:
+                self._listener.cancel()
+                self._listener = None
+
+    def dispatch(self, event: str):
+        """Hand an event to every subscriber, from any thread"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The loop of a disconnected client is closed
+                self.unsubscribe(subscription)
+
+    async def _listen(self):
+        import redis.asyncio
+
+        while True:
+            client = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(settings.LIVE_FEED_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.dispatch(message["data"].decode("utf-8"))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("Live feed subscription lost", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+hub = Hub()
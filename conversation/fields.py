@@ -0,0 +1,84 @@
+# conversation/fields.py
+from django import forms
+from django.conf import settings
+from django.db import models
+
+from .compression import compress_text, decompress_text, load_dictionaries
+
+
+def compression_options() -> dict:
+    """Codec settings used when writing compressed text."""
+    dictionaries = load_dictionaries(
+        str(getattr(settings, "COMPRESSION_DICTIONARY_DIR", "") or "")
+    )
+    return {
+        "codec": getattr(settings, "CONTENT_COMPRESSION", "zstd"),
+        "level": getattr(settings, "CONTENT_COMPRESSION_LEVEL", 3),
+        "dictionary": dictionaries.get(
+            getattr(settings, "COMPRESSION_DICTIONARY_ID", None)
+        ),
+    }
+
+
+def decompress(value) -> str:
+    dictionaries = load_dictionaries(
+        str(getattr(settings, "COMPRESSION_DICTIONARY_DIR", "") or "")
+    )
+    return decompress_text(value, dictionaries)
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    A text field stored compressed in a binary column.
+
+    Values are plain strings in Python and are compressed on write and
+    decompressed on read. Lookups on the content (``icontains``...) are not
+    supported, use the full-text search index instead.
+    """
+
+    description = "Compressed text"
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("editable", True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs.pop("editable", None)
+        return name, path, args, kwargs
+
+    def _check_str_default_value(self):
+        # Defaults are text, unlike a plain BinaryField
+        return []
+
+    def get_default(self):
+        default = super().get_default()
+        if isinstance(default, (bytes, memoryview)):
+            return decompress(default) if default else ""
+        return default
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return decompress(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return decompress(value)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        if isinstance(value, (bytes, memoryview)):
+            # Already compressed, e.g. when copying rows between tables
+            return bytes(value)
+        return compress_text(str(value), **compression_options())
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(
+            self, **{"form_class": forms.CharField, "widget": forms.Textarea, **kwargs}
+        )
@@ -0,0 +1,77 @@
+# conversation/locks.py
+"""
+Locks shared between worker processes, kept in the Django cache.
+
+With Redis (the default, see CACHE_URL) a lock is taken with ``SET NX`` and
+released by a script deleting it only if it still holds the holder's token,
+so neither step can race with another worker. Locks expire after their
+timeout so a crashed worker cannot hold one forever.
+
+The local memory cache (``CACHE_URL=locmem://``) only shares locks within a
+process: Celery workers refuse to start with it (see casy/celery.py).
+"""
+
+import uuid
+from contextlib import contextmanager
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+
+# Deletes KEYS[1] only if it still holds the token ARGV[1]
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def require_shared_cache():
+    """
+    Check that the default cache is shared by every process.
+
+    Raises:
+        ImproperlyConfigured: The cache is local to this process.
+    """
+    if isinstance(caches["default"], (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(
+            "Locks and quota budgets need a cache shared by all workers, "
+            "set CACHE_URL or REDIS_URL to a Redis server"
+        )
+
+
+def _redis_client():
+    """Redis client of the default cache, None for other backends"""
+    backend = caches["default"]
+    if isinstance(backend, RedisCache):
+        return backend._cache.get_client(write=True)
+    return None
+
+
+@contextmanager
+def singleton(name: str, timeout: int = 600):
+    """
+    Hold the lock ``name`` for the duration of the block.
+
+    Yields True if the lock was acquired, False if another holder has it.
+    """
+    key = f"lock:{name}"
+    token = uuid.uuid4().hex
+    client = _redis_client()
+    if client is None:
+        acquired = cache.add(key, token, timeout)
+    else:
+        key = cache.make_and_validate_key(key)
+        acquired = bool(client.set(key, token, nx=True, ex=timeout))
+    try:
+        yield acquired
+    finally:
+        # Do not release a lock taken by someone else after ours expired
+        if acquired and client is not None:
+            client.eval(RELEASE_SCRIPT, 1, key, token)
+        elif acquired and cache.get(key) == token:
+            # No other process shares a local cache
+            cache.delete(key)
@@ -0,0 +1,98 @@
+# conversation/log.py
+"""
+Logging helpers on top of the standard ``logging`` module.
+
+Log calls use ``%s`` arguments so nothing is formatted unless the record is
+emitted. Arguments that may be large or personal (bodies, LLM output,
+message dicts) are wrapped in ``trunc`` or ``fields``, which defer the work
+until formatting and cap its size.
+
+Correlation IDs (Gmail message ID, thread ID...) are bound for the duration
+of a stage with ``log_context`` and added to every record by
+``ContextFilter``, for the text and JSON formats configured in settings.
+"""
+
+import contextvars
+import json
+import logging
+from contextlib import contextmanager
+
+_context = contextvars.ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**ids):
+    """Add correlation IDs to the records logged inside the block."""
+    token = _context.set({**_context.get(), **ids})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind(**ids):
+    """Add correlation IDs until the enclosing ``log_context`` exits."""
+    _context.set({**_context.get(), **ids})
+
+
+def get_context() -> dict:
+    return dict(_context.get())
+
+
+class trunc:
+    """Log argument rendering ``value`` cut to ``limit`` characters."""
+
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = 80):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else repr(self.value)
+        text = text.replace("\n", "\\n")
+        if len(text) <= self.limit:
+            return text
+        return f"{text[: self.limit]}...[{len(text)} chars]"
+
+
+class fields:
+    """Log argument rendering selected keys of a dict, each truncated."""
+
+    __slots__ = ("data", "keys", "limit")
+
+    def __init__(self, data: dict, *keys: str, limit: int = 40):
+        self.data = data
+        self.keys = keys
+        self.limit = limit
+
+    def __str__(self):
+        return " ".join(
+            f"{key}={trunc(self.data.get(key), self.limit)}" for key in self.keys
+        )
+
+
+class ContextFilter(logging.Filter):
+    """Attach the bound correlation IDs to each record as ``record.context``."""
+
+    def filter(self, record):
+        context = _context.get()
+        record.context_ids = context
+        record.context = " ".join(f"{k}={v}" for k, v in context.items())
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, with the correlation IDs as keys."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **getattr(record, "context_ids", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
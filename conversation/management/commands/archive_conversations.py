@@ -0,0 +1,39 @@
+# conversation/management/commands/archive_conversations.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from conversation.services.archive import archive_idle_conversations
+
+
+class Command(BaseCommand):
+    help = "Move idle conversations out of the live tables into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.ARCHIVE_AFTER_DAYS,
+            help="Archive conversations idle for at least this many days",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Number of conversations moved per transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the conversations that would be archived",
+        )
+
+    def handle(self, *args, **options):
+        count = archive_idle_conversations(
+            options["days"],
+            chunk_size=options["chunk_size"],
+            dry_run=options["dry_run"],
+        )
+
+        if options["dry_run"]:
+            self.stdout.write(f"{count} conversations would be archived.")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Archived {count} conversations."))
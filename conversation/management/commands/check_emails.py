@@ -1,18 +1,119 @@
 # conversation/management/commands/check_emails.py
-from django.core.management.base import BaseCommand
+import signal
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from conversation.models import Mailbox
+from conversation.profiling import profile
+from conversation.services.daemon import EmailDaemon
 from conversation.services.email_processor import EmailProcessor
 
 
 class Command(BaseCommand):
     help = "Manually check for new emails and process them"
 
-    def handle(self, *args, **kwargs):
-        processor = EmailProcessor()
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mailbox",
+            help="Address of the mailbox to check, default all active mailboxes",
+        )
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Write a cProfile dump and a query log of the run to PROFILE_DIR",
+        )
+        parser.add_argument(
+            "--daemon",
+            action="store_true",
+            help="Keep running, polling adaptively until SIGTERM",
+        )
+        parser.add_argument(
+            "--min-interval",
+            type=float,
+            default=settings.DAEMON_MIN_INTERVAL,
+            help="Seconds between passes while mail is arriving",
+        )
+        parser.add_argument(
+            "--max-interval",
+            type=float,
+            default=settings.DAEMON_MAX_INTERVAL,
+            help="Longest wait between passes when idle",
+        )
+        parser.add_argument(
+            "--heartbeat-file",
+            default=str(settings.DAEMON_HEARTBEAT_FILE),
+            help="JSON file updated after every pass of the daemon",
+        )
+
+    def handle(self, *args, **options):
+        if options["daemon"]:
+            if options["profile"]:
+                raise CommandError("--profile profiles a single run, not --daemon")
+            self.run_daemon(options)
+            return
+
+        with profile("check_emails") if options["profile"] else nullcontext() as run:
+            for mailbox in self.mailboxes(options["mailbox"]):
+                self.process(mailbox)
+        if run is not None:
+            self.report(run)
+
+    def mailboxes(self, address):
+        """The mailboxes to check, [None] for the token file account alone"""
+        if address:
+            mailbox = Mailbox.objects.filter(email_address=address).first()
+            if mailbox is None:
+                raise CommandError(f"No mailbox {address}")
+            return [mailbox]
+        mailboxes = list(Mailbox.objects.filter(active=True))
+        if not mailboxes and not Mailbox.objects.exists():
+            return [None]
+        return mailboxes
 
-        self.stdout.write("Checking for new emails...")
+    def process(self, mailbox):
+        processor = EmailProcessor(mailbox=mailbox)
+
+        self.stdout.write(f"Checking {mailbox or 'the mailbox'} for new emails...")
         processor.process_new_emails()
 
         self.stdout.write("Sending scheduled responses...")
         processor.send_scheduled_messages()
 
         self.stdout.write(self.style.SUCCESS("Email processing completed!"))
+
+    def run_daemon(self, options):
+        if (
+            options["min_interval"] <= 0
+            or options["max_interval"] < options["min_interval"]
+        ):
+            raise CommandError(
+                "Intervals must satisfy 0 < --min-interval <= --max-interval"
+            )
+        mailboxes = self.mailboxes(options["mailbox"])
+        if len(mailboxes) != 1:
+            raise CommandError("A daemon serves one mailbox, choose it with --mailbox")
+        daemon = EmailDaemon(
+            EmailProcessor(mailbox=mailboxes[0]),
+            min_interval=options["min_interval"],
+            max_interval=options["max_interval"],
+            heartbeat_path=options["heartbeat_file"],
+        )
+        signal.signal(signal.SIGTERM, daemon.stop)
+        signal.signal(signal.SIGINT, daemon.stop)
+        self.stdout.write("Checking for new emails until stopped...")
+        daemon.run()
+        self.stdout.write(self.style.SUCCESS(f"Stopped after {daemon.passes} passes"))
+
+    def report(self, run):
+        self.stdout.write(
+            f"{len(run.queries.queries)} queries in "
+            f"{run.queries.total_seconds * 1000:.1f} ms, "
+            f"{run.elapsed * 1000:.1f} ms total"
+        )
+        for count, seconds, site, sql in run.repeated:
+            self.stdout.write(
+                self.style.WARNING(f"Possible N+1: {count}x from {site}: {sql[:100]}")
+            )
+        self.stdout.write(f"Profile: {run.stats_path}")
+        self.stdout.write(f"Query log: {run.queries_path}")
@@ -0,0 +1,90 @@
+# conversation/management/commands/export_conversations.py
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+
+from conversation.services import export
+
+
+class Command(BaseCommand):
+    help = "Export conversations, messages and scheduled messages for analytics"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default="exports",
+            help="Directory of the exported files and of watermark.json",
+        )
+        parser.add_argument("--format", choices=export.FORMATS, default="jsonl")
+        parser.add_argument(
+            "--table",
+            action="append",
+            choices=[table.name for table in export.TABLES],
+            help="Table to export, repeat for several (default all)",
+        )
+        parser.add_argument(
+            "--since",
+            help="Watermark file of an earlier export (e.g. exports/watermark.json) "
+            "to only export what changed after it, or an ISO date or time",
+        )
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=5000,
+            help="Rows per query and per Parquet row group",
+        )
+        parser.add_argument(
+            "--snapshot",
+            action="store_true",
+            help="Read from a copy of the SQLite database instead of the live file",
+        )
+        parser.add_argument(
+            "--raw", action="store_true", help="Also export the raw message bodies"
+        )
+
+    def handle(self, *args, **options):
+        if options["format"] == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise CommandError("Parquet output needs pyarrow: pip install pyarrow")
+
+        since = options["since"]
+        if since and not os.path.exists(since):
+            since = parse_datetime(since) or parse_datetime(since + "T00:00:00+00:00")
+            if since is None:
+                raise CommandError(
+                    f"--since is neither a watermark file nor a date: {options['since']}"
+                )
+
+        with tempfile.TemporaryDirectory() as directory:
+            using = "default"
+            if options["snapshot"]:
+                path = os.path.join(directory, "db.sqlite3")
+                try:
+                    export.sqlite_snapshot(path)
+                except ValueError as e:
+                    raise CommandError(str(e))
+                using = export.snapshot_alias(path)
+            try:
+                counts = export.export(
+                    options["output"],
+                    format=options["format"],
+                    tables=options["table"],
+                    since=since,
+                    page_size=options["page_size"],
+                    using=using,
+                    raw=options["raw"],
+                )
+            finally:
+                if options["snapshot"]:
+                    connections[using].close()
+
+        for name, count in counts.items():
+            self.stdout.write(f"{name}: {count} rows")
+        self.stdout.write(
+            self.style.SUCCESS(f"Exported to {options['output']}, watermark updated.")
+        )
@@ -0,0 +1,90 @@
+# conversation/management/commands/import_mail.py
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from conversation.models import Mailbox
+from conversation.services.mail_import import FORMATS, import_mail
+
+
+class Command(BaseCommand):
+    help = "Import historical mail from an mbox file, a Maildir or EML files"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="mbox file, Maildir, EML file or directory")
+        parser.add_argument(
+            "--format",
+            choices=FORMATS,
+            help="Format of the source, detected from the path by default",
+        )
+        parser.add_argument(
+            "--mailbox",
+            help="Email address of the Mailbox owning the imported conversations",
+        )
+        parser.add_argument(
+            "--address",
+            action="append",
+            default=[],
+            help="Address of the owner, whose mail is stored as outgoing "
+            "(repeatable; the --mailbox address is included)",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Parse processes, 1 to parse in this process",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Number of messages written per transaction",
+        )
+        parser.add_argument(
+            "--skip-index",
+            action="store_true",
+            help="Do not index the messages for search "
+            "(run rebuild_search_index afterwards)",
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["path"]):
+            raise CommandError(f"No such file or directory: {options['path']}")
+        mailbox = None
+        if options["mailbox"]:
+            mailbox = Mailbox.objects.filter(email_address=options["mailbox"]).first()
+            if mailbox is None:
+                raise CommandError(f"Unknown mailbox {options['mailbox']}")
+        if mailbox is None and not options["address"]:
+            self.stderr.write(
+                "No --mailbox or --address given, all mail is imported as incoming"
+            )
+
+        start = time.monotonic()
+
+        def progress(stats):
+            rate = stats.read / max(time.monotonic() - start, 1e-9) * 3600
+            self.stdout.write(
+                f"  {stats.read} read, {stats.imported} imported "
+                f"({rate:,.0f} messages/hour)"
+            )
+
+        stats = import_mail(
+            options["path"],
+            format=options["format"],
+            mailbox=mailbox,
+            addresses=options["address"],
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            index=not options["skip_index"],
+            progress=progress,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {stats.imported} of {stats.read} messages into "
+                f"{stats.conversations} new conversations with "
+                f"{stats.contacts} new contacts "
+                f"({stats.already_stored} already stored, {stats.skipped} skipped)."
+            )
+        )
@@ -0,0 +1,23 @@
+# conversation/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+from conversation.services.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index from the message table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of messages indexed per transaction",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Rebuilding search index...")
+        total = rebuild_index(
+            chunk_size=options["chunk_size"],
+            progress=lambda count: self.stdout.write(f"  {count} messages indexed"),
+        )
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} messages."))
@@ -0,0 +1,48 @@
+# conversation/management/commands/recompress_content.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from conversation.models import Message, ScheduledMessage
+
+COMPRESSED_FIELDS = [
+    (Message, ["content", "raw_content"]),
+    (ScheduledMessage, ["draft_content"]),
+]
+
+
+class Command(BaseCommand):
+    help = "Rewrite compressed text columns with the current compression settings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows rewritten per transaction",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        for model, fields in COMPRESSED_FIELDS:
+            self.stdout.write(f"Recompressing {model.__name__}...")
+            total = 0
+            last_id = 0
+            while True:
+                rows = list(
+                    model.objects.filter(pk__gt=last_id)
+                    .order_by("pk")
+                    .only("pk", *fields)[:batch_size]
+                )
+                if not rows:
+                    break
+
+                # Values are decompressed on load and compressed again on save
+                with transaction.atomic():
+                    model.objects.bulk_update(rows, fields)
+                total += len(rows)
+                last_id = rows[-1].pk
+
+            self.stdout.write(f"  {total} rows rewritten")
+
+        self.stdout.write(self.style.SUCCESS("Recompression completed!"))
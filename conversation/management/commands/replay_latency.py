@@ -0,0 +1,129 @@
+# conversation/management/commands/replay_latency.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from conversation.services import replay
+
+
+class Command(BaseCommand):
+    help = "Decide the latency of stored incoming messages again and compare backends"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backend",
+            action="append",
+            choices=replay.backend_names(),
+            help="Backend to replay, repeat to compare several "
+            f"(default {replay.LATENCY_AGENT})",
+        )
+        parser.add_argument(
+            "--output",
+            default="replay/latency.jsonl",
+            help="JSONL result file, with a .checkpoint.json next to it",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["jsonl", "parquet"],
+            default="jsonl",
+            help="Also write the results as Parquet (needs pyarrow)",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue an interrupted replay from its checkpoint",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=4,
+            help="Requests of a backend in flight at once",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Messages decided and checkpointed together",
+        )
+        parser.add_argument(
+            "--since", help="Only messages received from this ISO date or time"
+        )
+        parser.add_argument("--limit", type=int, help="Stop after this many messages")
+        parser.add_argument(
+            "--summary-only",
+            action="store_true",
+            help="Summarize an existing result file without replaying",
+        )
+        parser.add_argument("--json", action="store_true", help="Print raw JSON")
+
+    def handle(self, *args, **options):
+        backends = options["backend"] or [replay.LATENCY_AGENT]
+        if len(set(backends)) != len(backends):
+            raise CommandError("Each backend can only be given once")
+        if options["format"] == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise CommandError("Parquet output needs pyarrow: pip install pyarrow")
+
+        output = options["output"]
+        if not options["summary_only"]:
+            since = None
+            if options["since"]:
+                since = parse_datetime(options["since"]) or parse_datetime(
+                    options["since"] + "T00:00:00+00:00"
+                )
+                if since is None:
+                    raise CommandError(f"Invalid date: {options['since']}")
+            try:
+                count = replay.replay(
+                    backends,
+                    output,
+                    batch_size=options["batch_size"],
+                    concurrency=options["concurrency"],
+                    resume=options["resume"],
+                    limit=options["limit"],
+                    since=since,
+                )
+            except ValueError as e:
+                raise CommandError(f"{e}, not resuming")
+            self.stderr.write(f"Replayed {count} messages into {output}")
+
+        try:
+            summary = replay.summarize(output, backends)
+        except FileNotFoundError:
+            raise CommandError(f"No result file at {output}")
+        with open(f"{output}.summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        if options["format"] == "parquet":
+            parquet = output.removesuffix(".jsonl") + ".parquet"
+            replay.to_parquet(output, parquet, backends)
+            self.stderr.write(f"Wrote {parquet}")
+
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'minutes':16} {'count':>7} {'errors':>6} {'mean':>8} {'p50':>8} "
+            f"{'p90':>8} {'p99':>8} {'urgent':>7} {'stuck':>7}"
+        )
+        for name, stats in summary["backends"].items():
+            d = stats["latency_minutes"]
+            self.stdout.write(
+                f"{name:16} {stats['decisions']:7} {stats['errors']:6} "
+                f"{d['mean']:8.1f} {d['p50']:8} {d['p90']:8} {d['p99']:8} "
+                f"{_percent(stats['urgent_rate']):>7} "
+                f"{_percent(stats['stuck_rate']):>7}"
+            )
+        for pair, stats in summary["agreement"].items():
+            self.stdout.write(
+                f"Agreement {pair}: latency within x{replay.AGREEMENT_FACTOR:g} "
+                f"{_percent(stats['latency'])}, urgent {_percent(stats['urgent'])} "
+                f"({stats['compared']} messages)"
+            )
+
+
+def _percent(rate) -> str:
+    return "n/a" if rate is None else f"{rate:.0%}"
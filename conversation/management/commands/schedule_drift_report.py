@@ -0,0 +1,51 @@
+# conversation/management/commands/schedule_drift_report.py
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from conversation.tracing import read_spans, summarize
+
+
+class Command(BaseCommand):
+    help = "Report schedule drift and stage latency percentiles from exported traces"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            default=str(settings.TRACING_FILE),
+            help="Span file written by the file exporter",
+        )
+        parser.add_argument(
+            "--hours",
+            type=float,
+            help="Only include spans started in the last N hours",
+        )
+        parser.add_argument("--json", action="store_true", help="Print raw JSON")
+
+    def handle(self, *args, **options):
+        try:
+            spans = read_spans(options["file"])
+        except FileNotFoundError:
+            raise CommandError(f"No span file at {options['file']}")
+
+        since_ns = 0
+        if options["hours"]:
+            since_ns = time.time_ns() - int(options["hours"] * 3600 * 1e9)
+        summary = summarize(spans, since_ns=since_ns)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        self.stdout.write(
+            f"{'seconds':22} {'count':>7} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"
+        )
+        rows = [("schedule drift", summary["schedule_drift"])]
+        rows.append(("ingest to send", summary["end_to_end"]))
+        rows += [(f"span {name}", d) for name, d in summary["spans"].items()]
+        for label, d in rows:
+            self.stdout.write(
+                f"{label:22} {d['count']:7} {d['p50']:9.2f} {d['p90']:9.2f} "
+                f"{d['p99']:9.2f} {d['max']:9.2f}"
+            )
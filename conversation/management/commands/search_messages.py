@@ -0,0 +1,34 @@
+# conversation/management/commands/search_messages.py
+from django.core.management.base import BaseCommand
+from conversation.services.search import search_messages
+
+
+class Command(BaseCommand):
+    help = "Search stored messages by subject and content"
+
+    def add_arguments(self, parser):
+        parser.add_argument("query", help="Terms to search for, 'term*' for a prefix")
+        parser.add_argument("--page", type=int, default=1)
+        parser.add_argument("--page-size", type=int, default=20)
+
+    def handle(self, *args, **options):
+        results = search_messages(
+            options["query"], page=options["page"], page_size=options["page_size"]
+        )
+
+        if not results.hits:
+            self.stdout.write("No matching messages.")
+            return
+
+        for hit in results.hits:
+            message = hit.message
+            preview = " ".join(message.content.split())[:100]
+            self.stdout.write(
+                f"{hit.rank:8.3f}  thread {message.conversation.thread_id}  "
+                f"message {message.message_id}\n"
+                f"          {message.subject}\n"
+                f"          {preview}"
+            )
+
+        if results.has_next:
+            self.stdout.write(f"More results: --page {results.page + 1}")
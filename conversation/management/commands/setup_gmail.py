@@ -1,19 +1,53 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from conversation.services.gmail_service import GmailService
+from conversation.services.sync import renew_watch
 
 
 class Command(BaseCommand):
     help = "Set up Gmail API authentication"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--add-mailbox",
+            action="store_true",
+            help="Authorize another account and store its token in a Mailbox",
+        )
+
+    def handle(self, *args, **options):
+        if options["add_mailbox"]:
+            self.add_mailbox()
+            return
+
         self.stdout.write("Setting up Gmail API authentication...")
 
         # This will trigger the OAuth flow if needed
         service = GmailService()
 
-        if service.service:
-            self.stdout.write(
-                self.style.SUCCESS("Gmail API authentication successful!")
-            )
-        else:
+        if not service.service:
             self.stdout.write(self.style.ERROR("Failed to authenticate with Gmail API"))
+            return
+        self.stdout.write(self.style.SUCCESS("Gmail API authentication successful!"))
+
+        # Push notifications, renewed daily by the renew_gmail_watch task
+        if settings.GMAIL_PUBSUB_TOPIC:
+            state = renew_watch(service, settings.GMAIL_PUBSUB_TOPIC)
+            if state is None:
+                self.stdout.write(self.style.ERROR("Failed to watch the mailbox"))
+            else:
+                self.stdout.write(
+                    f"Watching {state.email_address} until {state.watch_expiration}"
+                )
+
+    def add_mailbox(self):
+        self.stdout.write("Authorizing a Gmail account...")
+        mailbox = GmailService.add_mailbox()
+        if mailbox is None:
+            self.stdout.write(self.style.ERROR("Failed to read the account profile"))
+            return
+        self.stdout.write(self.style.SUCCESS(f"Added mailbox {mailbox}"))
+
+        if settings.GMAIL_PUBSUB_TOPIC:
+            gmail = GmailService(mailbox=mailbox)
+            if renew_watch(gmail, settings.GMAIL_PUBSUB_TOPIC) is None:
+                self.stdout.write(self.style.ERROR("Failed to watch the mailbox"))
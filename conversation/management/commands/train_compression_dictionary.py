@@ -0,0 +1,49 @@
+# conversation/management/commands/train_compression_dictionary.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from conversation.compression import train_dictionary
+from conversation.models import Message
+
+
+class Command(BaseCommand):
+    # One dictionary for every mailbox, see conversation/compression.py
+    help = "Train a zstd dictionary on recent message bodies of all mailboxes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=10000,
+            help="Number of recent messages to train on",
+        )
+        parser.add_argument(
+            "--size", type=int, default=112640, help="Dictionary size in bytes"
+        )
+
+    def handle(self, *args, **options):
+        samples = []
+        for content, raw_content in (
+            Message.objects.order_by("-id")
+            .values_list("content", "raw_content")
+            .iterator(chunk_size=1000)
+        ):
+            samples.append(raw_content or content)
+            if len(samples) >= options["samples"]:
+                break
+
+        try:
+            dictionary = train_dictionary(samples, options["size"])
+        except Exception as e:
+            raise CommandError(f"Could not train a dictionary: {e}")
+
+        directory = settings.COMPRESSION_DICTIONARY_DIR
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{dictionary.dict_id()}.zdict"
+        path.write_bytes(dictionary.as_bytes())
+
+        self.stdout.write(self.style.SUCCESS(f"Dictionary written to {path}"))
+        self.stdout.write(
+            f"Set COMPRESSION_DICTIONARY_ID={dictionary.dict_id()} and run "
+            "recompress_content to use it for stored rows."
+        )
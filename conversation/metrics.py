@@ -0,0 +1,357 @@
+# conversation/metrics.py
+"""
+Pipeline metrics in the Prometheus text format.
+
+Counters, histograms and gauges are kept in memory per process and flushed
+as JSON to ``METRICS_DIR`` at most every ``METRICS_FLUSH_INTERVAL`` seconds
+(and at exit), one file per process. The ``/metrics`` view merges the files
+of every web and worker process. With ``METRICS_ENABLED`` off every call
+returns immediately.
+
+When collecting, the counters and histograms of exited processes are
+folded into ``exited.json`` and their files removed, so counters do not go
+backwards and the directory does not grow with every restart. Processes are
+found by pid, so ``METRICS_DIR`` must not be shared between hosts or
+containers.
+"""
+
+import atexit
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+
+# Seconds, from fast DB writes to slow LLM calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Quota units charged by the Gmail API per method
+GMAIL_QUOTA_UNITS = {
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.modify": 5,
+    "messages.send": 100,
+    "messages.attachments.get": 5,
+    "drafts.create": 10,
+    "drafts.send": 100,
+    "threads.get": 10,
+    "history.list": 2,
+    "getProfile": 1,
+    "watch": 100,
+}
+
+# Totals of the processes that have exited
+EXITED_FILE = "exited.json"
+
+_lock = threading.RLock()
+# (metric name, sorted label items) -> value, or bucket counts + [sum, count]
+_values = {}
+_state = {"last_flush": 0.0, "file": None}
+_registry = {}
+
+
+def enabled() -> bool:
+    return getattr(settings, "METRICS_ENABLED", False)
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _key(self, labels):
+        return self.name, tuple(sorted(labels.items()))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not enabled():
+            return
+        key = self._key(labels)
+        with _lock:
+            _values[key] = _values.get(key, 0) + amount
+        _maybe_flush()
+
+
+class Gauge(Metric):
+    """A value set by one process; the most recently set value wins."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        if not enabled():
+            return
+        with _lock:
+            _values[self._key(labels)] = [value, time.time()]
+        _maybe_flush()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        if not enabled():
+            return
+        key = self._key(labels)
+        with _lock:
+            counts = _values.get(key)
+            if counts is None:
+                counts = _values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+        _maybe_flush()
+
+    @contextmanager
+    def time(self, errors: Counter = None, **labels):
+        """Observe the duration of the block, counting exceptions in ``errors``."""
+        if not enabled():
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if errors is not None:
+                errors.inc(**labels)
+            raise
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def timed(self, errors: Counter = None, **labels):
+        """Decorator form of ``time``."""
+
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(errors, **labels):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+
+GMAIL_REQUEST_SECONDS = Histogram(
+    "casy_gmail_request_seconds", "Gmail API request latency", ["method"]
+)
+GMAIL_REQUEST_ERRORS = Counter(
+    "casy_gmail_request_errors_total", "Failed Gmail API requests", ["method"]
+)
+GMAIL_QUOTA_UNITS_USED = Counter(
+    "casy_gmail_quota_units_total", "Gmail API quota units used", ["method"]
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "casy_llm_request_seconds", "LLM call latency", ["operation"]
+)
+LLM_REQUEST_ERRORS = Counter(
+    "casy_llm_request_errors_total", "Failed LLM calls", ["operation"]
+)
+STAGE_SECONDS = Histogram(
+    "casy_pipeline_stage_seconds", "Email pipeline stage latency", ["stage"]
+)
+STAGE_ERRORS = Counter(
+    "casy_pipeline_stage_errors_total", "Email pipeline stage failures", ["stage"]
+)
+TASK_SECONDS = Histogram("casy_celery_task_seconds", "Celery task runtime", ["task"])
+TASK_FAILURES = Counter(
+    "casy_celery_task_failures_total", "Failed Celery tasks", ["task"]
+)
+SCHEDULE_DRIFT_SECONDS = Histogram(
+    "casy_schedule_drift_seconds",
+    "Delay between the scheduled and actual send time",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 4 * 3600),
+)
+UNREAD_BACKLOG = Gauge(
+    "casy_gmail_unread_backlog",
+    "Estimated unread messages in the mailbox",
+    ["mailbox"],
+)
+SCHEDULED_PENDING = Gauge(
+    "casy_scheduled_messages_pending", "Scheduled messages not sent or canceled"
+)
+SCHEDULED_DUE = Gauge(
+    "casy_scheduled_messages_due", "Pending scheduled messages past their send time"
+)
+DAEMON_HEARTBEAT = Gauge(
+    "casy_daemon_last_pass_timestamp_seconds",
+    "Unix time of the last pass of check_emails --daemon",
+)
+
+
+def charge_gmail_quota(method: str):
+    """Count the quota units of a Gmail API call."""
+    GMAIL_QUOTA_UNITS_USED.inc(GMAIL_QUOTA_UNITS.get(method, 0), method=method)
+
+
+def gmail_request(request, method: str):
+    """Execute a Gmail API request, recording latency, errors and quota."""
+    if not enabled():
+        return request.execute()
+    charge_gmail_quota(method)
+    with GMAIL_REQUEST_SECONDS.time(GMAIL_REQUEST_ERRORS, method=method):
+        return request.execute()
+
+
+def flush():
+    """Write this process's values to its file in METRICS_DIR."""
+    if not enabled():
+        return
+    directory = Path(settings.METRICS_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    if _state["file"] is None:
+        _state["file"] = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+    with _lock:
+        data = json.dumps(
+            [[name, labels, value] for (name, labels), value in _values.items()]
+        )
+        _state["last_flush"] = time.monotonic()
+    path = directory / _state["file"]
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(data)
+    os.replace(tmp, path)
+
+
+def _maybe_flush():
+    interval = getattr(settings, "METRICS_FLUSH_INTERVAL", 10)
+    if time.monotonic() - _state["last_flush"] >= interval:
+        flush()
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero under its own file
+    global _lock
+    _lock = threading.RLock()
+    _values.clear()
+    _state.update(last_flush=0.0, file=None)
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(flush)
+
+
+def collect() -> dict:
+    """Merge the flushed values of every process."""
+    directory = Path(settings.METRICS_DIR)
+    _prune_exited(directory)
+    merged = {}
+    for path in directory.glob("*.json"):
+        _merge(merged, _read(path))
+    return merged
+
+
+def _read(path: Path) -> list:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return []  # Being replaced or removed
+
+
+def _merge(merged: dict, entries: list, gauges: bool = True):
+    """Add flushed ``entries`` to ``merged``, optionally skipping gauges."""
+    for name, labels, value in entries:
+        metric = _registry.get(name)
+        if metric is None or (metric.kind == "gauge" and not gauges):
+            continue
+        key = (name, tuple(tuple(item) for item in labels))
+        current = merged.get(key)
+        if current is None:
+            merged[key] = value
+        elif metric.kind == "counter":
+            merged[key] = current + value
+        elif metric.kind == "gauge":
+            merged[key] = max(current, value, key=lambda v: v[1])
+        else:
+            merged[key] = [a + b for a, b in zip(current, value)]
+
+
+def _exited(path: Path) -> bool:
+    """Whether the process that wrote ``path`` has exited."""
+    pid = path.name.split("-", 1)[0]
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # Alive, run by another user
+    return False
+
+
+def _prune_exited(directory: Path):
+    """Fold the files of exited processes into EXITED_FILE and remove them."""
+    exited = [path for path in directory.glob("*.json") if _exited(path)]
+    if not exited:
+        return
+    # One collector at a time, so no file is folded twice
+    with open(directory / "exited.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        totals = {}
+        _merge(totals, _read(directory / EXITED_FILE))
+        exited = [path for path in exited if path.exists()]
+        for path in exited:
+            # Gauges of an exited process no longer describe anything
+            _merge(totals, _read(path), gauges=False)
+        data = json.dumps(
+            [[name, labels, value] for (name, labels), value in totals.items()]
+        )
+        tmp = directory / "exited.tmp"
+        tmp.write_text(data)
+        os.replace(tmp, directory / EXITED_FILE)
+        for path in exited:
+            path.unlink(missing_ok=True)
+
+
+def render(values: dict) -> str:
+    """Format merged values in the Prometheus text exposition format."""
+    by_name = {}
+    for (name, labels), value in values.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, samples in sorted(by_name.items()):
+        metric = _registry[name]
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in sorted(samples):
+            if metric.kind == "counter":
+                lines.append(f"{name}{_labels(labels)} {value}")
+            elif metric.kind == "gauge":
+                lines.append(f"{name}{_labels(labels)} {value[0]}")
+            else:
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value[:-2]):
+                    cumulative += count
+                    bucket_labels = labels + (("le", str(bound)),)
+                    lines.append(f"{name}_bucket{_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 22:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0002_message_receiver_message_sender_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="raw_content",
+            field=models.TextField(blank=True, default=""),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:10
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS conversation_message_fts USING fts5("
+    "subject, content, tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS conversation_message_fts_delete "
+    "AFTER DELETE ON conversation_message BEGIN "
+    "DELETE FROM conversation_message_fts WHERE rowid = old.id; END",
+    "INSERT INTO conversation_message_fts (rowid, subject, content) "
+    "SELECT id, subject, content FROM conversation_message",
+]
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS conversation_message_fts_delete",
+    "DROP TABLE IF EXISTS conversation_message_fts",
+]
+POSTGRES_FORWARD = [
+    "CREATE TABLE IF NOT EXISTS conversation_message_search ("
+    "message_id bigint PRIMARY KEY "
+    "REFERENCES conversation_message (id) ON DELETE CASCADE "
+    "DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "INSERT INTO conversation_message_search (message_id, document) "
+    "SELECT id, setweight(to_tsvector('english', subject), 'A') || "
+    "setweight(to_tsvector('english', content), 'B') FROM conversation_message",
+    "CREATE INDEX IF NOT EXISTS conversation_message_search_document_gin "
+    "ON conversation_message_search USING GIN (document)",
+]
+POSTGRES_BACKWARD = ["DROP TABLE IF EXISTS conversation_message_search"]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0003_message_raw_content"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            run_for_vendor(
+                {"sqlite": SQLITE_BACKWARD, "postgresql": POSTGRES_BACKWARD}
+            ),
+        ),
+    ]
@@ -0,0 +1,130 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:30
+
+from django.db import migrations, models
+
+import conversation.fields
+
+BATCH_SIZE = 1000
+
+# (model, field) pairs moved from TextField to CompressedTextField
+COMPRESSED_FIELDS = [
+    ("message", "content"),
+    ("message", "raw_content"),
+    ("scheduledmessage", "draft_content"),
+]
+
+
+def copy_compressed(apps, schema_editor):
+    """Fill the compressed columns from the text columns, in batches."""
+    alias = schema_editor.connection.alias
+    for model_name in {model_name for model_name, _ in COMPRESSED_FIELDS}:
+        model = apps.get_model("conversation", model_name)
+        fields = [field for name, field in COMPRESSED_FIELDS if name == model_name]
+        last_id = 0
+        while True:
+            rows = list(
+                model.objects.using(alias)
+                .filter(pk__gt=last_id)
+                .order_by("pk")
+                .only("pk", *fields)[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            for row in rows:
+                for field in fields:
+                    setattr(row, f"{field}_compressed", getattr(row, field))
+            model.objects.using(alias).bulk_update(
+                rows, [f"{field}_compressed" for field in fields]
+            )
+            last_id = rows[-1].pk
+
+
+def copy_text(apps, schema_editor):
+    """Reverse of copy_compressed, fill the text columns back."""
+    alias = schema_editor.connection.alias
+    for model_name in {model_name for model_name, _ in COMPRESSED_FIELDS}:
+        model = apps.get_model("conversation", model_name)
+        fields = [field for name, field in COMPRESSED_FIELDS if name == model_name]
+        last_id = 0
+        while True:
+            rows = list(
+                model.objects.using(alias)
+                .filter(pk__gt=last_id)
+                .order_by("pk")
+                .only("pk", *[f"{field}_compressed" for field in fields])[:BATCH_SIZE]
+            )
+            if not rows:
+                break
+            for row in rows:
+                for field in fields:
+                    setattr(row, field, getattr(row, f"{field}_compressed") or "")
+            model.objects.using(alias).bulk_update(rows, fields)
+            last_id = rows[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0004_message_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="content_compressed",
+            field=conversation.fields.CompressedTextField(null=True),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="raw_content_compressed",
+            field=conversation.fields.CompressedTextField(null=True),
+        ),
+        migrations.AddField(
+            model_name="scheduledmessage",
+            name="draft_content_compressed",
+            field=conversation.fields.CompressedTextField(null=True),
+        ),
+        # Nullable while both columns exist, so the migration can be reversed
+        migrations.AlterField(
+            model_name="message",
+            name="content",
+            field=models.TextField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="scheduledmessage",
+            name="draft_content",
+            field=models.TextField(null=True),
+        ),
+        migrations.RunPython(copy_compressed, copy_text),
+        migrations.RemoveField(model_name="message", name="content"),
+        migrations.RemoveField(model_name="message", name="raw_content"),
+        migrations.RemoveField(model_name="scheduledmessage", name="draft_content"),
+        migrations.RenameField(
+            model_name="message", old_name="content_compressed", new_name="content"
+        ),
+        migrations.RenameField(
+            model_name="message",
+            old_name="raw_content_compressed",
+            new_name="raw_content",
+        ),
+        migrations.RenameField(
+            model_name="scheduledmessage",
+            old_name="draft_content_compressed",
+            new_name="draft_content",
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="content",
+            field=conversation.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="raw_content",
+            field=conversation.fields.CompressedTextField(blank=True, default=""),
+        ),
+        migrations.AlterField(
+            model_name="scheduledmessage",
+            name="draft_content",
+            field=conversation.fields.CompressedTextField(),
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:02
+
+import conversation.fields
+import django.db.models.deletion
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0005_compress_text_fields"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedConversation",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("thread_id", models.CharField(max_length=255, unique=True)),
+                ("last_updated", models.DateTimeField()),
+                (
+                    "archived_at",
+                    models.DateTimeField(
+                        db_default=django.db.models.functions.datetime.Now()
+                    ),
+                ),
+                (
+                    "contact",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_conversations",
+                        to="conversation.contact",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ArchivedMessage",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("message_id", models.CharField(max_length=255, unique=True)),
+                (
+                    "message_type",
+                    models.CharField(
+                        choices=[
+                            ("INCOMING", "Incoming"),
+                            ("OUTGOING", "Outgoing"),
+                            ("DRAFT", "Draft"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("subject", models.CharField(blank=True, max_length=512)),
+                ("content", conversation.fields.CompressedTextField()),
+                (
+                    "raw_content",
+                    conversation.fields.CompressedTextField(blank=True, default=""),
+                ),
+                ("sender", models.EmailField(blank=True, max_length=254, null=True)),
+                ("receiver", models.EmailField(blank=True, max_length=254, null=True)),
+                ("timestamp", models.DateTimeField(blank=True, null=True)),
+                (
+                    "conversation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="messages",
+                        to="conversation.archivedconversation",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ArchivedScheduledMessage",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("draft_content", conversation.fields.CompressedTextField()),
+                ("draft_subject", models.CharField(max_length=512)),
+                ("created_at", models.DateTimeField()),
+                ("scheduled_send_time", models.DateTimeField()),
+                ("sent", models.BooleanField(default=False)),
+                ("canceled", models.BooleanField(default=False)),
+                (
+                    "conversation",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="conversation.archivedconversation",
+                    ),
+                ),
+            ],
+        ),
+    ]
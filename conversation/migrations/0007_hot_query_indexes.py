@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0006_archive_tables"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="conversation",
+            name="last_updated",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "-timestamp"],
+                name="message_conversation_time_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="scheduledmessage",
+            index=models.Index(
+                condition=models.Q(("canceled", False), ("sent", False)),
+                fields=["scheduled_send_time"],
+                name="scheduled_pending_due_idx",
+            ),
+        ),
+    ]
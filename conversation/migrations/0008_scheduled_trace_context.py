@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0007_hot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedscheduledmessage",
+            name="trace_context",
+            field=models.CharField(blank=True, default="", max_length=55),
+        ),
+        migrations.AddField(
+            model_name="scheduledmessage",
+            name="trace_context",
+            field=models.CharField(blank=True, default="", max_length=55),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0008_scheduled_trace_context"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("email_address", models.EmailField(max_length=254, unique=True)),
+                ("history_id", models.CharField(blank=True, max_length=32)),
+                ("watch_expiration", models.DateTimeField(blank=True, null=True)),
+                ("last_synced", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
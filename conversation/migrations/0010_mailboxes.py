@@ -0,0 +1,47 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0009_sync_state"),
+    ]
+
+    operations = [
+        # Sync state rows become the mailboxes of the token file account
+        migrations.RenameModel(old_name="SyncState", new_name="Mailbox"),
+        migrations.AddField(
+            model_name="mailbox",
+            name="token_json",
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name="mailbox",
+            name="active",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name="archivedconversation",
+            name="mailbox",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="archived_conversations",
+                to="conversation.mailbox",
+            ),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="mailbox",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                to="conversation.mailbox",
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0010_mailboxes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedconversation",
+            name="hydrated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="conversation",
+            name="hydrated_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
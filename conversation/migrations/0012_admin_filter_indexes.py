@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 23:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0011_thread_hydration"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["message_type", "-id"], name="message_type_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="scheduledmessage",
+            index=models.Index(
+                fields=["sent", "canceled", "-id"], name="scheduled_state_idx"
+            ),
+        ),
+    ]
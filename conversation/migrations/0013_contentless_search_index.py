@@ -0,0 +1,71 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:12
+
+from django.db import migrations
+
+TABLE = "conversation_message_fts"
+
+
+def sqlite_version(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_version()")
+        return tuple(int(part) for part in cursor.fetchone()[0].split("."))
+
+
+def table_sql(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s", [TABLE])
+        row = cursor.fetchone()
+    return row[0] if row else ""
+
+
+def rebuild(apps, schema_editor, options):
+    """Recreate the FTS5 table with ``options`` and index every message again"""
+    Message = apps.get_model("conversation", "Message")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5("
+        f"subject, content, tokenize='porter unicode61'{options})"
+    )
+    last_id = 0
+    while True:
+        rows = list(
+            Message.objects.filter(pk__gt=last_id)
+            .order_by("pk")
+            .values_list("id", "subject", "content")[:1000]
+        )
+        if not rows:
+            return
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (rowid, subject, content) VALUES (%s, %s, %s)",
+                rows,
+            )
+        last_id = rows[-1][0]
+
+
+def make_contentless(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    # contentless_delete needs SQLite 3.43, older versions keep a copy
+    if sqlite_version(schema_editor) < (3, 43):
+        return
+    if "content=''" not in table_sql(schema_editor):
+        rebuild(apps, schema_editor, ", content='', contentless_delete=1")
+
+
+def keep_content(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    if "content=''" in table_sql(schema_editor):
+        rebuild(apps, schema_editor, "")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0012_admin_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(make_contentless, keep_content),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0013_contentless_search_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scheduledmessage",
+            name="sending_since",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0014_scheduled_message_claim"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scheduledmessage",
+            name="in_reply_to",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="scheduled_replies",
+                to="conversation.message",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="scheduledmessage",
+            constraint=models.UniqueConstraint(
+                fields=("in_reply_to",), name="scheduled_unique_reply"
+            ),
+        ),
+    ]
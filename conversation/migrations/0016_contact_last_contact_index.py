@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0015_scheduled_in_reply_to"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="contact",
+            name="last_contact",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
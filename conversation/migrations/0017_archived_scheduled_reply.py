@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-19 00:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0016_contact_last_contact_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedscheduledmessage",
+            name="in_reply_to_id",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="archivedscheduledmessage",
+            name="sending_since",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-19 00:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("conversation", "0017_archived_scheduled_reply"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivedscheduledmessage",
+            name="last_updated",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="scheduledmessage",
+            name="last_updated",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
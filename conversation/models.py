@@ -1,21 +1,47 @@
 # conversation/models.py
 from django.db import models
+from django.db.models.functions import Now
+
+from .fields import CompressedTextField
 
 
 class Contact(models.Model):
     email = models.EmailField(unique=True)
     name = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    last_contact = models.DateTimeField(auto_now=True)
+    last_contact = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.email
 
 
+class Mailbox(models.Model):
+    """A Gmail account served by this deployment, with its sync state"""
+
+    email_address = models.EmailField(unique=True)
+    # Authorized user info of the OAuth token; empty for the account of the
+    # GMAIL_TOKEN_PATH file
+    token_json = models.TextField(blank=True)
+    active = models.BooleanField(default=True)
+    # Messages added after this point are fetched by the next sync
+    history_id = models.CharField(max_length=32, blank=True)
+    watch_expiration = models.DateTimeField(blank=True, null=True)
+    last_synced = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return self.email_address
+
+
 class Conversation(models.Model):
     contact = models.ForeignKey(Contact, on_delete=models.CASCADE)
+    # Null for conversations stored before mailboxes were added
+    mailbox = models.ForeignKey(
+        Mailbox, on_delete=models.PROTECT, null=True, blank=True
+    )
     thread_id = models.CharField(max_length=255, unique=True)
-    last_updated = models.DateTimeField(auto_now=True)
+    last_updated = models.DateTimeField(auto_now=True, db_index=True)
+    # When the earlier messages of the thread were fetched, null until then
+    hydrated_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"Conversation with {self.contact.email}"
@@ -34,23 +60,127 @@ class Message(models.Model):
     message_id = models.CharField(max_length=255, unique=True)
     message_type = models.CharField(max_length=10, choices=MESSAGE_TYPE_CHOICES)
     subject = models.CharField(max_length=512, blank=True)
-    content = models.TextField()
+    # New text only (quoted history and signature stripped), used for prompts
+    content = CompressedTextField()
+    # Body exactly as received
+    raw_content = CompressedTextField(blank=True, default="")
     sender = models.EmailField(blank=True, null=True)
     receiver = models.EmailField(blank=True, null=True)
     timestamp = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Latest message of a conversation
+            models.Index(
+                fields=["conversation", "-timestamp"],
+                name="message_conversation_time_idx",
+            ),
+            # Admin list filtered by type, newest first
+            models.Index(fields=["message_type", "-id"], name="message_type_idx"),
+        ]
+
     def __str__(self):
         return f"timestamp:{self.timestamp}\nfrom:{self.sender}\nto:{self.receiver}\nsubject:{self.subject}\ncontent: {self.content}\n\n"
 
 
 class ScheduledMessage(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
-    draft_content = models.TextField()
+    draft_content = CompressedTextField()
     draft_subject = models.CharField(max_length=512)
     created_at = models.DateTimeField(auto_now_add=True)
     scheduled_send_time = models.DateTimeField()
     sent = models.BooleanField(default=False)
     canceled = models.BooleanField(default=False)
+    # Queryset updates must set it too, exports read changes by it
+    last_updated = models.DateTimeField(auto_now=True, db_index=True)
+    # Set while a worker sends it, so the Gmail call runs outside a transaction
+    sending_since = models.DateTimeField(null=True, blank=True)
+    # W3C traceparent of the span that scheduled it (see conversation/tracing.py)
+    trace_context = models.CharField(max_length=55, blank=True, default="")
+    # Incoming message answered, set on the reply only (not the follow-up)
+    in_reply_to = models.ForeignKey(
+        Message,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="scheduled_replies",
+    )
+
+    class Meta:
+        constraints = [
+            # A message redelivered to decide_response is answered once
+            models.UniqueConstraint(
+                fields=["in_reply_to"], name="scheduled_unique_reply"
+            ),
+        ]
+        indexes = [
+            # Partial index: only pending rows are ever swept for sending
+            models.Index(
+                fields=["scheduled_send_time"],
+                condition=models.Q(sent=False, canceled=False),
+                name="scheduled_pending_due_idx",
+            ),
+            # Admin list filtered by state, newest first
+            models.Index(
+                fields=["sent", "canceled", "-id"], name="scheduled_state_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"Response to {self.conversation.contact.email} at {self.scheduled_send_time}"
+
+
+# Archive tables: idle conversations are moved here with their messages and
+# scheduled messages, keeping their primary keys (see services/archive.py).
+
+
+class ArchivedConversation(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    contact = models.ForeignKey(
+        Contact, on_delete=models.CASCADE, related_name="archived_conversations"
+    )
+    mailbox = models.ForeignKey(
+        Mailbox,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="archived_conversations",
+    )
+    thread_id = models.CharField(max_length=255, unique=True)
+    last_updated = models.DateTimeField()
+    hydrated_at = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(db_default=Now())
+
+    def __str__(self):
+        return f"Archived conversation {self.thread_id}"
+
+
+class ArchivedMessage(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    conversation = models.ForeignKey(
+        ArchivedConversation, on_delete=models.CASCADE, related_name="messages"
+    )
+    message_id = models.CharField(max_length=255, unique=True)
+    message_type = models.CharField(max_length=10, choices=Message.MESSAGE_TYPE_CHOICES)
+    subject = models.CharField(max_length=512, blank=True)
+    content = CompressedTextField()
+    raw_content = CompressedTextField(blank=True, default="")
+    sender = models.EmailField(blank=True, null=True)
+    receiver = models.EmailField(blank=True, null=True)
+    timestamp = models.DateTimeField(blank=True, null=True)
+
+
+class ArchivedScheduledMessage(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    conversation = models.ForeignKey(ArchivedConversation, on_delete=models.CASCADE)
+    draft_content = CompressedTextField()
+    draft_subject = models.CharField(max_length=512)
+    created_at = models.DateTimeField()
+    scheduled_send_time = models.DateTimeField()
+    sent = models.BooleanField(default=False)
+    canceled = models.BooleanField(default=False)
+    last_updated = models.DateTimeField()
+    sending_since = models.DateTimeField(null=True, blank=True)
+    trace_context = models.CharField(max_length=55, blank=True, default="")
+    # Plain ID: the answered message is archived alongside, in ArchivedMessage
+    in_reply_to_id = models.BigIntegerField(null=True, blank=True)
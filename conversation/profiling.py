@@ -0,0 +1,169 @@
+# conversation/profiling.py
+"""
+On-demand profiling of one command run or Celery task.
+
+``profile`` runs a block under cProfile and logs every SQL query it makes
+through ``connection.execute_wrapper``, then writes two timestamped files
+to ``PROFILE_DIR``:
+
+- ``<name>-<time>-<pid>.prof``: cProfile stats, for ``pstats`` or snakeviz
+- ``<name>-<time>-<pid>.queries.log``: query totals, the statements repeated
+  from one call site (likely N+1 patterns), and every query in order
+
+``check_emails --profile`` profiles a manual run. Tasks decorated with
+``profiled`` are profiled when their name is listed in ``PROFILE_TASKS``
+(``"*"`` for all); otherwise the task runs as is.
+"""
+
+import cProfile
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from pathlib import Path
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import connection
+
+# Same statement from the same line at least this many times: likely N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+_PROJECT_DIR = str(Path(__file__).resolve().parent.parent)
+_IN_LIST = re.compile(r"\((?:\s*%s\s*,)+\s*%s\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def fingerprint(sql: str) -> str:
+    """The statement of a query with literals and IN lists collapsed."""
+    sql = _IN_LIST.sub("(...)", sql)
+    return _LITERAL.sub("?", sql)
+
+
+def _call_site() -> str:
+    """file:line of the innermost project frame outside this module."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(_PROJECT_DIR)
+            and filename != __file__
+            and "site-packages" not in filename
+        ):
+            return f"{os.path.relpath(filename, _PROJECT_DIR)}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "?"
+
+
+class QueryLog:
+    """``execute_wrapper`` recording the duration and origin of each query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        site = _call_site()
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start, site))
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(duration for _, duration, _ in self.queries)
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        """
+        Statements run at least ``threshold`` times from the same call site.
+
+        Returns ``(count, seconds, call site, fingerprint)`` tuples, most
+        frequent first.
+        """
+        counts = Counter()
+        seconds = defaultdict(float)
+        for sql, duration, site in self.queries:
+            key = (site, fingerprint(sql))
+            counts[key] += 1
+            seconds[key] += duration
+        return [
+            (count, seconds[key], key[0], key[1])
+            for key, count in counts.most_common()
+            if count >= threshold
+        ]
+
+    def write(self, path: Path, elapsed: float):
+        repeated = self.repeated()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(
+                f"{len(self.queries)} queries in {self.total_seconds * 1000:.1f} ms "
+                f"({elapsed * 1000:.1f} ms total)\n\n"
+            )
+            f.write(f"Repeated from one call site (possible N+1): {len(repeated)}\n")
+            for count, seconds, site, sql in repeated:
+                f.write(f"  {count:6}x {seconds * 1000:9.1f} ms  {site}\n")
+                f.write(f"          {sql}\n")
+            f.write("\nAll queries:\n")
+            for sql, duration, site in self.queries:
+                f.write(f"  {duration * 1000:9.3f} ms  {site}  {sql}\n")
+
+
+@dataclass
+class ProfileResult:
+    elapsed: float = 0.0
+    stats_path: Optional[Path] = None
+    queries_path: Optional[Path] = None
+    queries: QueryLog = field(default_factory=QueryLog)
+    repeated: List[tuple] = field(default_factory=list)
+
+
+@contextmanager
+def profile(name: str, directory=None):
+    """
+    Profile the block and record its queries.
+
+    Yields a ``ProfileResult`` whose fields are filled in when the block
+    exits, after the files are written.
+    """
+    directory = Path(directory or settings.PROFILE_DIR)
+    result = ProfileResult()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(result.queries):
+            profiler.enable()
+            try:
+                yield result
+            finally:
+                profiler.disable()
+    finally:
+        result.elapsed = time.perf_counter() - start
+        directory.mkdir(parents=True, exist_ok=True)
+        stem = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        result.stats_path = directory / f"{stem}.prof"
+        result.queries_path = directory / f"{stem}.queries.log"
+        profiler.dump_stats(result.stats_path)
+        result.queries.write(result.queries_path, result.elapsed)
+        result.repeated = result.queries.repeated()
+
+
+def task_enabled(name: str) -> bool:
+    tasks = getattr(settings, "PROFILE_TASKS", [])
+    return "*" in tasks or name in tasks
+
+
+def profiled(func):
+    """Profile a task when it is listed in ``PROFILE_TASKS``."""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not task_enabled(func.__name__):
+            return func(*args, **kwargs)
+        with profile(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
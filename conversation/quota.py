@@ -0,0 +1,61 @@
+# conversation/quota.py
+"""
+Gmail API quota budget per mailbox.
+
+Gmail limits the quota units each account may use per second. Every
+request of a mailbox is charged to its own budget of
+``GMAIL_MAILBOX_QUOTA_UNITS`` per ``GMAIL_MAILBOX_QUOTA_WINDOW`` seconds,
+counted in the Django cache so all workers share it. A cache local to the
+process would give each one its own budget (or none with the dummy cache),
+so charging raises ImproperlyConfigured, unless a local one was chosen for a single
+process with ``CACHE_URL=locmem://``. A request over budget
+raises ``QuotaExceeded`` instead of being sent, and the task retries once
+the window has passed, so a busy mailbox waits for itself without using up
+a shared limit or holding back the others.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .locks import require_shared_cache
+from .metrics import GMAIL_QUOTA_UNITS
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(
+            f"Gmail quota budget of {key} used, retry in {retry_after:.0f}s"
+        )
+        self.key = key
+        self.retry_after = retry_after
+
+
+def charge(key: str, method: str):
+    """
+    Charge the units of a Gmail API method to the budget of ``key``.
+
+    Raises:
+        QuotaExceeded: The budget of the current window is used up.
+        ImproperlyConfigured: The budget would be counted per process.
+    """
+    units = GMAIL_QUOTA_UNITS.get(method, 0)
+    budget = settings.GMAIL_MAILBOX_QUOTA_UNITS
+    if not units or not budget:
+        return
+    if settings.CACHE_URL != "locmem://":
+        require_shared_cache()
+    window = settings.GMAIL_MAILBOX_QUOTA_WINDOW
+    now = time.time()
+    start = int(now // window * window)
+    cache_key = f"quota:{key}:{start}"
+    cache.add(cache_key, 0, window * 2)
+    try:
+        used = cache.incr(cache_key, units)
+    except ValueError:
+        # Evicted between add and incr
+        cache.add(cache_key, units, window * 2)
+        used = units
+    if used > budget:
+        raise QuotaExceeded(key, start + window - now)
@@ -0,0 +1,113 @@
+# conversation/serializers.py
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+from .models import Contact, Conversation, Message, ScheduledMessage
+
+
+def requested_fields(request):
+    """Field names of ``?fields=a,b``, None when every field is wanted"""
+    value = request.query_params.get("fields") if request is not None else None
+    if not value:
+        return None
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+class SparseFieldsSerializer(serializers.ModelSerializer):
+    """
+    Serializes only the fields named by ``?fields=`` when given.
+
+    ``Meta.columns`` maps a field to the model columns it reads, by default
+    the column of the same name, so views can load nothing else.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        names = requested_fields(self.context.get("request"))
+        if names is not None:
+            for name in set(self.fields) - names:
+                self.fields.pop(name)
+
+    @classmethod
+    def columns(cls, request) -> list:
+        """Model columns needed for the fields requested by ``request``"""
+        fields = cls.Meta.fields
+        names = requested_fields(request)
+        if names is not None:
+            unknown = names - set(fields)
+            if unknown:
+                raise ValidationError(
+                    {"fields": f"Unknown fields: {', '.join(sorted(unknown))}"}
+                )
+            fields = [name for name in fields if name in names]
+        mapping = getattr(cls.Meta, "columns", {})
+        return [column for name in fields for column in mapping.get(name, [name])]
+
+
+class ContactSerializer(SparseFieldsSerializer):
+    class Meta:
+        model = Contact
+        fields = ["id", "email", "name", "created_at", "last_contact"]
+
+
+class ContactSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Contact
+        fields = ["id", "email", "name"]
+
+
+class ConversationSerializer(SparseFieldsSerializer):
+    contact = ContactSummarySerializer(read_only=True)
+    mailbox = serializers.CharField(
+        source="mailbox.email_address", read_only=True, default=None
+    )
+
+    class Meta:
+        model = Conversation
+        fields = [
+            "id",
+            "thread_id",
+            "contact",
+            "mailbox",
+            "last_updated",
+            "hydrated_at",
+        ]
+        columns = {
+            "contact": ["contact__id", "contact__email", "contact__name"],
+            "mailbox": ["mailbox__email_address"],
+        }
+
+
+class MessageSerializer(SparseFieldsSerializer):
+    class Meta:
+        model = Message
+        fields = [
+            "id",
+            "message_id",
+            "conversation",
+            "message_type",
+            "subject",
+            "content",
+            "sender",
+            "receiver",
+            "timestamp",
+        ]
+
+
+class ScheduledMessageSerializer(SparseFieldsSerializer):
+    contact = serializers.EmailField(
+        source="conversation.contact.email", read_only=True
+    )
+
+    class Meta:
+        model = ScheduledMessage
+        fields = [
+            "id",
+            "conversation",
+            "contact",
+            "draft_subject",
+            "draft_content",
+            "scheduled_send_time",
+            "created_at",
+        ]
+        columns = {"contact": ["conversation__contact__email"]}
@@ -0,0 +1,166 @@
+# conversation/services/archive.py
+"""
+Hot/cold partitioning of conversations.
+
+Conversations idle for longer than a cut-off, with nothing left to send, are
+moved with their messages and scheduled messages into the ``Archived*``
+tables, so the live tables only hold active conversations. Rows keep their
+primary keys and are copied with ``INSERT ... SELECT`` so compressed bodies
+are moved as-is. A conversation is moved back as soon as new mail arrives on
+its thread.
+
+Archiving records when it last removed rows from the live tables, as API
+ETags cannot see a removal in the latest values of the remaining rows.
+"""
+
+import logging
+import time
+from datetime import timedelta
+from typing import List, Optional
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from ..models import (
+    ArchivedConversation,
+    ArchivedMessage,
+    ArchivedScheduledMessage,
+    Conversation,
+    Message,
+    ScheduledMessage,
+)
+from .search import index_messages
+
+logger = logging.getLogger(__name__)
+
+LAST_ARCHIVED_KEY = "archive:last"
+
+# (live model, archive model, column holding the conversation id), parents first
+PARTITIONED_TABLES = [
+    (Conversation, ArchivedConversation, "id"),
+    (Message, ArchivedMessage, "conversation_id"),
+    (ScheduledMessage, ArchivedScheduledMessage, "conversation_id"),
+]
+
+
+def last_archived() -> Optional[float]:
+    """Time conversations were last archived, None if unknown"""
+    return cache.get(LAST_ARCHIVED_KEY)
+
+
+def idle_conversations(days: int):
+    """Live conversations idle for ``days`` with no pending scheduled message."""
+    cutoff = timezone.now() - timedelta(days=days)
+    pending = ScheduledMessage.objects.filter(
+        conversation=OuterRef("pk"), sent=False, canceled=False
+    )
+    return Conversation.objects.filter(last_updated__lt=cutoff).exclude(Exists(pending))
+
+
+def archive_idle_conversations(
+    days: int, chunk_size: int = 500, dry_run: bool = False
+) -> int:
+    """
+    Move idle conversations into the archive tables.
+
+    Each chunk of conversations is moved in its own transaction, and the
+    idle condition is checked again inside it so a conversation that just
+    received mail is left alone.
+
+    Args:
+        days: Minimum number of days since the conversation was updated.
+        chunk_size: Number of conversations moved per transaction.
+        dry_run: Only count the conversations that would be archived.
+
+    Returns:
+        The number of conversations archived.
+    """
+    if dry_run:
+        return idle_conversations(days).count()
+
+    total = 0
+    last_id = 0
+    while True:
+        ids = list(
+            idle_conversations(days)
+            .filter(pk__gt=last_id)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return total
+        last_id = ids[-1]
+
+        with transaction.atomic():
+            ids = list(
+                idle_conversations(days)
+                .filter(pk__in=ids)
+                .select_for_update()
+                .values_list("pk", flat=True)
+            )
+            if not ids:
+                continue
+            for live, archived, column in PARTITIONED_TABLES:
+                _copy_rows(live, archived, column, ids)
+            # Messages and scheduled messages go with the conversation
+            Conversation.objects.filter(pk__in=ids).delete()
+            transaction.on_commit(
+                lambda: cache.set(LAST_ARCHIVED_KEY, time.time(), None)
+            )
+
+        total += len(ids)
+        logger.info("Archived %s conversations", total)
+
+
+def rehydrate_conversation(thread_id: str) -> Optional[Conversation]:
+    """
+    Move an archived conversation back into the live tables.
+
+    Args:
+        thread_id: The Gmail thread ID of the conversation.
+
+    Returns:
+        The live conversation, or None if the thread was not archived.
+    """
+    with transaction.atomic():
+        ids = list(
+            ArchivedConversation.objects.filter(thread_id=thread_id)
+            .select_for_update()
+            .values_list("pk", flat=True)
+        )
+        if not ids:
+            return None
+
+        for live, archived, column in PARTITIONED_TABLES:
+            _copy_rows(archived, live, column, ids)
+        ArchivedConversation.objects.filter(pk__in=ids).delete()
+
+        index_messages(
+            Message.objects.filter(conversation_id__in=ids).only(
+                "id", "subject", "content"
+            )
+        )
+
+    logger.info("Rehydrated archived conversation %s", thread_id)
+    return Conversation.objects.get(pk=ids[0])
+
+
+def _copy_rows(source, target, column: str, ids: List[int]):
+    """Copy the rows of ``source`` matching ``column IN ids`` into ``target``."""
+    quote = connection.ops.quote_name
+    target_columns = {field.column for field in target._meta.concrete_fields}
+    columns = ", ".join(
+        quote(field.column)
+        for field in source._meta.concrete_fields
+        if field.column in target_columns
+    )
+    placeholders = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(target._meta.db_table)} ({columns}) "
+            f"SELECT {columns} FROM {quote(source._meta.db_table)} "
+            f"WHERE {quote(column)} IN ({placeholders})",
+            ids,
+        )
@@ -0,0 +1,108 @@
+# conversation/services/attachment_store.py
+"""
+Content-addressed file store for email attachments.
+
+Files are stored under ``<root>/<aa>/<bb>/<sha256>`` and written in chunks
+through a temporary file, so storing an attachment never needs more memory
+than one chunk, and identical attachments are only stored once.
+"""
+
+import base64
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterable, Union
+
+# Base64 text is decoded in multiples of 4 characters (3 bytes each)
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class AttachmentStore:
+    """A directory of files named after the SHA-256 of their content."""
+
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+
+    def path(self, digest: str) -> Path:
+        """Return the path where the content with this digest is stored."""
+        return self.root / digest[:2] / digest[2:4] / digest
+
+    def exists(self, digest: str) -> bool:
+        return self.path(digest).exists()
+
+    def open(self, digest: str):
+        """Open stored content for binary reading."""
+        return open(self.path(digest), "rb")
+
+    def put_chunks(self, chunks: Iterable[bytes]) -> str:
+        """
+        Store binary content given as an iterable of chunks.
+
+        Args:
+            chunks: The content, in order.
+
+        Returns:
+            The hex SHA-256 digest identifying the stored content.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            hexdigest = digest.hexdigest()
+            target = self.path(hexdigest)
+            if target.exists():
+                os.unlink(tmp_path)
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, target)
+            return hexdigest
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def put_base64(
+        self, data: Iterable[str], chunk_size: int = DEFAULT_CHUNK_SIZE
+    ) -> str:
+        """
+        Store content given as base64url text, decoding it chunk by chunk.
+
+        Args:
+            data: The base64url text, either as one string or as an iterable
+                of string fragments of any size.
+            chunk_size: Number of base64 characters decoded at a time.
+
+        Returns:
+            The hex SHA-256 digest identifying the stored content.
+        """
+        if isinstance(data, str):
+            data = [data]
+        return self.put_chunks(iter_base64_decoded(data, chunk_size))
+
+
+def iter_base64_decoded(
+    fragments: Iterable[str], chunk_size: int = DEFAULT_CHUNK_SIZE
+) -> Iterable[bytes]:
+    """Decode base64url text fragments into binary chunks of bounded size."""
+    chunk_size -= chunk_size % 4
+    pending = ""
+    for fragment in fragments:
+        if pending:
+            fragment = pending + fragment
+        aligned = len(fragment) - len(fragment) % 4
+        for start in range(0, aligned, chunk_size):
+            yield base64.urlsafe_b64decode(
+                fragment[start : min(start + chunk_size, aligned)]
+            )
+        # Carry at most 3 characters over to the next fragment
+        pending = fragment[aligned:]
+
+    if pending:
+        # Gmail omits the padding on some payloads
+        yield base64.urlsafe_b64decode(pending + "=" * (-len(pending) % 4))
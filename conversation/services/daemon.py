@@ -0,0 +1,156 @@
+# conversation/services/daemon.py
+"""
+Long-running fetch-and-send loop, an alternative to the beat sweeps.
+
+One process keeps its Gmail and NLP clients between passes and picks the
+time of the next pass itself: ``min_interval`` after a pass that received
+mail, doubling up to ``max_interval`` while the mailbox is idle, and never
+later than the send time of the next pending scheduled message. An email
+that fails is logged and skipped; a pass that fails is logged and the next
+one waits longer after each failure in a row, up to ``max_interval``.
+
+A daemon serves the mailbox of its processor. Each pass holds the same
+locks as the beat sweeps, so the daemon and a beat schedule left running do
+not work on the mailbox at the same time. After each pass a heartbeat is
+written as JSON (and to the metrics when enabled) for liveness checks.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .. import metrics
+from ..locks import singleton
+from ..models import ScheduledMessage
+from ..quota import QuotaExceeded
+from .email_processor import EmailProcessor
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before retrying messages that are due but were not sent
+RETRY_DUE_INTERVAL = 5.0
+
+
+class EmailDaemon:
+    def __init__(
+        self,
+        processor=None,
+        min_interval: float = 5.0,
+        max_interval: float = 300.0,
+        backoff: float = 2.0,
+        heartbeat_path=None,
+    ):
+        self.processor = processor or EmailProcessor()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.heartbeat_path = Path(heartbeat_path) if heartbeat_path else None
+        self.interval = min_interval
+        self.passes = 0
+        # Passes failed in a row
+        self.errors = 0
+        self._stop = threading.Event()
+
+    def stop(self, *args):
+        """Finish the current pass and exit, usable as a signal handler."""
+        if not self._stop.is_set():
+            logger.info("Stopping after the current pass")
+        self._stop.set()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop.is_set()
+
+    def run(self):
+        logger.info(
+            "Polling every %s to %s seconds", self.min_interval, self.max_interval
+        )
+        while not self.stopping:
+            delay = self.run_once()
+            logger.debug("Next pass in %.1f seconds", delay)
+            self._stop.wait(delay)
+        logger.info("Stopped after %d passes", self.passes)
+
+    def run_once(self) -> float:
+        """Fetch and send once, returning the seconds until the next pass."""
+        # Drop connections past CONN_MAX_AGE or broken while sleeping
+        close_old_connections()
+        received = sent = 0
+        mailbox = self.processor.mailbox
+        poll_lock = f"poll_mailbox:{mailbox.pk if mailbox else None}"
+        try:
+            with singleton(poll_lock) as acquired:
+                if acquired:
+                    received = self.processor.process_new_emails()
+            with singleton("send_scheduled_emails") as acquired:
+                if acquired:
+                    sent = self.processor.send_scheduled_messages()
+        except QuotaExceeded as e:
+            logger.warning("%s, pausing", e)
+            self.interval = max(self.min_interval, e.retry_after)
+            self.passes += 1
+            self.heartbeat(received, sent, self.interval)
+            return self.interval
+        except Exception:
+            self.errors += 1
+            self.interval = min(
+                self.min_interval * self.backoff**self.errors, self.max_interval
+            )
+            logger.exception("Pass failed, retrying in %.1f seconds", self.interval)
+            self.passes += 1
+            self.heartbeat(received, sent, self.interval)
+            return self.interval
+        finally:
+            close_old_connections()
+
+        self.passes += 1
+        self.errors = 0
+        if received:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        delay = self.next_delay()
+        self.heartbeat(received, sent, delay)
+        return delay
+
+    def next_delay(self) -> float:
+        """The polling interval, shortened to wake up for the next send."""
+        next_send = (
+            ScheduledMessage.objects.filter(
+                sent=False, canceled=False, conversation__mailbox=self.processor.mailbox
+            )
+            .order_by("scheduled_send_time")
+            .values_list("scheduled_send_time", flat=True)
+            .first()
+        )
+        if next_send is None:
+            return self.interval
+        until_send = (next_send - timezone.now()).total_seconds()
+        if until_send <= 0:
+            # Still due after the sweep: sending failed or the lock was held
+            return min(self.interval, RETRY_DUE_INTERVAL)
+        return min(self.interval, until_send)
+
+    def heartbeat(self, received: int, sent: int, delay: float):
+        metrics.DAEMON_HEARTBEAT.set(time.time())
+        if self.heartbeat_path is None:
+            return
+        data = {
+            "pid": os.getpid(),
+            "time": timezone.now().isoformat(),
+            "passes": self.passes,
+            "received": received,
+            "sent": sent,
+            "errors": self.errors,
+            "next_pass_in": round(delay, 3),
+        }
+        self.heartbeat_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.heartbeat_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, self.heartbeat_path)
@@ -0,0 +1,151 @@
+# conversation/services/decision.py
+"""
+The ``openrouter`` NLP backend: decisions made by the LLM in one request
+per message.
+
+The reply, the time to wait before sending it and the follow-up are asked
+for together, as one structured result, instead of one request each.
+``decide_batch`` decides for many messages with at most
+``LLM_MAX_CONCURRENCY`` requests in flight.
+"""
+
+import asyncio
+import datetime
+import logging
+from pathlib import Path
+from typing import List, Optional, Union
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.utils import timezone
+from pydantic import BaseModel, Field
+from pydantic_ai import Agent
+
+from .. import metrics
+from ..log import log_context, trunc
+from ..models import Message
+from .latency_determination import LatencyConfig, model
+from .nlp_service import Decision, NLPBackend
+
+logger = logging.getLogger(__name__)
+
+PROMPT_PATH = Path(__file__).resolve().parent.parent / "prompts" / "decide.prompt"
+
+
+class ResponseDecision(BaseModel):
+    """Structured result of a decision."""
+
+    reasoning: str = Field(..., description="The reasoning behind these decisions")
+    reply: str = Field(..., description="The response to the latest email")
+    days: int = Field(..., ge=0, description="Days to wait before responding")
+    hours: int = Field(..., ge=0, description="Hours to wait before responding")
+    minutes: int = Field(..., ge=0, description="Minutes to wait before responding")
+    followup_days: int = Field(
+        ..., ge=1, description="Days without an answer before following up"
+    )
+    followup_subject: str = Field(..., description="Subject of the follow-up")
+    followup_body: str = Field(..., description="Text of the follow-up")
+
+
+class ResponseDecider(NLPBackend):
+    """Decides the reply, latency and follow-up of a message with the LLM."""
+
+    name = "openrouter"
+
+    def __init__(self, config: Optional[LatencyConfig] = None, llm=None):
+        """
+        Args:
+            config: Business hours, as for latency decisions.
+            llm: The pydantic-ai model to use, the OpenRouter one by default.
+        """
+        self.agent = Agent(model=llm or model, result_type=ResponseDecision)
+        self.config = config or LatencyConfig()
+        self.template = PROMPT_PATH.read_text()
+
+    def prompt(self, message: Message, history=None) -> str:
+        """The prompt for a stored message and the history of its thread."""
+        now = timezone.localtime()
+        business_hours = (
+            self.config.business_hours_start
+            <= now.hour
+            < self.config.business_hours_end
+        )
+        if history is None:
+            history = message.conversation.messages.order_by("timestamp", "pk")
+        return self.template.format(
+            conversation_history="".join(str(m) for m in history),
+            message=str(message),
+            time=str(now),
+            business_hours_yn="yes" if business_hours else "no",
+            weekend_yn="yes" if now.weekday() >= 5 else "no",
+        )
+
+    def decide(self, message: Message, history=None) -> Decision:
+        """Decide for one message, raising if the request fails."""
+        prompt = self.prompt(message, history)
+        return async_to_sync(self._decide)(message, prompt)
+
+    def decide_batch(
+        self,
+        messages: List[Message],
+        max_concurrency: Optional[int] = None,
+        histories=None,
+    ) -> List[Union[Decision, Exception]]:
+        """
+        Decide for several messages concurrently.
+
+        Args:
+            messages: The stored messages to decide for.
+            max_concurrency: Requests in flight at once, LLM_MAX_CONCURRENCY
+                by default.
+            histories: The conversation history to show for each message,
+                by default the stored conversation.
+
+        Returns:
+            The decisions in the order of ``messages``, with the exception
+            raised in place of the decision of a message whose request failed.
+        """
+        # Prompts query the database, which cannot be done from the event loop
+        histories = histories or [None] * len(messages)
+        prompts = [
+            self.prompt(message, history)
+            for message, history in zip(messages, histories)
+        ]
+        return async_to_sync(self._decide_all)(
+            messages, prompts, max_concurrency or settings.LLM_MAX_CONCURRENCY
+        )
+
+    async def _decide_all(self, messages, prompts, max_concurrency):
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def decide_one(message, prompt):
+            async with semaphore:
+                try:
+                    return await self._decide(message, prompt)
+                except Exception as e:
+                    logger.error(
+                        "Error deciding for message %s: %s", message.message_id, e
+                    )
+                    return e
+
+        return await asyncio.gather(
+            *(decide_one(message, prompt) for message, prompt in zip(messages, prompts))
+        )
+
+    async def _decide(self, message: Message, prompt: str) -> Decision:
+        with log_context(gmail_message_id=message.message_id):
+            with metrics.LLM_REQUEST_SECONDS.time(
+                metrics.LLM_REQUEST_ERRORS, operation="decide"
+            ):
+                response = await self.agent.run(prompt)
+            logger.debug("Decision: %s", trunc(response.data, 200))
+
+        result = response.data
+        return Decision(
+            reply=result.reply,
+            latency_minutes=result.days * 24 * 60 + result.hours * 60 + result.minutes,
+            followup_time=timezone.now()
+            + datetime.timedelta(days=result.followup_days),
+            followup_subject=result.followup_subject,
+            followup_body=result.followup_body,
+        )
@@ -1,49 +1,141 @@
 # conversation/services/email_processor.py
+import logging
 from datetime import datetime, timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Now
 from django.utils import timezone
 
+from .. import events, metrics, tracing
+from ..log import bind, fields, log_context, trunc
+from ..quota import QuotaExceeded
 from ..models import (
     Contact,
     Conversation,
     Message,
     ScheduledMessage,
 )
+from .archive import rehydrate_conversation
 from .gmail_service import GmailService
-from .nlp_service import NLPService
+from .mail_import import IMPORTED_THREAD_PREFIX, message_ids
+from .nlp_service import get_backend
+from .quote_stripping import strip_quoted_text
+from .search import index_messages
+
+logger = logging.getLogger(__name__)
+
+# A send claimed for longer than this is taken over by another worker
+SEND_CLAIM_SECONDS = 600
+
+
+def due_scheduled_messages():
+    """Pending scheduled messages whose send time has passed, oldest first"""
+    # Served by the partial index on pending rows
+    return ScheduledMessage.objects.filter(
+        scheduled_send_time__lte=timezone.now(), sent=False, canceled=False
+    ).order_by("scheduled_send_time")
 
 
 class EmailProcessor:
-    def __init__(self):
-        self.gmail = GmailService()
-        self.nlp = NLPService()
+    def __init__(self, gmail=None, nlp=None, mailbox=None):
+        """
+        Args:
+            gmail: The GmailService to use, built for ``mailbox`` by default.
+            nlp: The NLP backend deciding the responses, NLP_BACKEND by
+                default.
+            mailbox: The Mailbox whose mail is processed, None for the
+                account of the token file when no mailbox is configured.
+        """
+        self.mailbox = mailbox
+        self.gmail = gmail or GmailService(mailbox=mailbox)
+        self.nlp = nlp or get_backend()
 
     def process_new_emails(self):
-        """Process all new unread emails"""
-        unread_messages = self.gmail.get_unread_messages()
-
-        for message_data in unread_messages:
-            self._process_single_email(message_data)
+        """Process all new unread emails, returning how many were listed"""
+        page_token = None
+        count = 0
+        while True:
+            unread_messages, page_token = self.gmail.list_unread_page(page_token)
+            for message_data in unread_messages:
+                try:
+                    self._process_single_email(message_data)
+                except QuotaExceeded:
+                    raise
+                except Exception:
+                    # One bad email must not hold back the rest of the page
+                    logger.exception("Could not process email %s", message_data["id"])
+            count += len(unread_messages)
+            if not page_token:
+                return count
 
     def _process_single_email(self, message_data):
         """Process a single email message"""
-        print(f"[DEBUG] Processing new email with data: {message_data}")
-        message_details = self.gmail.get_message_details(message_data["id"])
-        print(f"[DEBUG] Retrieved message details: {message_details}")
+        with tracing.start_span("email"):
+            message = self.ingest_email(message_data["id"])
+            if message is not None:
+                self.schedule_response(message)
+
+    def ingest_email(self, gmail_message_id):
+        """
+        Fetch an email and store it in its conversation.
+
+        Returns the stored message, or None if it was already stored (a
+        redelivered or duplicate task).
+        """
+        with (
+            log_context(gmail_message_id=gmail_message_id),
+            metrics.STAGE_SECONDS.time(metrics.STAGE_ERRORS, stage="ingest"),
+            tracing.start_span(
+                "ingest", attributes={"gmail_message_id": gmail_message_id}
+            ),
+        ):
+            return self._ingest_email(gmail_message_id)
+
+    def _ingest_email(self, gmail_message_id):
+        if Message.objects.filter(message_id=gmail_message_id).exists():
+            logger.info("Message already stored, skipping")
+            return None
+
+        message_details = self.gmail.get_message_details(gmail_message_id)
+        bind(thread_id=message_details["threadId"])
+        logger.debug(
+            "Retrieved message details: %s",
+            fields(message_details, "from", "subject", "date", "body"),
+        )
+        if self._adopt_imported(message_details):
+            logger.info("Message was imported, now keyed by its Gmail ID")
+            return None
 
         # Get or create contact
         contact, created = Contact.objects.get_or_create(
             email=message_details["from"],
             defaults={"name": ""},  # Extract name in real implementation
         )
-        print(f"[DEBUG] {'Created' if created else 'Found'} contact: {contact.email}")
+        logger.debug("%s contact %s", "Created" if created else "Found", contact.pk)
 
-        # Get or create conversation
+        # Bring the thread back from the archive if it went idle
+        rehydrate_conversation(message_details["threadId"])
+
+        # Get or create conversation, a thread started by this message has no
+        # earlier mail to fetch
+        first_in_thread = message_details["id"] == message_details["threadId"]
         conversation, created = Conversation.objects.get_or_create(
-            thread_id=message_details["threadId"], defaults={"contact": contact}
+            thread_id=message_details["threadId"],
+            defaults={
+                "contact": contact,
+                "mailbox": self.mailbox,
+                "hydrated_at": timezone.now() if first_in_thread else None,
+            },
         )
-        print(
-            f"[DEBUG] {'Created' if created else 'Found'} conversation with thread ID: {conversation.thread_id}"
+        logger.debug(
+            "%s conversation %s", "Created" if created else "Found", conversation.pk
         )
+        if conversation.hydrated_at is None:
+            self._hydrate_conversation(conversation, message_details)
+
+        # Keep the raw body, but only pass the new text on to the NLP layer
+        raw_body = message_details["body"]
+        body = strip_quoted_text(raw_body)
 
         # Save the incoming message
         message = Message.objects.create(
@@ -51,122 +143,399 @@ class EmailProcessor:
             message_id=message_details["id"],
             message_type="INCOMING",
             subject=message_details.get("subject", ""),
-            content=message_details["body"],
+            content=body,
+            raw_content=raw_body,
+            timestamp=_received_at(message_details),
+        )
+        logger.info(
+            "Stored incoming message %s (%d of %d chars kept)",
+            message.pk,
+            len(body),
+            len(raw_body),
+        )
+
+        # Keep the conversation out of the archive while it is active
+        conversation.save(update_fields=["last_updated"])
+        events.publish_on_commit(
+            "received",
+            message=message.pk,
+            conversation=conversation.pk,
+            sender=contact.email,
+            subject=message.subject,
+        )
+        return message
+
+    def _adopt_imported(self, message_details) -> bool:
+        """
+        Give mail imported from an export (see mail_import.py) its Gmail IDs.
+
+        Mail imported without Gmail headers is keyed by its Message-ID header
+        and its conversation by an ``IMPORTED_THREAD_PREFIX`` thread ID. When
+        that mail, or a reply to it, comes through Gmail, the stored rows are
+        re-keyed so the thread is neither stored twice nor fetched again.
+
+        Returns True if the message itself was imported.
+        """
+        header_ids = message_ids(message_details.get("message-id"))
+        parent_ids = message_ids(
+            f"{message_details.get('in-reply-to', '')} "
+            f"{message_details.get('references', '')}"
         )
-        print(f"[DEBUG] Saved incoming message with ID: {message.message_id}")
+        if not header_ids and not parent_ids:
+            return False
+
+        thread_id = message_details["threadId"]
+        with transaction.atomic():
+            imported = (
+                Message.objects.filter(
+                    message_id__in=header_ids + parent_ids,
+                    conversation__thread_id__startswith=IMPORTED_THREAD_PREFIX,
+                )
+                .values_list("conversation_id", flat=True)
+                .first()
+            )
+            if (
+                imported is not None
+                and not Conversation.objects.filter(thread_id=thread_id).exists()
+            ):
+                Conversation.objects.filter(pk=imported).update(thread_id=thread_id)
+            adopted = Message.objects.filter(message_id__in=header_ids[:1]).update(
+                message_id=message_details["id"]
+            )
+        return adopted > 0
+
+    def _hydrate_conversation(self, conversation, message_details):
+        """
+        Store the earlier messages of a thread seen for the first time.
+
+        The whole thread is fetched in one request, and the messages before
+        ``message_details`` that are not stored yet are inserted in bulk.
+        Drafts are left out, and so is unread mail, which is ingested (and
+        answered) on its own. If the fetch fails the conversation stays
+        unhydrated and is tried again with the next message of the thread.
+        """
+        thread_messages = self.gmail.get_thread_messages(conversation.thread_id)
+        if thread_messages is None:
+            logger.warning("Could not fetch thread, not hydrated")
+            return
+
+        earlier = []
+        # Threads are listed oldest first
+        for details in thread_messages:
+            if details["id"] == message_details["id"]:
+                break
+            labels = details["labelIds"]
+            if "DRAFT" not in labels and "UNREAD" not in labels:
+                earlier.append(details)
+        stored = set(
+            Message.objects.filter(
+                message_id__in=[details["id"] for details in earlier]
+            ).values_list("message_id", flat=True)
+        )
+        rows = []
+        for details in earlier:
+            if details["id"] in stored:
+                continue
+            raw_body = details["body"]
+            rows.append(
+                Message(
+                    conversation=conversation,
+                    message_id=details["id"],
+                    message_type=(
+                        "OUTGOING" if "SENT" in details["labelIds"] else "INCOMING"
+                    ),
+                    subject=details["subject"],
+                    content=strip_quoted_text(raw_body),
+                    raw_content=raw_body,
+                    timestamp=_received_at(details),
+                )
+            )
+        if rows:
+            # Racing workers may insert the same rows, keep the first
+            Message.objects.bulk_create(rows, ignore_conflicts=True)
+            # bulk_create skips the post_save indexing and, ignoring
+            # conflicts, does not set the primary keys
+            index_messages(
+                Message.objects.filter(
+                    message_id__in=[row.message_id for row in rows]
+                ).only("id", "subject", "content")
+            )
+
+        conversation.hydrated_at = timezone.now()
+        Conversation.objects.filter(pk=conversation.pk).update(
+            hydrated_at=conversation.hydrated_at
+        )
+        logger.info(
+            "Hydrated conversation %s with %d earlier messages",
+            conversation.pk,
+            len(rows),
+        )
+
+    def schedule_response(self, message, traceparent=None):
+        """
+        Draft a response to a stored incoming message and schedule it.
 
-        # Generate a response
-        response_content = self.nlp.generate_response(message_details["body"])
-        print(f"[DEBUG] Generated response content: {response_content[:100]}...")
+        ``traceparent`` is the trace context of the ingest when it ran in
+        another task.
+        """
+        with (
+            log_context(
+                gmail_message_id=message.message_id,
+                thread_id=message.conversation.thread_id,
+            ),
+            metrics.STAGE_SECONDS.time(metrics.STAGE_ERRORS, stage="decide"),
+            tracing.start_span("decide", parent=traceparent),
+        ):
+            self._schedule_response(message)
 
-        # Determine appropriate latency
-        latency_minutes = self.nlp.determine_latency(message_details["body"])
+    def _schedule_response(self, message):
+        conversation = message.conversation
+        contact = conversation.contact
+
+        # decide_response runs again when a worker dies before acknowledging it
+        if ScheduledMessage.objects.filter(in_reply_to=message).exists():
+            logger.info("Response to message %s already scheduled", message.pk)
+            return
+
+        # Reply, latency and follow-up come from one NLP call
+        decision = self.nlp.decide(message)
+        response_content = decision.reply
+        logger.debug("Generated response: %s", trunc(response_content))
+
+        latency_minutes = decision.latency_minutes
         send_time = timezone.now() + timedelta(minutes=latency_minutes)
-        print(
-            f"[DEBUG] Determined latency: {latency_minutes} minutes (send time: {send_time})"
+        logger.info(
+            "Determined latency: %s minutes (send time: %s)", latency_minutes, send_time
         )
 
         # TODO: determine if we should reply or notify the admin to take over
         # TODO: notify admin
 
         # Create and schedule response
-        draft_id = self.gmail.create_draft(
-            to=contact.email,
-            subject=f"Re: {message_details.get('subject', '')}",
-            body=response_content,
-            thread_id=conversation.thread_id,
+        with tracing.start_span("draft"):
+            draft_id = self.gmail.create_draft(
+                to=contact.email,
+                subject=f"Re: {message.subject}",
+                body=response_content,
+                thread_id=conversation.thread_id,
+            )
+        logger.debug("Created draft %s", draft_id)
+
+        # Schedule the response and its follow-up together
+        followup_time = decision.followup_time
+        logger.debug("Determined followup time: %s", followup_time)
+
+        followup_subject = decision.followup_subject
+        followup_content = decision.followup_body
+        logger.debug("Generated followup: %s", trunc(followup_content))
+
+        try:
+            with transaction.atomic():
+                scheduled_message = ScheduledMessage.objects.create(
+                    conversation=conversation,
+                    in_reply_to=message,
+                    draft_content=response_content,
+                    draft_subject=f"Re: {message.subject}",
+                    scheduled_send_time=send_time,
+                    trace_context=tracing.current_traceparent() or "",
+                )
+                followup_message = ScheduledMessage.objects.create(
+                    conversation=conversation,
+                    draft_content=followup_content,
+                    draft_subject=followup_subject,
+                    scheduled_send_time=followup_time,
+                    trace_context=tracing.current_traceparent() or "",
+                )
+                Conversation.objects.filter(pk=conversation.pk).update(
+                    last_updated=Now()
+                )
+        except IntegrityError:
+            # Another run of the task scheduled it first
+            logger.info("Response to message %s already scheduled", message.pk)
+            return
+        logger.info("Scheduled response %s", scheduled_message.pk)
+        logger.info("Scheduled followup %s at %s", followup_message.pk, followup_time)
+        events.publish_on_commit(
+            "scheduled",
+            message=message.pk,
+            conversation=conversation.pk,
+            latency_minutes=latency_minutes,
+            send_time=send_time,
+            followup_time=followup_time,
         )
-        print(f"[DEBUG] Created draft with ID: {draft_id}")
 
-        # Schedule the response
-        scheduled_message = ScheduledMessage.objects.create(
-            conversation=conversation,
-            draft_content=response_content,
-            draft_subject=f"Re: {message_details.get('subject', '')}",
-            scheduled_send_time=send_time,
+    def send_scheduled_messages(self, chunk_size=500):
+        """Send all scheduled responses whose time has come, returning how many"""
+        count = 0
+        for message_pk in self.due_scheduled_messages().iterator(chunk_size=chunk_size):
+            self.send_scheduled_message(message_pk)
+            count += 1
+        return count
+
+    def due_scheduled_messages(self):
+        """IDs of the due scheduled messages of this processor's mailbox"""
+        logger.debug("Checking for scheduled messages to send")
+        # Callers stream the ids so a large backlog is never loaded at once
+        return (
+            due_scheduled_messages()
+            .filter(conversation__mailbox=self.mailbox)
+            .values_list("pk", flat=True)
         )
-        print(f"[DEBUG] Scheduled response with ID: {scheduled_message.draft_subject}")
 
-        # Schedule a follow-up if needed
-        followup_time = self.nlp.determine_followup_time(message_details["body"])
-        print(f"[DEBUG] Determined followup time: {followup_time}")
+    def send_scheduled_message(self, message_pk):
+        """Claim a due scheduled message and send it"""
+        with (
+            log_context(scheduled_message_id=message_pk),
+            metrics.STAGE_SECONDS.time(metrics.STAGE_ERRORS, stage="send"),
+        ):
+            self._send_scheduled_message(message_pk)
 
-        followup_subject, followup_content = self.nlp.generate_followup_message()
-        print(f"[DEBUG] Generated followup content: {followup_content[:100]}...")
+    def _send_scheduled_message(self, message_pk):
+        message = self._claim_scheduled_message(message_pk)
+        if message is None:
+            logger.debug("Already claimed, sent or canceled")
+            return
 
-        followup_message = ScheduledMessage.objects.create(
-            conversation=conversation,
-            draft_content=followup_content,
-            draft_subject=followup_subject,
-            scheduled_send_time=followup_time,
-        )
-        print(f"[DEBUG] Scheduled followup with ID: {followup_message.draft_subject}")
+        bind(thread_id=message.conversation.thread_id)
+        # Same trace as the ingest and decision that scheduled it
+        with tracing.start_span(
+            "send",
+            parent=message.trace_context,
+            attributes={
+                "scheduled_message_id": message.pk,
+                "scheduled_send_time": message.scheduled_send_time.isoformat(),
+            },
+        ) as span:
+            self._deliver_scheduled_message(message, span)
+
+    def _claim_scheduled_message(self, message_pk):
+        """
+        Mark a pending scheduled message as being sent and return it.
 
-    def send_scheduled_messages(self):
-        """Send all scheduled responses whose time has come"""
+        The claim is a single UPDATE, so no transaction stays open while the
+        message is sent. Returns None if another worker holds a recent claim
+        or the message is no longer pending. A claim older than
+        ``SEND_CLAIM_SECONDS`` belongs to a worker that died and is taken over.
+        """
         now = timezone.now()
-        print(f"[DEBUG] Checking for scheduled messages to send at {now}")
-        messages_to_send = ScheduledMessage.objects.filter(
-            scheduled_send_time__lte=now, sent=False
+        stale = now - timedelta(seconds=SEND_CLAIM_SECONDS)
+        claimed = (
+            ScheduledMessage.objects.filter(pk=message_pk, sent=False, canceled=False)
+            .filter(Q(sending_since__isnull=True) | Q(sending_since__lt=stale))
+            .update(sending_since=now, last_updated=now)
+        )
+        if not claimed:
+            return None
+        return (
+            ScheduledMessage.objects.select_related("conversation__contact")
+            .filter(pk=message_pk)
+            .first()
         )
-        print(f"[DEBUG] Found {messages_to_send.count()} messages to process")
 
-        for message in messages_to_send:
-            print(f"[DEBUG] Processing scheduled message : {message.draft_subject}")
-            conversation = message.conversation
-            print(f"[DEBUG] Associated conversation : {conversation.id}")
+    def _release_claim(self, message):
+        """Leave a message that was not sent pending for the next sweep"""
+        ScheduledMessage.objects.filter(pk=message.pk).update(
+            sending_since=None, last_updated=Now()
+        )
 
-            # Check if there's been a response since scheduling the followup
-            latest_message = (
-                Message.objects.filter(conversation=conversation)
-                .order_by("-timestamp")
-                .first()
-            )
+    def _deliver_scheduled_message(self, message, span):
+        conversation = message.conversation
 
-            if latest_message:
-                print(
-                    f"[DEBUG] Latest message in conversation:\n {latest_message.content}\n#########################\nType {latest_message.message_type}, timestamp {latest_message.timestamp}"
-                )
+        # Check if there's been a response since scheduling the followup;
+        # legacy rows without a timestamp sort last on every database
+        latest_message = (
+            Message.objects.filter(conversation=conversation)
+            .order_by(F("timestamp").desc(nulls_last=True), "-pk")
+            .first()
+        )
 
-            if (
-                latest_message
-                and latest_message.message_type == "INCOMING"
-                and latest_message.timestamp > message.created_at
-            ):
-                print(
-                    "[DEBUG] New incoming message detected - canceling scheduled response"
+        if latest_message:
+            logger.debug(
+                "Latest message in conversation: %s %s at %s",
+                latest_message.message_type,
+                latest_message.pk,
+                latest_message.timestamp,
+            )
+
+        if (
+            latest_message
+            and latest_message.message_type == "INCOMING"
+            and latest_message.timestamp is not None
+            and latest_message.timestamp > message.created_at
+        ):
+            with transaction.atomic():
+                ScheduledMessage.objects.filter(pk=message.pk).update(
+                    canceled=True, sending_since=None, last_updated=Now()
                 )
-                message.canceled = True
-                message.save()
-                print(
-                    f"[DEBUG] Marked message as canceled : \n{message.draft_content}\n "
+                # Touch the conversation so API clients see the change
+                Conversation.objects.filter(pk=conversation.pk).update(
+                    last_updated=Now()
                 )
-                continue
+            span.set_attribute("outcome", "canceled")
+            logger.info("New incoming message, canceled scheduled response")
+            events.publish_on_commit(
+                "canceled", scheduled_message=message.pk, conversation=conversation.pk
+            )
+            return
 
-            print(f"[DEBUG] Preparing to send message ID: {message.draft_subject}")
-            try:
-                message_id = self.gmail.send_email(
-                    to=message.conversation.contact.email,
-                    subject=message.draft_subject,
-                    body=message.draft_content,
-                    thread_id=message.conversation.thread_id,
-                )
-                print(f"[DEBUG] Successfully sent email with message ID: {message_id}")
-            except Exception as e:
-                print(f"[ERROR] Failed to send email: {str(e)}")
-                continue
+        # Sent outside any transaction, the claim keeps other workers away
+        try:
+            message_id = self.gmail.send_email(
+                to=conversation.contact.email,
+                subject=message.draft_subject,
+                body=message.draft_content,
+                thread_id=conversation.thread_id,
+            )
+        except QuotaExceeded:
+            # Left pending, the task is retried when the budget refills
+            span.set_attribute("outcome", "over_quota")
+            self._release_claim(message)
+            raise
+        except Exception:
+            span.set_attribute("outcome", "failed")
+            logger.exception("Failed to send email")
+            self._release_claim(message)
+            return
+
+        # How late the message went out compared to the time it was due
+        drift = (timezone.now() - message.scheduled_send_time).total_seconds()
+        span.set_attribute("outcome", "sent")
+        span.set_attribute("schedule_drift_seconds", drift)
+        metrics.SCHEDULE_DRIFT_SECONDS.observe(drift)
 
+        with transaction.atomic():
             # Save the outgoing message
             outgoing_message = Message.objects.create(
-                conversation=message.conversation,
+                conversation=conversation,
                 message_id=message_id,
                 message_type="OUTGOING",
                 subject=message.draft_subject,
                 content=message.draft_content,
+                timestamp=timezone.now(),
             )
-            print(f"[DEBUG] Created outgoing message record ID: {outgoing_message.id}")
+
+            conversation.save(update_fields=["last_updated"])
 
             # Mark as sent
-            message.sent = True
-            message.save()
-            print(f"[DEBUG] Marked scheduled message ID {message.id} as sent")
+            ScheduledMessage.objects.filter(pk=message.pk).update(
+                sent=True, sending_since=None, last_updated=Now()
+            )
+        logger.info(
+            "Sent scheduled message as %s (message %s)",
+            message_id,
+            outgoing_message.pk,
+        )
+        events.publish_on_commit(
+            "sent",
+            scheduled_message=message.pk,
+            message=outgoing_message.pk,
+            conversation=conversation.pk,
+            drift_seconds=drift,
+        )
+
+
+def _received_at(message_details):
+    """When the message was received, or now if Gmail did not say."""
+    if message_details.get("timestamp"):
+        return datetime.fromisoformat(message_details["timestamp"])
+    return timezone.now()
@@ -0,0 +1,323 @@
+# conversation/services/export.py
+"""
+Streaming export of the live tables for analytics.
+
+Conversations, messages and scheduled messages are read in pages with
+keyset pagination (``WHERE key > last ORDER BY key LIMIT n``), so memory
+stays constant and no query scans what was already read. Each page is
+written as lines of a JSONL file or as a row group of a Parquet file.
+
+An export records in a watermark file the last key written for each table.
+Passing it back with ``since`` only exports the rows added (messages) or
+updated (conversations, scheduled messages) since; an updated row is
+exported again, so consumers keep the last version of each ID. Rows are
+read up to the keys found when the export starts, so rows written meanwhile
+are left to the next export.
+
+``sqlite_snapshot`` copies a SQLite database with the online backup API,
+so long exports read a copy and never hold the read lock writers wait on.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ..models import Conversation, Message, ScheduledMessage
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ["jsonl", "parquet"]
+
+
+@dataclass
+class ExportTable:
+    name: str
+    model: type
+    # Keyset columns, the last one unique
+    key: tuple
+    # Column compared with a ``since`` date
+    date_field: str
+    exclude: tuple = ()
+
+
+TABLES = [
+    ExportTable("conversations", Conversation, ("last_updated", "id"), "last_updated"),
+    ExportTable("messages", Message, ("id",), "timestamp", exclude=("raw_content",)),
+    ExportTable(
+        "scheduled_messages", ScheduledMessage, ("last_updated", "id"), "last_updated"
+    ),
+]
+
+
+def fields(table: ExportTable, raw: bool = False) -> List[models.Field]:
+    """The exported columns of a table, foreign keys as their ID column."""
+    return [
+        field
+        for field in table.model._meta.concrete_fields
+        if raw or field.name not in table.exclude
+    ]
+
+
+def _key_filter(table: ExportTable, last: list) -> Q:
+    """Rows after the key ``last``, (a, b) > (x, y) spelled out for any database."""
+    condition = Q()
+    for index in reversed(range(len(table.key))):
+        equal = {column: value for column, value in zip(table.key, last[:index])}
+        after = Q(**equal, **{f"{table.key[index]}__gt": last[index]})
+        condition = after if index == len(table.key) - 1 else after | condition
+    return condition
+
+
+def iter_pages(
+    table: ExportTable,
+    after: Optional[list] = None,
+    until: Optional[list] = None,
+    since: Optional[datetime] = None,
+    page_size: int = 5000,
+    using: str = "default",
+    raw: bool = False,
+) -> Iterator[List[dict]]:
+    """
+    Yield the rows of a table in key order, ``page_size`` at a time.
+
+    Args:
+        table: The table to read.
+        after: Key of the last row already exported.
+        until: Key of the last row to export.
+        since: Only rows whose ``date_field`` is at or after this time.
+        page_size: Rows per query.
+        using: Database alias to read from.
+        raw: Include the columns left out by default (raw message bodies).
+    """
+    columns = [field.attname for field in fields(table, raw)]
+    queryset = table.model._default_manager.using(using).order_by(*table.key)
+    if since is not None:
+        queryset = queryset.filter(**{f"{table.date_field}__gte": since})
+    if until is not None:
+        queryset = queryset.exclude(_key_filter(table, until))
+    last = after
+    while True:
+        page = queryset
+        if last is not None:
+            page = page.filter(_key_filter(table, last))
+        rows = list(page.values(*columns)[:page_size])
+        if not rows:
+            return
+        yield rows
+        last = [rows[-1][column] for column in table.key]
+
+
+def upper_key(table: ExportTable, using: str = "default") -> Optional[list]:
+    """Key of the last row of a table, None when it is empty."""
+    row = (
+        table.model._default_manager.using(using)
+        .order_by(*(f"-{column}" for column in table.key))
+        .values(*table.key)
+        .first()
+    )
+    return None if row is None else [row[column] for column in table.key]
+
+
+def read_watermark(path) -> Dict[str, list]:
+    """The last keys of a watermark file, dates parsed back."""
+    data = json.loads(Path(path).read_text())
+    return {
+        name: [_parse_key(value) for value in key]
+        for name, key in data["tables"].items()
+    }
+
+
+def _parse_key(value):
+    if isinstance(value, str):
+        return parse_datetime(value) or value
+    return value
+
+
+def _format_key(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def write_watermark(path, keys: Dict[str, Optional[list]]):
+    path = Path(path)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(
+        json.dumps(
+            {
+                "exported_at": timezone.now(),
+                # DjangoJSONEncoder would cut dates to milliseconds
+                "tables": {
+                    name: [_format_key(value) for value in key]
+                    for name, key in keys.items()
+                    if key is not None
+                },
+            },
+            cls=DjangoJSONEncoder,
+            indent=2,
+        )
+    )
+    os.replace(tmp, path)
+
+
+class JSONLWriter:
+    def __init__(self, path, table: ExportTable, raw: bool = False):
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, rows: List[dict]):
+        self.file.writelines(
+            json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in rows
+        )
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """
+    Writes each page as a row group of a Parquet file.
+
+    Requires pyarrow.
+    """
+
+    def __init__(self, path, table: ExportTable, raw: bool = False):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.schema = pa.schema(
+            [(field.attname, _arrow_type(pa, field)) for field in fields(table, raw)]
+        )
+        self.writer = pq.ParquetWriter(str(path), self.schema)
+
+    def write(self, rows: List[dict]):
+        columns = {name: [row[name] for row in rows] for name in self.schema.names}
+        self.writer.write_table(self.pa.table(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _arrow_type(pa, field: models.Field):
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.AutoField, models.IntegerField, models.ForeignKey)):
+        return pa.int64()
+    return pa.string()
+
+
+WRITERS = {"jsonl": JSONLWriter, "parquet": ParquetWriter}
+
+
+def sqlite_snapshot(path, using: str = "default", pages: int = 1024):
+    """
+    Copy a SQLite database to ``path``.
+
+    The copy is made with the online backup API ``pages`` at a time, so
+    writers are only blocked for the copy of one step. The connection of
+    ``using`` must not be inside a transaction that wrote.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        raise ValueError("Snapshots are only supported for SQLite databases")
+    connection.ensure_connection()
+    target = sqlite3.connect(str(path))
+    try:
+        connection.connection.backup(target, pages=pages)
+    finally:
+        target.close()
+
+
+def snapshot_alias(path, using: str = "default") -> str:
+    """Register the snapshot at ``path`` as a database alias and return it."""
+    alias = f"{using}_snapshot"
+    if alias in connections.settings:
+        # Drop the connection to an earlier snapshot
+        connections[alias].close()
+        del connections[alias]
+    connections.settings[alias] = {**connections.settings[using], "NAME": str(path)}
+    return alias
+
+
+def export(
+    output_dir,
+    format: str = "jsonl",
+    tables: Optional[List[str]] = None,
+    since=None,
+    page_size: int = 5000,
+    using: str = "default",
+    raw: bool = False,
+) -> Dict[str, int]:
+    """
+    Export tables into ``output_dir``, one file per table.
+
+    Files are named after the table and the time of the export, and a
+    ``watermark.json`` recording the last key written of each table is
+    updated in the same directory.
+
+    Args:
+        output_dir: Directory of the exported files.
+        format: One of ``FORMATS``.
+        tables: Names of the tables to export, all of ``TABLES`` by default.
+        since: A watermark file path, to only export what changed after it,
+            or a datetime compared with the date column of each table.
+        page_size: Rows per query and per Parquet row group.
+        using: Database alias to read from.
+        raw: Also export the raw message bodies.
+
+    Returns:
+        The number of rows exported for each table.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    watermark_file = output_dir / "watermark.json"
+    after, since_date = {}, None
+    if isinstance(since, datetime):
+        since_date = since
+    elif since is not None:
+        after = read_watermark(since)
+    keys = read_watermark(watermark_file) if watermark_file.exists() else {}
+
+    stamp = timezone.now().strftime("%Y%m%dT%H%M%S%f")
+    counts = {}
+    for table in TABLES:
+        if tables and table.name not in tables:
+            continue
+        until = upper_key(table, using)
+        start = after.get(table.name)
+        if start is not None and len(start) != len(table.key):
+            # Written with another keyset, export the whole table again
+            start = None
+        path = output_dir / f"{table.name}-{stamp}.{format}"
+        writer = WRITERS[format](path, table, raw)
+        count = 0
+        try:
+            for rows in iter_pages(
+                table,
+                after=start,
+                until=until,
+                since=since_date,
+                page_size=page_size,
+                using=using,
+                raw=raw,
+            ):
+                writer.write(rows)
+                count += len(rows)
+                logger.info("Exported %d %s", count, table.name)
+        finally:
+            writer.close()
+        counts[table.name] = count
+        keys[table.name] = until or start or keys.get(table.name)
+    write_watermark(watermark_file, keys)
+    return counts
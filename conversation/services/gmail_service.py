@@ -3,15 +3,29 @@ import base64
 import os
 from datetime import datetime, timezone
 from email.mime.text import MIMEText
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
 from django.conf import settings
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import AuthorizedSession, Request
 import json
+import logging
+
+from .. import metrics, quota
+from ..metrics import gmail_request
+from .attachment_store import AttachmentStore
+from .mime import get_attachments, get_message_body
+
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1"
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryExpired(Exception):
+    """The start history ID is too old, a full sync is needed."""
 
 
 class GmailService:
@@ -24,9 +38,44 @@ class GmailService:
         "https://www.googleapis.com/auth/gmail.modify",
     ]
 
-    def __init__(self):
-        self.service = None
-        self.setup_service()
+    def __init__(self, service=None, mailbox=None):
+        """
+        Args:
+            service: An already built Gmail API resource (e.g. the fake in
+                benchmarks/). Skips authentication when given.
+            mailbox: The Mailbox to act for. Its stored token is used, or
+                the GMAIL_TOKEN_PATH file when it has none or no mailbox is
+                given.
+        """
+        self.service = service
+        self.mailbox = mailbox
+        self.credentials = None
+        # Requests are charged to the quota budget of the mailbox
+        self.quota_key = f"mailbox:{mailbox.pk}" if mailbox else "default"
+        if service is None:
+            if mailbox is not None and mailbox.token_json:
+                self.setup_mailbox_service()
+            else:
+                self.setup_service()
+
+    def setup_mailbox_service(self):
+        """Build the Gmail API service from the token stored on the mailbox."""
+        try:
+            creds = Credentials.from_authorized_user_info(
+                json.loads(self.mailbox.token_json), self.SCOPES
+            )
+            if not creds.valid:
+                # Workers cannot run the interactive flow, only refresh
+                creds.refresh(Request())
+                self.mailbox.token_json = creds.to_json()
+                self.mailbox.save(update_fields=["token_json"])
+            self.service = build("gmail", "v1", credentials=creds)
+            self.credentials = creds
+        except Exception as e:
+            logger.error(
+                "Error setting up Gmail for %s: %s", self.mailbox.email_address, e
+            )
+            self.service = None
 
     def setup_service(self):
         """Configure and build the Gmail API service."""
@@ -42,7 +91,7 @@ class GmailService:
                         json.loads(token.read()), self.SCOPES
                     )
             except Exception as e:
-                print(f"Error loading credentials from token file: {e}")
+                logger.error("Error loading credentials from token file: %s", e)
                 creds = None
 
         # If no valid credentials available, authenticate
@@ -51,7 +100,7 @@ class GmailService:
                 try:
                     creds.refresh(Request())
                 except Exception as e:
-                    print(f"Error refreshing credentials: {e}")
+                    logger.error("Error refreshing credentials: %s", e)
                     creds = self._authenticate_new()
             else:
                 creds = self._authenticate_new()
@@ -62,16 +111,18 @@ class GmailService:
                     with open(settings.GMAIL_TOKEN_PATH, "w") as token:
                         token.write(creds.to_json())
                 except Exception as e:
-                    print(f"Error saving token: {e}")
+                    logger.error("Error saving token: %s", e)
 
         try:
             self.service = build("gmail", "v1", credentials=creds)
-            print("Gmail service successfully configured")
+            self.credentials = creds
+            logger.info("Gmail service successfully configured")
         except Exception as e:
-            print(f"Error building Gmail service: {e}")
+            logger.error("Error building Gmail service: %s", e)
             self.service = None
 
-    def _authenticate_new(self):
+    @classmethod
+    def _authenticate_new(cls):
         """Perform OAuth flow to authenticate the application."""
         try:
             credentials_path = getattr(settings, "GMAIL_CREDENTIALS_PATH", None)
@@ -79,7 +130,7 @@ class GmailService:
                 raise FileNotFoundError("Google credentials file not found")
 
             flow = InstalledAppFlow.from_client_secrets_file(
-                credentials_path, self.SCOPES
+                credentials_path, cls.SCOPES
             )
 
             # Determine the redirect URI based on settings or use localhost
@@ -104,9 +155,37 @@ class GmailService:
 
             return creds
         except Exception as e:
-            print(f"Authentication error: {e}")
+            logger.error("Authentication error: %s", e)
             raise
 
+    @classmethod
+    def add_mailbox(cls):
+        """
+        Authorize another Gmail account and store it as a Mailbox.
+
+        Returns:
+            The created or updated Mailbox, None if the profile could not
+            be read.
+        """
+        from ..models import Mailbox
+
+        creds = cls._authenticate_new()
+        gmail = cls(service=build("gmail", "v1", credentials=creds))
+        gmail.credentials = creds
+        profile = gmail.get_profile()
+        if not profile:
+            return None
+        mailbox, created = Mailbox.objects.update_or_create(
+            email_address=profile["emailAddress"],
+            defaults={"token_json": creds.to_json(), "active": True},
+        )
+        return mailbox
+
+    def _execute(self, request, method: str):
+        """Execute a request within the quota budget of the mailbox."""
+        quota.charge(self.quota_key, method)
+        return gmail_request(request, method)
+
     def get_unread_messages(self, max_results=10) -> List[Dict[str, Any]]:
         """
         Retrieve unread messages from Gmail.
@@ -118,16 +197,16 @@ class GmailService:
             List of message dictionaries.
         """
         if not self.service:
-            print("Gmail service not initialized")
+            logger.warning("Gmail service not initialized")
             return []
 
         try:
             # Get IDs of unread messages
-            results = (
+            results = self._execute(
                 self.service.users()
                 .messages()
-                .list(userId="me", q="is:unread", maxResults=max_results)
-                .execute()
+                .list(userId="me", q="is:unread", maxResults=max_results),
+                "messages.list",
             )
 
             messages = results.get("messages", [])
@@ -135,7 +214,7 @@ class GmailService:
             # Fetch basic details for each message
             unread_messages = []
             for msg in messages:
-                message_data = (
+                message_data = self._execute(
                     self.service.users()
                     .messages()
                     .get(
@@ -143,8 +222,8 @@ class GmailService:
                         id=msg["id"],
                         format="metadata",
                         metadataHeaders=["Subject", "From", "Date"],
-                    )
-                    .execute()
+                    ),
+                    "messages.get",
                 )
 
                 unread_messages.append(
@@ -158,84 +237,195 @@ class GmailService:
             return unread_messages
 
         except HttpError as error:
-            print(f"An error occurred while retrieving unread messages: {error}")
+            logger.error(
+                "An error occurred while retrieving unread messages: %s", error
+            )
             return []
 
-    def get_message_details(self, message_id: str) -> Dict[str, Any]:
+    def list_unread_page(
+        self, page_token: Optional[str] = None, max_results: Optional[int] = None
+    ) -> Tuple[List[Dict[str, str]], Optional[str]]:
+        """
+        List one page of unread messages.
+
+        Unlike ``get_unread_messages`` no request is made per message, the
+        caller fetches the details of the messages it processes.
+
+        Args:
+            page_token: Token of the page to list, None for the first page.
+            max_results: Page size, defaults to the GMAIL_PAGE_SIZE setting.
+
+        Returns:
+            A tuple of the ``{"id", "threadId"}`` dictionaries of the page and
+            the token of the next page, or None on the last page.
+        """
+        if not self.service:
+            logger.warning("Gmail service not initialized")
+            return [], None
+
+        if max_results is None:
+            max_results = getattr(settings, "GMAIL_PAGE_SIZE", 100)
+
+        try:
+            results = self._execute(
+                self.service.users()
+                .messages()
+                .list(
+                    userId="me",
+                    q="is:unread",
+                    maxResults=max_results,
+                    pageToken=page_token,
+                ),
+                "messages.list",
+            )
+        except HttpError as error:
+            logger.error("An error occurred while listing unread messages: %s", error)
+            return [], None
+
+        if page_token is None:
+            metrics.UNREAD_BACKLOG.set(
+                results.get("resultSizeEstimate", 0),
+                mailbox=self.mailbox.email_address if self.mailbox else "default",
+            )
+
+        return results.get("messages", []), results.get("nextPageToken")
+
+    def get_message_details(
+        self, message_id: str, fetch_attachments: bool = False
+    ) -> Dict[str, Any]:
         """
         Get full details of a specific message.
 
+        Attachments are listed but only downloaded when requested, in which
+        case they are streamed into the attachment store.
+
         Args:
             message_id: The ID of the message to retrieve.
+            fetch_attachments: Whether to download the attachments.
 
         Returns:
             A dictionary with message details.
         """
         if not self.service:
-            print("Gmail service not initialized")
+            logger.warning("Gmail service not initialized")
             return {}
 
         try:
             # Get the full message
-            message = (
+            message = self._execute(
                 self.service.users()
                 .messages()
-                .get(userId="me", id=message_id, format="full")
-                .execute()
+                .get(userId="me", id=message_id, format="full"),
+                "messages.get",
             )
 
-            # Extract headers
-            headers = {}
-            for header in message["payload"]["headers"]:
-                headers[header["name"].lower()] = header["value"]
-
-            # Extract body
-            body = self._get_message_body(message["payload"])
+            attachments = []
+            for attachment in get_attachments(message["payload"]):
+                info = {
+                    "filename": attachment.filename,
+                    "mimeType": attachment.mime_type,
+                    "size": attachment.size,
+                    "attachmentId": attachment.attachment_id,
+                }
+                if fetch_attachments and attachment.attachment_id:
+                    info["sha256"] = self.save_attachment(
+                        message_id, attachment.attachment_id
+                    )
+                attachments.append(info)
 
             # Mark message as read (optional)
-            self.service.users().messages().modify(
-                userId="me", id=message_id, body={"removeLabelIds": ["UNREAD"]}
-            ).execute()
-
-            return {
-                "id": message["id"],
-                "threadId": message["threadId"],
-                "subject": headers.get("subject", ""),
-                "from": headers.get("from", ""),
-                "to": headers.get("to", ""),
-                "date": headers.get("date", ""),
-                "body": body,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            }
+            self._execute(
+                self.service.users()
+                .messages()
+                .modify(
+                    userId="me", id=message_id, body={"removeLabelIds": ["UNREAD"]}
+                ),
+                "messages.modify",
+            )
+
+            return {**self._parse_message(message), "attachments": attachments}
 
         except HttpError as error:
-            print(f"An error occurred while retrieving message details: {error}")
+            logger.error(
+                "An error occurred while retrieving message details: %s", error
+            )
             return {"id": message_id, "error": str(error)}
 
+    def _parse_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Headers, body and receive time of a message fetched as ``full``."""
+        headers = {}
+        for header in message["payload"]["headers"]:
+            headers[header["name"].lower()] = header["value"]
+
+        return {
+            "id": message["id"],
+            "threadId": message["threadId"],
+            "labelIds": message.get("labelIds", []),
+            "subject": headers.get("subject", ""),
+            "from": headers.get("from", ""),
+            "to": headers.get("to", ""),
+            "date": headers.get("date", ""),
+            "message-id": headers.get("message-id", ""),
+            "in-reply-to": headers.get("in-reply-to", ""),
+            "references": headers.get("references", ""),
+            "body": self._get_message_body(message["payload"]),
+            "timestamp": _internal_date(message).isoformat(),
+        }
+
     def _get_message_body(self, payload):
-        """Extract the text body from a message payload."""
-        if "body" in payload and payload["body"].get("data"):
-            # Base64 decode the body
-            body_data = payload["body"]["data"]
-            body_bytes = base64.urlsafe_b64decode(body_data)
-            return body_bytes.decode("utf-8")
-
-        # If the message has parts (multipart message)
-        if "parts" in payload:
-            for part in payload["parts"]:
-                if part["mimeType"] == "text/plain":
-                    if part["body"].get("data"):
-                        body_data = part["body"]["data"]
-                        body_bytes = base64.urlsafe_b64decode(body_data)
-                        return body_bytes.decode("utf-8")
-
-                # Recursive call for nested parts
-                if "parts" in part:
-                    body = self._get_message_body(part)
-                    if body:
-                        return body
-
-        return ""
+        """Extract the best text body from a message payload."""
+        return get_message_body(payload)
+
+    def save_attachment(
+        self,
+        message_id: str,
+        attachment_id: str,
+        store: Optional[AttachmentStore] = None,
+    ) -> str:
+        """
+        Download an attachment into the content-addressed attachment store.
+
+        The attachment is streamed and decoded in chunks, so memory use does
+        not depend on the attachment size.
+
+        Args:
+            message_id: The ID of the message holding the attachment.
+            attachment_id: The ID of the attachment.
+            store: The store to write to, defaults to ATTACHMENT_STORE_PATH.
+
+        Returns:
+            The SHA-256 digest of the stored attachment.
+        """
+        store = store or AttachmentStore(settings.ATTACHMENT_STORE_PATH)
+        return store.put_base64(self._iter_attachment_data(message_id, attachment_id))
+
+    def _iter_attachment_data(self, message_id: str, attachment_id: str):
+        """Yield the base64url data of an attachment in fragments."""
+        if self.credentials is None:
+            # No raw HTTP access (e.g. a stubbed service), go through the client
+            attachment = self._execute(
+                self.service.users()
+                .messages()
+                .attachments()
+                .get(userId="me", messageId=message_id, id=attachment_id),
+                "messages.attachments.get",
+            )
+            yield attachment.get("data", "")
+            return
+
+        quota.charge(self.quota_key, "messages.attachments.get")
+        metrics.charge_gmail_quota("messages.attachments.get")
+        session = AuthorizedSession(self.credentials)
+        url = (
+            f"{GMAIL_API_URL}/users/me/messages/{message_id}"
+            f"/attachments/{attachment_id}"
+        )
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            yield from _iter_json_string_field(
+                response.iter_content(chunk_size=64 * 1024, decode_unicode=True),
+                "data",
+            )
 
     def create_draft(
         self, to: str, subject: str, body: str, thread_id: Optional[str] = None
@@ -253,7 +443,7 @@ class GmailService:
             The draft ID if successful.
         """
         if not self.service:
-            print("Gmail service not initialized")
+            logger.warning("Gmail service not initialized")
             return ""
 
         try:
@@ -272,17 +462,15 @@ class GmailService:
             if thread_id:
                 draft_body["message"]["threadId"] = thread_id
 
-            draft = (
-                self.service.users()
-                .drafts()
-                .create(userId="me", body=draft_body)
-                .execute()
+            draft = self._execute(
+                self.service.users().drafts().create(userId="me", body=draft_body),
+                "drafts.create",
             )
 
             return draft["id"]
 
         except HttpError as error:
-            print(f"An error occurred while creating a draft: {error}")
+            logger.error("An error occurred while creating a draft: %s", error)
             return ""
 
     def send_draft(self, draft_id: str) -> str:
@@ -296,21 +484,19 @@ class GmailService:
             The message ID of the sent email.
         """
         if not self.service:
-            print("Gmail service not initialized")
+            logger.warning("Gmail service not initialized")
             return ""
 
         try:
-            sent_message = (
-                self.service.users()
-                .drafts()
-                .send(userId="me", body={"id": draft_id})
-                .execute()
+            sent_message = self._execute(
+                self.service.users().drafts().send(userId="me", body={"id": draft_id}),
+                "drafts.send",
             )
 
             return sent_message["id"]
 
         except HttpError as error:
-            print(f"An error occurred while sending a draft: {error}")
+            logger.error("An error occurred while sending a draft: %s", error)
             return ""
 
     def schedule_email(self, draft_id: str, send_time) -> bool:
@@ -329,7 +515,7 @@ class GmailService:
         """
         # Since Gmail API doesn't have native scheduling, we just store the info
         # and return True. The actual sending will be handled by a scheduled task.
-        print(f"Email with draft ID {draft_id} scheduled for {send_time}")
+        logger.info("Email with draft ID %s scheduled for %s", draft_id, send_time)
         return True
 
     def send_email(
@@ -348,7 +534,7 @@ class GmailService:
             The message ID of the sent email.
         """
         if not self.service:
-            print("Gmail service not initialized")
+            logger.warning("Gmail service not initialized")
             return ""
 
         try:
@@ -368,40 +554,201 @@ class GmailService:
                 message_body["threadId"] = thread_id
 
             # Send message
-            sent_message = (
-                self.service.users()
-                .messages()
-                .send(userId="me", body=message_body)
-                .execute()
+            sent_message = self._execute(
+                self.service.users().messages().send(userId="me", body=message_body),
+                "messages.send",
             )
 
             return sent_message["id"]
 
         except HttpError as error:
-            print(f"An error occurred while sending an email: {error}")
+            logger.error("An error occurred while sending an email: %s", error)
             return ""
 
-    def get_thread(self, thread_id: str) -> Dict[str, Any]:
+    def get_thread(self, thread_id: str, format: str = "full") -> Dict[str, Any]:
         """
         Get all messages in a thread.
 
         Args:
             thread_id: The ID of the thread to retrieve.
+            format: Format of the messages, as for ``messages.get``.
 
         Returns:
             A dictionary with thread details.
         """
         if not self.service:
-            print("Gmail service not initialized")
+            logger.warning("Gmail service not initialized")
             return {}
 
         try:
-            thread = (
-                self.service.users().threads().get(userId="me", id=thread_id).execute()
+            thread = self._execute(
+                self.service.users()
+                .threads()
+                .get(userId="me", id=thread_id, format=format),
+                "threads.get",
             )
 
             return thread
 
         except HttpError as error:
-            print(f"An error occurred while retrieving a thread: {error}")
+            logger.error("An error occurred while retrieving a thread: %s", error)
+            return {}
+
+    def get_profile(self) -> Dict[str, Any]:
+        """
+        Get the address and current history ID of the mailbox.
+
+        Returns:
+            A dictionary with ``emailAddress`` and ``historyId``, empty if
+            the request failed.
+        """
+        if not self.service:
+            logger.warning("Gmail service not initialized")
+            return {}
+
+        try:
+            return self._execute(
+                self.service.users().getProfile(userId="me"), "getProfile"
+            )
+        except HttpError as error:
+            logger.error("An error occurred while getting the profile: %s", error)
+            return {}
+
+    def watch(self, topic_name: str, label_ids=("INBOX",)) -> Dict[str, Any]:
+        """
+        Start or renew push notifications to a Pub/Sub topic.
+
+        Args:
+            topic_name: Full topic name, ``projects/<project>/topics/<topic>``.
+            label_ids: Only changes to messages with these labels are pushed.
+
+        Returns:
+            A dictionary with ``historyId`` and ``expiration`` (ms since the
+            epoch), empty if the request failed.
+        """
+        if not self.service:
+            logger.warning("Gmail service not initialized")
+            return {}
+
+        try:
+            return self._execute(
+                self.service.users().watch(
+                    userId="me",
+                    body={
+                        "topicName": topic_name,
+                        "labelIds": list(label_ids),
+                        "labelFilterBehavior": "include",
+                    },
+                ),
+                "watch",
+            )
+        except HttpError as error:
+            logger.error("An error occurred while renewing the watch: %s", error)
             return {}
+
+    def list_history_page(
+        self, start_history_id: str, page_token: Optional[str] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], Optional[str]]:
+        """
+        List one page of the messages added to the inbox since a history ID.
+
+        Args:
+            start_history_id: History ID of the last sync.
+            page_token: Token of the page to list, None for the first page.
+
+        Returns:
+            A tuple of the history records of the page, the token of the
+            next page (None on the last page) and the current history ID.
+
+        Raises:
+            HistoryExpired: The start history ID is no longer available.
+        """
+        if not self.service:
+            logger.warning("Gmail service not initialized")
+            return [], None, None
+
+        try:
+            results = self._execute(
+                self.service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded"],
+                    labelId="INBOX",
+                    pageToken=page_token,
+                ),
+                "history.list",
+            )
+        except HttpError as error:
+            if error.resp.status == 404:
+                raise HistoryExpired(start_history_id) from error
+            logger.error("An error occurred while listing history: %s", error)
+            return [], None, None
+
+        return (
+            results.get("history", []),
+            results.get("nextPageToken"),
+            results.get("historyId"),
+        )
+
+    def get_thread_messages(self, thread_id: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get the details of every message of a thread in one request.
+
+        Unlike ``get_message_details`` messages are not marked as read and
+        attachments are not listed.
+
+        Args:
+            thread_id: The ID of the thread to retrieve.
+
+        Returns:
+            The message details in thread order, None if the request failed.
+        """
+        thread = self.get_thread(thread_id, format="full")
+        if not thread:
+            return None
+        return [self._parse_message(message) for message in thread["messages"]]
+
+
+def _internal_date(message: Dict[str, Any]) -> datetime:
+    """When Gmail received a message, falling back to now."""
+    if message.get("internalDate"):
+        return datetime.fromtimestamp(int(message["internalDate"]) / 1000, timezone.utc)
+    return datetime.now(timezone.utc)
+
+
+def _iter_json_string_field(chunks, field: str):
+    """
+    Yield the value of a top-level string field from a streamed JSON object.
+
+    Only suitable for values without escape sequences, such as base64 data.
+    """
+    marker = f'"{field}"'
+    buffer = ""
+    chunks = iter(chunks)
+
+    # Find the opening quote of the value
+    for chunk in chunks:
+        buffer += chunk
+        index = buffer.find(marker)
+        if index == -1:
+            buffer = buffer[-len(marker) :]
+            continue
+        rest = buffer[index + len(marker) :].lstrip(" \t\r\n:")
+        if rest.startswith('"'):
+            buffer = rest[1:]
+            break
+        buffer = buffer[index:]
+    else:
+        return
+
+    # Emit fragments up to the closing quote
+    while buffer is not None:
+        end = buffer.find('"')
+        if end != -1:
+            yield buffer[:end]
+            return
+        if buffer:
+            yield buffer
+        buffer = next(chunks, None)
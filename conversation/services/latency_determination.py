@@ -7,18 +7,20 @@ import random
 import datetime
 from conversation.models import Message
 from django.conf import settings
+from django.utils import timezone
 
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+from conversation import metrics
+from conversation.log import log_context, trunc
+
 logger = logging.getLogger(__name__)
 
 
 model = OpenAIModel(
     "google/gemini-2.0-flash-lite-001",
     provider=OpenAIProvider(
-        base_url="https://openrouter.ai/api/v1", api_key=settings.OPENROUTER_API_KEY
+        base_url=settings.OPENROUTER_BASE_URL, api_key=settings.OPENROUTER_API_KEY
     ),
 )
 
@@ -64,10 +66,33 @@ class HumanLatencyAgent:
         """
         self.agent = Agent(model=model, result_type=LatencyDetermination)
         self.config = config or LatencyConfig()
-        logger.info(f"HumanLatencyAgent initialized.")
+        logger.info("HumanLatencyAgent initialized.")
+
+    def determine_latency(self, message: Message, history=None):
+        """
+        Decide how long to wait before answering a message.
+
+        Returns ``(urgent, stuck, minutes)``, a random fallback if the LLM
+        request fails.
+        """
+        try:
+            return self.decide_latency(message, history)
+        except Exception as e:
+            logger.error("Error determining latency: %s", e, exc_info=True)
+            # Fallback to reasonable default in case of any errors
+            # Since the message content appears to indicate urgency, default to urgent
+            return (False, False, random.randint(30, 60))
 
-    def determine_latency(self, message: Message):
-        now = datetime.datetime.now()
+    def decide_latency(self, message: Message, history=None):
+        """
+        Like ``determine_latency``, but raising if the LLM request fails.
+
+        Args:
+            message: The message to answer.
+            history: The messages of the conversation to show, by default
+                every stored message of its conversation.
+        """
+        now = timezone.localtime()
         business_hours = (
             self.config.business_hours_start
             <= int(now.hour)
@@ -75,52 +100,50 @@ class HumanLatencyAgent:
         )
         weekend = now.weekday() >= 5  # 5 and 6 are saturday and sunday
 
-        try:
-            # Format conversation history
-            conversation_history = ""
-
-            # Get messages in chronological order
-            messages = message.conversation.messages.all()
-            # Sort in Python to avoid database ordering issues
-            print(message)
-            messages_sorted = sorted(
-                messages,
-                key=lambda m: m.timestamp if m.timestamp else datetime.datetime.min,
-            )
-
-            for msg in messages_sorted:
-                conversation_history += str(msg)
-
-            time = str(datetime.datetime.now())
-            business_hours_yn = "yes" if business_hours else "no"
-            weekend_yn = "yes" if weekend else "no"
-
-            # Get response from agent
-            with open("conversation/prompts/determine_latency.prompt", "r") as p_file:
-                prompt = p_file.read()
-
-            # Format prompt
-            prompt = prompt.format(
-                conversation_history=conversation_history,
-                message=str(message),
-                time=time,
-                business_hours_yn=business_hours_yn,
-                weekend_yn=weekend_yn,
-            )
-
-            response = self.agent.run_sync(prompt)
-            print("HERE")
-            print(response)
-
-            return (
-                response.data.urgent,
-                response.data.stuck,
-                response.data.days * 24 * 60
-                + response.data.hours * 60
-                + response.data.minutes,
-            )
-        except Exception as e:
-            logger.error(f"Error determining latency: {e}", exc_info=True)
-            # Fallback to reasonable default in case of any errors
-            # Since the message content appears to indicate urgency, default to urgent
-            return (False, False, random.randint(30, 60))
+        # Format conversation history
+        conversation_history = ""
+
+        # Get messages in chronological order
+        if history is None:
+            history = message.conversation.messages.all()
+        # Sort in Python to avoid database ordering issues
+        messages_sorted = sorted(
+            history,
+            key=lambda m: m.timestamp
+            or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc),
+        )
+
+        for msg in messages_sorted:
+            conversation_history += str(msg)
+
+        time = str(now)
+        business_hours_yn = "yes" if business_hours else "no"
+        weekend_yn = "yes" if weekend else "no"
+
+        # Get response from agent
+        with open("conversation/prompts/determine_latency.prompt", "r") as p_file:
+            prompt = p_file.read()
+
+        # Format prompt
+        prompt = prompt.format(
+            conversation_history=conversation_history,
+            message=str(message),
+            time=time,
+            business_hours_yn=business_hours_yn,
+            weekend_yn=weekend_yn,
+        )
+
+        with log_context(gmail_message_id=message.message_id):
+            with metrics.LLM_REQUEST_SECONDS.time(
+                metrics.LLM_REQUEST_ERRORS, operation="determine_latency"
+            ):
+                response = self.agent.run_sync(prompt)
+            logger.debug("Latency decision: %s", trunc(response.data, 200))
+
+        return (
+            response.data.urgent,
+            response.data.stuck,
+            response.data.days * 24 * 60
+            + response.data.hours * 60
+            + response.data.minutes,
+        )
@@ -0,0 +1,467 @@
+# conversation/services/mail_import.py
+"""
+Bulk import of historical mail from mbox files, Maildirs and EML files.
+
+Importing the history of a mailbox through the Gmail API costs a request
+(and quota) per message; exported mail is read locally instead. Sources are
+read one message at a time and parsed by a pool of worker processes, with a
+bounded number of chunks in flight, so memory stays flat however large the
+source. Parsed messages are written in batches, each in one transaction:
+contacts and conversations are looked up and created in bulk, then the
+messages are inserted with ``bulk_create`` and added to the search index.
+
+Messages are grouped into conversations by their thread headers: a reply
+joins the conversation of the closest message it references, or of the
+first message of its ``References``. Conversations are marked hydrated.
+
+Gmail exports (Takeout) carry the Gmail thread and message IDs in the
+``X-GM-THRID`` and ``X-GM-MSGID`` headers; they key the imported rows as
+Gmail would, so mail later delivered through the API is recognized. Without
+them messages are keyed by their ``Message-ID`` header and conversations
+get a thread ID derived from their root message (``IMPORTED_THREAD_PREFIX``),
+which ingestion replaces with the Gmail IDs when it meets the same mail or a
+reply to it (see ``EmailProcessor``). Either way an import can be run again
+without duplicating mail.
+"""
+
+import email
+import email.policy
+import hashlib
+import logging
+import mailbox
+import multiprocessing
+import os
+import re
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+from email.utils import getaddresses, parseaddr, parsedate_to_datetime
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+import django
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from ..compression import compress_text
+from ..fields import compression_options
+from ..models import Contact, Conversation, Message
+from .mime import html_to_text
+from .quote_stripping import strip_quoted_text
+from .search import get_search_backend
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("mbox", "maildir", "eml")
+
+_MESSAGE_ID_RE = re.compile(r"<[^<>\s]+>")
+
+# Thread IDs of imported conversations whose Gmail thread is unknown
+IMPORTED_THREAD_PREFIX = "import-"
+
+# Field lengths of the models
+_EMAIL_LENGTH = 254
+_SUBJECT_LENGTH = 512
+_ID_LENGTH = 255
+
+
+@dataclass
+class ImportStats:
+    read: int = 0
+    imported: int = 0
+    already_stored: int = 0
+    skipped: int = 0
+    contacts: int = 0
+    conversations: int = 0
+
+
+def detect_format(path) -> str:
+    path = Path(path)
+    if path.is_dir():
+        if (path / "cur").is_dir() and (path / "new").is_dir():
+            return "maildir"
+        return "eml"
+    return "eml" if path.suffix.lower() == ".eml" else "mbox"
+
+
+def iter_raw_messages(path, format: str) -> Iterator[bytes]:
+    """Yield the bytes of each message of a source, one at a time."""
+    path = Path(path)
+    if format == "mbox":
+        box = mailbox.mbox(path, create=False)
+        for key in box.iterkeys():
+            yield box.get_bytes(key)
+    elif format == "maildir":
+        box = mailbox.Maildir(path, factory=None, create=False)
+        for key in box.iterkeys():
+            yield box.get_bytes(key)
+    elif path.is_file():
+        yield path.read_bytes()
+    else:
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".eml"):
+                    yield Path(root, name).read_bytes()
+
+
+def parse_raw(raw: bytes) -> Optional[dict]:
+    """
+    Parse one message into the fields stored for it.
+
+    Runs in the worker processes. The raw body is compressed here, to keep
+    that work off the writing process. Returns None for unreadable mail.
+    """
+    try:
+        message = email.message_from_bytes(raw, policy=email.policy.default)
+        message_id = message_ids(message.get("Message-ID", ""))
+        references = message_ids(message.get("References", ""))
+        in_reply_to = message_ids(message.get("In-Reply-To", ""))
+        sender_name, sender = parseaddr(str(message.get("From", "")))
+        recipients = [
+            address
+            for _, address in getaddresses([str(v) for v in message.get_all("To", [])])
+            if address
+        ]
+        subject = str(message.get("Subject", ""))
+        body = _body_text(message)
+        timestamp = _date(message.get("Date"))
+        gmail_id = _gmail_id(message.get("X-GM-MSGID"))
+        gmail_thread_id = _gmail_id(message.get("X-GM-THRID"))
+    except Exception as e:
+        logger.warning("Skipping unreadable message: %s", e)
+        return None
+
+    return {
+        # Mail without a Message-ID is keyed by its content
+        "message_id": (
+            message_id[0]
+            if message_id
+            else f"<{hashlib.sha256(raw).hexdigest()[:32]}@import>"
+        ),
+        "gmail_id": gmail_id,
+        "gmail_thread_id": gmail_thread_id,
+        "references": references,
+        "in_reply_to": in_reply_to[0] if in_reply_to else None,
+        "sender": sender.lower()[:_EMAIL_LENGTH],
+        "sender_name": sender_name[:255],
+        "receiver": recipients[0].lower()[:_EMAIL_LENGTH] if recipients else "",
+        "subject": subject[:_SUBJECT_LENGTH],
+        "timestamp": timestamp,
+        "content": strip_quoted_text(body),
+        "raw_content": compress_text(body, **compression_options()),
+    }
+
+
+def parse_chunk(chunk: List[bytes]) -> List[Optional[dict]]:
+    return [parse_raw(raw) for raw in chunk]
+
+
+def message_ids(value) -> List[str]:
+    """The ``<...>`` IDs of a Message-ID, In-Reply-To or References header"""
+    return _MESSAGE_ID_RE.findall(str(value or ""))
+
+
+def _gmail_id(value) -> Optional[str]:
+    """Gmail API ID of an X-GM-MSGID or X-GM-THRID header, in hexadecimal"""
+    try:
+        return format(int(str(value).strip()), "x") if value else None
+    except ValueError:
+        return None
+
+
+def _date(value) -> Optional[datetime]:
+    try:
+        timestamp = parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    if timezone.is_naive(timestamp):
+        timestamp = timestamp.replace(tzinfo=dt_timezone.utc)
+    return timestamp
+
+
+def _body_text(message) -> str:
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return ""
+    text = part.get_content()
+    if part.get_content_type() == "text/html":
+        text = html_to_text(text)
+    return text
+
+
+def parse_all(
+    raws: Iterable[bytes], workers: int = 1, chunk_size: int = 200
+) -> Iterator[Optional[dict]]:
+    """
+    Parse messages in order, in ``workers`` processes.
+
+    At most two chunks per worker are in flight, so a large source is never
+    read ahead of the writer.
+    """
+    if workers <= 1:
+        for raw in raws:
+            yield parse_raw(raw)
+        return
+
+    raws = iter(raws)
+    # Spawned rather than forked, so workers never share a database connection
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=django.setup,
+    ) as executor:
+        pending = deque()
+        while True:
+            chunk = list(islice(raws, chunk_size))
+            if chunk:
+                pending.append(executor.submit(parse_chunk, chunk))
+            if pending and (not chunk or len(pending) >= workers * 2):
+                yield from pending.popleft().result()
+            elif not chunk:
+                return
+
+
+class MailImporter:
+    """
+    Writes parsed messages to the database in batches.
+
+    Args:
+        mailbox: Mailbox owning the imported conversations, if any.
+        addresses: Addresses of the mailbox owner; mail they sent is
+            stored as outgoing.
+        index: Add the imported messages to the search index.
+        thread_cache_size: Message IDs remembered to thread replies whose
+            ``References`` header is truncated.
+    """
+
+    def __init__(
+        self,
+        mailbox=None,
+        addresses: Iterable[str] = (),
+        index: bool = True,
+        thread_cache_size: int = 1_000_000,
+    ):
+        self.mailbox = mailbox
+        self.addresses = {address.lower() for address in addresses}
+        if mailbox is not None:
+            self.addresses.add(mailbox.email_address.lower())
+        self.index = index
+        self.thread_cache_size = thread_cache_size
+        self.threads = OrderedDict()
+        self.stats = ImportStats()
+
+    def thread_root(self, parsed: dict) -> str:
+        """The Message-ID identifying the conversation of a message."""
+        parents = [parsed["in_reply_to"], *reversed(parsed["references"])]
+        root = None
+        for parent in parents:
+            if parent in self.threads:
+                root = self.threads[parent]
+                self.threads.move_to_end(parent)
+                break
+        if root is None:
+            references = parsed["references"]
+            root = (
+                references[0]
+                if references
+                else parsed["in_reply_to"] or parsed["message_id"]
+            )
+        self.threads[parsed["message_id"]] = root
+        if len(self.threads) > self.thread_cache_size:
+            self.threads.popitem(last=False)
+        return root
+
+    def write_batch(self, batch: List[dict]):
+        """Store one batch of parsed messages in a transaction."""
+        rows = []
+        for parsed in batch:
+            outgoing = parsed["sender"] in self.addresses
+            contact = parsed["receiver"] if outgoing else parsed["sender"]
+            if not contact:
+                self.stats.skipped += 1
+                continue
+            message_id = parsed.get("gmail_id") or parsed["message_id"]
+            if len(message_id) > _ID_LENGTH:
+                message_id = f"<{hashlib.sha256(message_id.encode()).hexdigest()}>"
+            root = self.thread_root(parsed)
+            thread = parsed.get("gmail_thread_id") or thread_id(root)
+            rows.append((parsed, message_id, outgoing, contact, thread))
+        if not rows:
+            return
+
+        with transaction.atomic():
+            stored = set(
+                Message.objects.filter(
+                    message_id__in=[row[1] for row in rows]
+                ).values_list("message_id", flat=True)
+            )
+            # Mail repeated in the source is stored once, so every row left
+            # is inserted (conflicts only come from a concurrent import)
+            new = []
+            for row in rows:
+                if row[1] not in stored:
+                    stored.add(row[1])
+                    new.append(row)
+            self.stats.already_stored += len(rows) - len(new)
+            if not new:
+                return
+
+            contacts = self._contacts(new)
+            conversations = self._conversations(new, contacts)
+            messages = [
+                Message(
+                    conversation_id=conversations[thread],
+                    message_id=message_id,
+                    message_type="OUTGOING" if outgoing else "INCOMING",
+                    subject=parsed["subject"],
+                    content=parsed["content"],
+                    # Compressed by the parse worker
+                    raw_content=parsed["raw_content"],
+                    sender=parsed["sender"] or None,
+                    receiver=parsed["receiver"] or None,
+                    timestamp=parsed["timestamp"],
+                )
+                for parsed, message_id, outgoing, _, thread in new
+            ]
+            Message.objects.bulk_create(
+                messages, batch_size=1000, ignore_conflicts=True
+            )
+            self.stats.imported += len(new)
+
+            conversation_ids = set(conversations.values())
+            # bulk_create stamped the conversations with the import time
+            Conversation.objects.filter(pk__in=conversation_ids).update(
+                last_updated=Coalesce(
+                    Subquery(
+                        Message.objects.filter(
+                            conversation=OuterRef("pk"), timestamp__isnull=False
+                        )
+                        .order_by("-timestamp")
+                        .values("timestamp")[:1]
+                    ),
+                    F("last_updated"),
+                )
+            )
+            if self.index:
+                self._index(new)
+
+    def _contacts(self, rows) -> dict:
+        """IDs of the contacts of the rows by address, creating missing ones."""
+        names = {}
+        for parsed, _, outgoing, contact, _ in rows:
+            names.setdefault(contact, "" if outgoing else parsed["sender_name"])
+        ids = dict(Contact.objects.filter(email__in=names).values_list("email", "pk"))
+        missing = [address for address in names if address not in ids]
+        if missing:
+            Contact.objects.bulk_create(
+                [Contact(email=address, name=names[address]) for address in missing],
+                ignore_conflicts=True,
+            )
+            self.stats.contacts += len(missing)
+            ids.update(
+                Contact.objects.filter(email__in=missing).values_list("email", "pk")
+            )
+        return ids
+
+    def _conversations(self, rows, contacts: dict) -> dict:
+        """IDs of the conversations of the rows by thread ID, creating missing ones."""
+        first_contact = {}
+        for _, _, _, contact, thread in rows:
+            first_contact.setdefault(thread, contact)
+        ids = dict(
+            Conversation.objects.filter(thread_id__in=first_contact).values_list(
+                "thread_id", "pk"
+            )
+        )
+        missing = [thread for thread in first_contact if thread not in ids]
+        if missing:
+            now = timezone.now()
+            Conversation.objects.bulk_create(
+                [
+                    Conversation(
+                        thread_id=thread,
+                        contact_id=contacts[first_contact[thread]],
+                        mailbox=self.mailbox,
+                        hydrated_at=now,
+                    )
+                    for thread in missing
+                ],
+                ignore_conflicts=True,
+            )
+            self.stats.conversations += len(missing)
+            ids.update(
+                Conversation.objects.filter(thread_id__in=missing).values_list(
+                    "thread_id", "pk"
+                )
+            )
+        return ids
+
+    def _index(self, rows):
+        # bulk_create does not send post_save, which indexes single saves
+        pks = dict(
+            Message.objects.filter(message_id__in=[row[1] for row in rows]).values_list(
+                "message_id", "pk"
+            )
+        )
+        get_search_backend().index(
+            [
+                (pks[message_id], parsed["subject"], parsed["content"])
+                for parsed, message_id, _, _, _ in rows
+                if message_id in pks
+            ]
+        )
+
+
+def thread_id(root: str) -> str:
+    """Thread ID of an imported conversation started by ``root``."""
+    return (
+        IMPORTED_THREAD_PREFIX + hashlib.sha256(root.encode("utf-8")).hexdigest()[:32]
+    )
+
+
+def import_mail(
+    path,
+    format: Optional[str] = None,
+    mailbox=None,
+    addresses: Iterable[str] = (),
+    workers: int = 1,
+    batch_size: int = 5000,
+    index: bool = True,
+    progress=None,
+) -> ImportStats:
+    """
+    Import every message of a mail source.
+
+    Args:
+        path: An mbox file, a Maildir, an EML file or a directory of them.
+        format: One of FORMATS, detected from the path by default.
+        mailbox: Mailbox owning the imported conversations, if any.
+        addresses: Addresses whose mail is stored as outgoing, in addition
+            to the address of ``mailbox``.
+        workers: Parse processes, 1 to parse in this process.
+        batch_size: Messages written per transaction.
+        index: Add the imported messages to the search index.
+        progress: Optional callable receiving the stats after each batch.
+
+    Returns:
+        The import stats.
+    """
+    format = format or detect_format(path)
+    importer = MailImporter(mailbox=mailbox, addresses=addresses, index=index)
+    stats = importer.stats
+    parsed = parse_all(iter_raw_messages(path, format), workers)
+    while True:
+        chunk = list(islice(parsed, batch_size))
+        if not chunk:
+            return stats
+        stats.read += len(chunk)
+        batch = [message for message in chunk if message is not None]
+        stats.skipped += len(chunk) - len(batch)
+        importer.write_batch(batch)
+        if progress:
+            progress(stats)
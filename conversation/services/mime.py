@@ -0,0 +1,201 @@
+# conversation/services/mime.py
+"""
+Walk Gmail API message payloads and extract the best text representation.
+
+The walker only looks at part metadata while choosing which part to use, and
+only the chosen text part is base64-decoded. Parts stored out of line (with an
+``attachmentId``) are never downloaded here; they are reported as attachments
+so the caller can decide whether to fetch them.
+"""
+
+import base64
+import re
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Preferred text representations, best first
+TEXT_PREFERENCE = ("text/plain", "text/html")
+
+_CHARSET_RE = re.compile(r"charset\s*=\s*\"?([\w.:-]+)", re.IGNORECASE)
+_BLANK_LINES_RE = re.compile(r"\n[ \t]*(?:\n[ \t]*)+")
+_SPACES_RE = re.compile(r"[ \t\r\f\v]+")
+
+
+@dataclass
+class AttachmentInfo:
+    """Metadata of an attachment part, without its content."""
+
+    part_id: str
+    filename: str
+    mime_type: str
+    size: int
+    attachment_id: Optional[str]
+
+
+def iter_parts(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Yield every leaf part of a payload, depth first and in order."""
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        children = part.get("parts")
+        if children:
+            stack.extend(reversed(children))
+        else:
+            yield part
+
+
+def part_headers(part: Dict[str, Any]) -> Dict[str, str]:
+    """Return the headers of a part as a lower-cased dictionary."""
+    return {h["name"].lower(): h["value"] for h in part.get("headers", [])}
+
+
+def is_attachment(part: Dict[str, Any]) -> bool:
+    """Whether a part is an attachment rather than an inline body."""
+    if part.get("filename"):
+        return True
+    if part.get("body", {}).get("attachmentId"):
+        return True
+    disposition = part_headers(part).get("content-disposition", "")
+    return disposition.lower().startswith("attachment")
+
+
+def get_message_body(payload: Dict[str, Any]) -> str:
+    """
+    Extract the text body from a message payload.
+
+    Prefers ``text/plain`` and falls back to ``text/html`` converted to text.
+
+    Args:
+        payload: The ``payload`` of a Gmail message in ``full`` format.
+
+    Returns:
+        The body text, or an empty string if there is no inline text part.
+    """
+    chosen = _choose_text_part(payload)
+    if chosen is None:
+        return ""
+
+    mime_type, part = chosen
+    text = decode_part_data(part)
+    if mime_type == "text/html":
+        return html_to_text(text)
+    return text
+
+
+def get_attachments(payload: Dict[str, Any]) -> List[AttachmentInfo]:
+    """List the attachments of a message payload without downloading them."""
+    attachments = []
+    for part in iter_parts(payload):
+        if not is_attachment(part):
+            continue
+        body = part.get("body", {})
+        attachments.append(
+            AttachmentInfo(
+                part_id=part.get("partId", ""),
+                filename=part.get("filename", ""),
+                mime_type=part.get("mimeType", ""),
+                size=int(body.get("size", 0)),
+                attachment_id=body.get("attachmentId"),
+            )
+        )
+    return attachments
+
+
+def decode_part_data(part: Dict[str, Any]) -> str:
+    """Decode the inline base64url data of a part using its declared charset."""
+    data = part.get("body", {}).get("data")
+    if not data:
+        return ""
+
+    charset = "utf-8"
+    match = _CHARSET_RE.search(part_headers(part).get("content-type", ""))
+    if match:
+        charset = match.group(1)
+
+    raw = base64.urlsafe_b64decode(data)
+    try:
+        return raw.decode(charset, errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def html_to_text(html: str) -> str:
+    """Convert an HTML body to plain text, keeping paragraph breaks."""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = "".join(parser.chunks)
+    lines = (_SPACES_RE.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def _choose_text_part(
+    payload: Dict[str, Any],
+) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Pick the best inline text part by MIME type preference."""
+    best = None
+    best_rank = len(TEXT_PREFERENCE)
+    for part in iter_parts(payload):
+        mime_type = part.get("mimeType", "").lower()
+        if mime_type not in TEXT_PREFERENCE or is_attachment(part):
+            continue
+        if not part.get("body", {}).get("data"):
+            continue
+        rank = TEXT_PREFERENCE.index(mime_type)
+        if rank < best_rank:
+            best, best_rank = (mime_type, part), rank
+            if rank == 0:
+                break
+    return best
+
+
+class _TextExtractor(HTMLParser):
+    """Collect the visible text of an HTML document."""
+
+    # Tags that end a line, and tags that end a paragraph
+    LINE_TAGS = {"div", "li", "tr", "dt", "dd"}
+    PARAGRAPH_TAGS = {
+        "address",
+        "blockquote",
+        "h1",
+        "h2",
+        "h3",
+        "h4",
+        "h5",
+        "h6",
+        "hr",
+        "ol",
+        "p",
+        "pre",
+        "table",
+        "ul",
+    }
+    SKIP_TAGS = {"head", "script", "style", "title"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "br" or tag in self.LINE_TAGS:
+            self.chunks.append("\n")
+        elif tag in self.PARAGRAPH_TAGS:
+            self.chunks.append("\n\n")
+        elif tag in ("td", "th"):
+            self.chunks.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag in self.LINE_TAGS:
+            self.chunks.append("\n")
+        elif tag in self.PARAGRAPH_TAGS:
+            self.chunks.append("\n\n")
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.chunks.append(data)
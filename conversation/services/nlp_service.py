@@ -1,11 +1,100 @@
 # conversation/services/nlp_service.py
+"""
+NLP backends deciding how to answer incoming messages.
+
+A backend turns a stored incoming ``Message`` into a ``Decision``: the
+reply, how long to wait before sending it and the follow-up to send if no
+answer comes. The backend named by ``NLP_BACKEND`` is used:
+
+- ``dummy``: random templates and delays, for development
+- ``heuristic``: local rules on the text and the time of day, no requests
+- ``openrouter``: one structured LLM request per message (see decision.py)
+
+With ``NLP_CACHE_SECONDS`` the backend is wrapped in a ``CachedBackend``,
+so a message decided again (a retried task, a replay) reuses its decision.
+Backends are created once per process by ``get_backend`` and shared.
+"""
+
+import hashlib
+import logging
 import random
+import re
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Decision:
+    """Everything decided about one incoming message"""
+
+    reply: str
+    latency_minutes: int
+    followup_time: datetime
+    followup_subject: str
+    followup_body: str
+
+
+class NLPBackend:
+    """Base class of the NLP backends."""
 
+    name = ""
 
-class NLPService:
+    def decide(self, message, history=None) -> Decision:
+        """
+        Decide the reply, its latency and the follow-up for a stored message.
+
+        ``history`` is the list of messages of the conversation to consider,
+        by default every stored message of the conversation.
+        """
+        raise NotImplementedError
+
+    def decide_batch(
+        self, messages, max_concurrency: Optional[int] = None, histories=None
+    ) -> List:
+        """
+        Decide for several messages, in order.
+
+        A message whose decision failed gets the exception in place of its
+        decision. Backends making requests run them concurrently, at most
+        ``max_concurrency`` at once; the base implementation decides one
+        message after the other. ``histories`` holds the history of each
+        message, as for ``decide``.
+        """
+        histories = histories or [None] * len(messages)
+        results = []
+        for message, history in zip(messages, histories):
+            try:
+                results.append(self.decide(message, history))
+            except Exception as e:
+                logger.error("Error deciding for message %s: %s", message.message_id, e)
+                results.append(e)
+        return results
+
+
+class DummyBackend(NLPBackend):
     """Dummy NLP service - in a real app, replace with actual NLP models"""
 
+    name = "dummy"
+
+    def decide(self, message, history=None) -> Decision:
+        followup_subject, followup_body = self.generate_followup_message()
+        return Decision(
+            reply=self.generate_response(message.content),
+            latency_minutes=self.determine_latency(message.content),
+            followup_time=self.determine_followup_time(message.content),
+            followup_subject=followup_subject,
+            followup_body=followup_body,
+        )
+
     def generate_response(self, incoming_message: str, contact_history=None) -> str:
         """Generate a response to an incoming message"""
         # Dummy implementation
@@ -28,7 +117,7 @@ class NLPService:
         """Determine when to follow up if no response is received"""
         # Dummy implementation - follow up in 2-5 days
         days = random.randint(2, 5)
-        return datetime.now() + timedelta(days=days)
+        return timezone.now() + timedelta(days=days)
 
     def generate_followup_message(self, conversation_history=None) -> tuple:
         """Generate a follow-up message when no response has been received"""
@@ -41,3 +130,172 @@ class NLPService:
             "I was thinking about our discussion and wanted to check in with you.",
         ]
         return subject, random.choice(templates)
+
+
+class HeuristicBackend(NLPBackend):
+    """
+    Rule-based decisions, free and deterministic.
+
+    Urgent messages are answered within minutes, questions within the hour
+    and anything else after a few hours. Outside business hours the reply
+    waits for the next business day.
+    """
+
+    name = "heuristic"
+
+    business_hours_start = 9
+    business_hours_end = 17
+    urgent = re.compile(r"\b(urgent|asap|immediately|emergency|today)\b", re.I)
+
+    def decide(self, message, history=None) -> Decision:
+        text = message.content or ""
+        urgent = bool(self.urgent.search(text)) or bool(
+            self.urgent.search(message.subject or "")
+        )
+        question = "?" in text
+
+        if urgent:
+            minutes = 5
+            reply = "Thanks for letting me know, I'm looking into it right now."
+        elif question:
+            minutes = 45
+            reply = "Thanks for your question. Let me get back to you on that shortly."
+        else:
+            minutes = 180
+            reply = "Thanks for your message, noted."
+
+        now = timezone.localtime()
+        if not urgent:
+            minutes = max(minutes, self._minutes_to_business_hours(now))
+        return Decision(
+            reply=reply,
+            latency_minutes=minutes,
+            followup_time=timezone.now() + timedelta(days=1 if urgent else 3),
+            followup_subject="Checking in",
+            followup_body="I wanted to follow up on my last message. Any news?",
+        )
+
+    def _minutes_to_business_hours(self, now: datetime) -> int:
+        """Minutes until business hours start, 0 during business hours."""
+        start = now.replace(
+            hour=self.business_hours_start, minute=0, second=0, microsecond=0
+        )
+        if now.weekday() < 5 and now.hour < self.business_hours_start:
+            return int((start - now).total_seconds() // 60)
+        if now.weekday() < 5 and now.hour < self.business_hours_end:
+            return 0
+        start += timedelta(days=1)
+        while start.weekday() >= 5:
+            start += timedelta(days=1)
+        return int((start - now).total_seconds() // 60)
+
+
+class CachedBackend(NLPBackend):
+    """
+    Reuses the decisions of another backend from the Django cache.
+
+    Decisions are keyed by backend, message ID and content and the messages
+    of the history, so an edited message or one seen in another context is
+    decided again. The follow-up is stored as a delay from the decision and
+    its time computed again on each hit, so a late hit never schedules it in
+    the past.
+    """
+
+    def __init__(self, backend: NLPBackend, timeout: int):
+        self.backend = backend
+        self.timeout = timeout
+        self.name = f"cached:{backend.name}"
+
+    def key(self, message, history=None) -> str:
+        if history is None:
+            # The default history, every stored message of the conversation
+            history_ids = list(
+                message.conversation.messages.order_by("pk").values_list(
+                    "message_id", flat=True
+                )
+            )
+        else:
+            history_ids = [m.message_id for m in history]
+        digest = hashlib.sha256(
+            "\0".join([message.message_id, message.content or "", *history_ids]).encode(
+                "utf-8"
+            )
+        ).hexdigest()
+        # v2: entries hold the follow-up delay instead of its time
+        return f"nlp_decision:v2:{self.backend.name}:{digest}"
+
+    @staticmethod
+    def _entry(decision: Decision) -> tuple:
+        """What is cached of a decision: the follow-up as a delay"""
+        delay = decision.followup_time - timezone.now()
+        return replace(decision, followup_time=None), delay
+
+    @staticmethod
+    def _decision(entry: tuple) -> Decision:
+        decision, delay = entry
+        return replace(decision, followup_time=timezone.now() + delay)
+
+    def decide(self, message, history=None) -> Decision:
+        key = self.key(message, history)
+        entry = cache.get(key)
+        if entry is not None:
+            return self._decision(entry)
+        decision = self.backend.decide(message, history)
+        cache.set(key, self._entry(decision), self.timeout)
+        return decision
+
+    def decide_batch(
+        self, messages, max_concurrency: Optional[int] = None, histories=None
+    ) -> List:
+        histories = histories or [None] * len(messages)
+        keys = [
+            self.key(message, history) for message, history in zip(messages, histories)
+        ]
+        results = {
+            key: self._decision(entry) for key, entry in cache.get_many(keys).items()
+        }
+        missing = [
+            (message, history, key)
+            for message, history, key in zip(messages, histories, keys)
+            if key not in results
+        ]
+        if missing:
+            decided = self.backend.decide_batch(
+                [message for message, _, _ in missing],
+                max_concurrency,
+                [history for _, history, _ in missing],
+            )
+            new = {}
+            for (_, _, key), decision in zip(missing, decided):
+                results[key] = decision
+                if isinstance(decision, Decision):
+                    new[key] = self._entry(decision)
+            cache.set_many(new, self.timeout)
+        return [results[key] for key in keys]
+
+
+# Backend classes by name, imported when first used
+BACKENDS = {
+    "dummy": "conversation.services.nlp_service.DummyBackend",
+    "heuristic": "conversation.services.nlp_service.HeuristicBackend",
+    "openrouter": "conversation.services.decision.ResponseDecider",
+}
+
+# Backends of this process, by name
+_backends: Dict[str, NLPBackend] = {}
+
+
+def get_backend(name: Optional[str] = None) -> NLPBackend:
+    """The backend called ``name`` (NLP_BACKEND by default), shared per process"""
+    name = name or settings.NLP_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in BACKENDS:
+            raise ImproperlyConfigured(
+                f"Unknown NLP backend {name!r}, choose from {', '.join(BACKENDS)}"
+            )
+        backend = import_string(BACKENDS[name])()
+        if settings.NLP_CACHE_SECONDS:
+            backend = CachedBackend(backend, settings.NLP_CACHE_SECONDS)
+        _backends[name] = backend
+    return backend
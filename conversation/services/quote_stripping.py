@@ -0,0 +1,223 @@
+# conversation/services/quote_stripping.py
+"""
+Strip quoted reply history and signatures from plain-text email bodies.
+
+Every reply in a thread usually carries the whole thread below it, so storing
+and prompting with raw bodies grows quadratically with thread length. Only the
+new text on top of each message is worth keeping for the LLM.
+
+Two implementations are provided and produce the same output:
+
+- ``strip_quoted_text`` runs a handful of precompiled regexes over the whole
+  body and is the fastest option for typical message sizes.
+- ``iter_trimmed_lines`` scans an iterable of lines and stops reading as soon
+  as the quoted history starts, so very large bodies (or lazily decoded
+  streams) never have to be scanned in full.
+"""
+
+import io
+import re
+from typing import Iterable, Iterator, List
+
+# Bodies larger than this are handled by the streaming line scanner
+STREAMING_THRESHOLD = 64 * 1024
+
+# A line that starts the quoted history ("On <date>, <name> wrote:")
+_ATTRIBUTION = (
+    r"(?:On[ \t].*\bwrote|Le[ \t].*\ba[ \t]+écrit|Am[ \t].*\bschrieb|El[ \t].*\bescribió)"
+    r"[ \t]*:"
+)
+# Separators Outlook writes above the quoted history
+_SEPARATOR = r"-{2,}[ \t]*Original Message[ \t]*-{2,}.*|_{10,}[ \t]*"
+# Markers above a forwarded message, whose body is the content and is kept
+_FORWARD = r"-{2,}[ \t]*Forwarded message[ \t]*-{2,}.*|Begin forwarded message:[ \t]*"
+# RFC 3676 signature delimiter and the usual mobile sign-offs
+_SIGNATURE = (
+    r"-- ?"
+    r"|Sent from my [\w ]+.*"
+    r"|Get Outlook for \w+.*"
+    r"|Sent from (?:Mail|Yahoo Mail|Outlook) for \w+.*"
+)
+
+_ATTRIBUTION_RE = re.compile(rf"[ \t]*{_ATTRIBUTION}[ \t]*$", re.IGNORECASE)
+_ATTRIBUTION_START_RE = re.compile(r"[ \t]*(?:On|Le|Am|El)[ \t]", re.IGNORECASE)
+_ATTRIBUTION_END_RE = re.compile(
+    r".*\b(?:wrote|écrit|schrieb|escribió)[ \t]*:[ \t]*$", re.IGNORECASE
+)
+_SEPARATOR_RE = re.compile(rf"[ \t]*(?:{_SEPARATOR})$", re.IGNORECASE)
+_FORWARD_RE = re.compile(rf"[ \t]*(?:{_FORWARD})$", re.IGNORECASE)
+_SIGNATURE_RE = re.compile(rf"(?:{_SIGNATURE})$", re.IGNORECASE)
+_OUTLOOK_FROM_RE = re.compile(r"[ \t]*\*?From:\*?[ \t].+$", re.IGNORECASE)
+_OUTLOOK_HEADER_RE = re.compile(r"[ \t]*\*?(?:Sent|Date):\*?[ \t].+$", re.IGNORECASE)
+_QUOTED_RE = re.compile(r"[ \t]*>")
+
+# Start of the quoted history. Attributions may wrap onto a second line.
+_QUOTE_START = (
+    rf"[ \t]*{_ATTRIBUTION}[ \t]*"
+    rf"|[ \t]*(?:On|Le|Am|El)[ \t][^\n]*\n[^\n]*\b(?:wrote|écrit|schrieb|escribió)[ \t]*:[ \t]*"
+    rf"|[ \t]*(?:{_SEPARATOR})"
+    rf"|[ \t]*\*?From:\*?[ \t][^\n]+\n[ \t]*\*?(?:Sent|Date):\*?[ \t][^\n]+"
+)
+_QUOTE_START_RE = re.compile(rf"^(?:{_QUOTE_START})$", re.IGNORECASE | re.MULTILINE)
+_FORWARD_SEARCH_RE = re.compile(
+    rf"^[ \t]*(?:{_FORWARD})$", re.IGNORECASE | re.MULTILINE
+)
+
+# Single pass over the whole body: the earliest match marks where the quoted
+# history or signature begins.
+_CUT_RE = re.compile(
+    rf"^(?:{_QUOTE_START}|(?:{_SIGNATURE}))$", re.IGNORECASE | re.MULTILINE
+)
+
+
+def strip_quoted_text(body: str) -> str:
+    """
+    Return the new text of an email body, without quoted history or signature.
+
+    Args:
+        body: The plain-text body as received.
+
+    Returns:
+        The trimmed body. Returns the body unchanged (minus surrounding
+        whitespace) when no quoted history is found. A forwarded message
+        is kept whole below the trimmed comment on top of it.
+    """
+    if not body:
+        return ""
+
+    if len(body) > STREAMING_THRESHOLD:
+        return "\n".join(iter_trimmed_lines(io.StringIO(body))).strip()
+
+    body = body.replace("\r\n", "\n")
+    forwarded = ""
+    forward = _FORWARD_SEARCH_RE.search(body)
+    # A forward marker inside the quoted history is part of that history
+    if forward and not _QUOTE_START_RE.search(body, 0, forward.start()):
+        body, forwarded = body[: forward.start()], body[forward.start() :].strip()
+
+    match = _CUT_RE.search(body)
+    if match:
+        body = body[: match.start()]
+
+    if not forwarded:
+        return _strip_trailing_quote(body).strip()
+    comment = _strip_trailing_quote(body).lstrip()
+    return f"{comment}\n\n{forwarded}" if comment else forwarded
+
+
+def iter_trimmed_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Yield the lines of a body up to the start of the quoted history.
+
+    Reading stops at the first attribution, separator or signature line, so
+    the rest of the input is never consumed. Runs of ``>``-quoted and blank
+    lines are held back and only emitted if new text follows them. A forward
+    marker, even below a signature, is yielded with the rest of the input.
+
+    Args:
+        lines: Any iterable of lines, with or without line endings.
+
+    Yields:
+        The lines of the trimmed body, without line endings.
+    """
+    lines = iter(lines)
+    pending_quote: List[str] = []
+    previous = None
+    started = False
+
+    for raw_line in lines:
+        line = raw_line.rstrip("\r\n")
+
+        if previous is not None:
+            if _ATTRIBUTION_START_RE.match(previous) and _ATTRIBUTION_END_RE.match(
+                line
+            ):
+                return
+            if _OUTLOOK_FROM_RE.match(previous) and _OUTLOOK_HEADER_RE.match(line):
+                return
+            # The held-back line turned out to be ordinary text
+            yield from _flush(previous, pending_quote, started)
+            started = True
+            pending_quote = []
+            previous = None
+
+        if _FORWARD_RE.match(line):
+            yield from _forwarded(line, lines, started)
+            return
+
+        if _SIGNATURE_RE.match(line):
+            yield from _forwarded_below_signature(lines, started)
+            return
+
+        if _ATTRIBUTION_RE.match(line) or _SEPARATOR_RE.match(line):
+            return
+
+        if _QUOTED_RE.match(line) or ((started or pending_quote) and not line.strip()):
+            pending_quote.append(line)
+            continue
+
+        if _ATTRIBUTION_START_RE.match(line) or _OUTLOOK_FROM_RE.match(line):
+            # May be the first half of a two-line header, decide on next line
+            previous = line
+            continue
+
+        if not started and not line.strip() and not pending_quote:
+            continue
+
+        yield from _flush(line, pending_quote, started)
+        started = True
+        pending_quote = []
+
+    if previous is not None:
+        yield from _flush(previous, pending_quote, started)
+
+
+def _forwarded(marker: str, lines: Iterator[str], started: bool) -> Iterator[str]:
+    """Yield a forward marker and the rest of the input after it."""
+    if started:
+        yield ""
+    yield marker.lstrip()
+    for raw_line in lines:
+        yield raw_line.rstrip("\r\n")
+
+
+def _forwarded_below_signature(lines: Iterator[str], started: bool) -> Iterator[str]:
+    """Skip a signature, yielding the forwarded message below it if any."""
+    previous = ""
+    for raw_line in lines:
+        line = raw_line.rstrip("\r\n")
+        if _FORWARD_RE.match(line):
+            yield from _forwarded(line, lines, started)
+            return
+        if (
+            _ATTRIBUTION_RE.match(line)
+            or _SEPARATOR_RE.match(line)
+            or (
+                _ATTRIBUTION_START_RE.match(previous)
+                and _ATTRIBUTION_END_RE.match(line)
+            )
+            or (_OUTLOOK_FROM_RE.match(previous) and _OUTLOOK_HEADER_RE.match(line))
+        ):
+            return
+        previous = line
+
+
+def _strip_trailing_quote(body: str) -> str:
+    """Drop the block of ">"-quoted and blank lines at the end of a body."""
+    end = len(body)
+    while end > 0:
+        start = body.rfind("\n", 0, end) + 1
+        if body[start:end].strip() and not _QUOTED_RE.match(body, start, end):
+            break
+        end = max(start - 1, 0)
+    return body[:end]
+
+
+def _flush(line: str, pending_quote: List[str], started: bool) -> Iterator[str]:
+    """Emit held-back quoted lines followed by the current line."""
+    for quoted in pending_quote:
+        if started or quoted.strip():
+            started = True
+            yield quoted
+    if started or line.strip():
+        yield line
@@ -0,0 +1,380 @@
+# conversation/services/replay.py
+"""
+Offline replay of latency decisions over stored conversations.
+
+Every stored incoming message is decided again by one or more backends,
+seeing only the part of its conversation that existed when it arrived.
+Messages are streamed in conversation and time order, so the as-of history
+of a message is the prefix of its conversation read so far. Backends are
+the NLP backends of ``nlp_service.BACKENDS`` and ``latency-agent`` (the
+``HumanLatencyAgent``, which also says whether a message is urgent or the
+conversation stuck).
+
+Results are appended to a JSONL file, one line per message with the result
+of each backend. After each batch a checkpoint next to the file records the
+last message written, the file size and the backends, so an interrupted
+replay resumes where it stopped, with the same backends only. ``summarize`` computes the latency distribution, the
+urgent and stuck rates of each backend and the agreement between backends.
+"""
+
+import itertools
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from django.db.models import F
+
+from ..models import Message
+from ..tracing import percentile
+from .nlp_service import BACKENDS, get_backend
+
+logger = logging.getLogger(__name__)
+
+LATENCY_AGENT = "latency-agent"
+
+# Latencies within this factor of each other count as an agreement
+AGREEMENT_FACTOR = 2.0
+
+
+@dataclass
+class ReplayResult:
+    latency_minutes: Optional[int] = None
+    urgent: Optional[bool] = None
+    stuck: Optional[bool] = None
+    error: str = ""
+
+
+def backend_names() -> List[str]:
+    return [LATENCY_AGENT, *BACKENDS]
+
+
+def checkpoint_path(output) -> Path:
+    output = Path(output)
+    return output.with_name(output.name + ".checkpoint.json")
+
+
+def iter_as_of(
+    queryset=None,
+    start_conversation: int = 0,
+    chunk_size: int = 2000,
+    since: Optional[datetime] = None,
+) -> Iterator[Tuple[Message, List[Message]]]:
+    """
+    Yield each incoming message with the history of its conversation then.
+
+    The history holds the messages of the conversation up to and including
+    the message, oldest first. With ``since`` only the messages received
+    from then are yielded, still with their whole history.
+    """
+    queryset = Message.objects.all() if queryset is None else queryset
+    # Raw bodies are never shown to the backends
+    queryset = queryset.defer("raw_content").filter(
+        conversation_id__gte=start_conversation
+    )
+    if since is not None:
+        queryset = queryset.filter(
+            conversation_id__in=Message.objects.filter(
+                timestamp__gte=since, message_type="INCOMING"
+            ).values("conversation_id")
+        )
+    messages = queryset.order_by(
+        "conversation_id", F("timestamp").asc(nulls_first=True), "pk"
+    ).iterator(chunk_size=chunk_size)
+    for _, conversation in itertools.groupby(messages, lambda m: m.conversation_id):
+        history = []
+        for message in conversation:
+            history.append(message)
+            if message.message_type != "INCOMING":
+                continue
+            if since is None or (message.timestamp and message.timestamp >= since):
+                yield message, list(history)
+
+
+def decide(name: str, messages, histories, concurrency: int) -> List[ReplayResult]:
+    """Results of one backend for a batch of messages."""
+    if name == LATENCY_AGENT:
+        agent = _latency_agent()
+
+        def run(args):
+            try:
+                urgent, stuck, minutes = agent.decide_latency(*args)
+            except Exception as e:
+                return ReplayResult(error=str(e) or type(e).__name__)
+            return ReplayResult(latency_minutes=minutes, urgent=urgent, stuck=stuck)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(run, zip(messages, histories)))
+
+    results = []
+    decisions = get_backend(name).decide_batch(messages, concurrency, histories)
+    for decision in decisions:
+        if isinstance(decision, Exception):
+            results.append(ReplayResult(error=str(decision) or type(decision).__name__))
+        else:
+            results.append(ReplayResult(latency_minutes=decision.latency_minutes))
+    return results
+
+
+_agent = None
+
+
+def _latency_agent():
+    """The HumanLatencyAgent of this process."""
+    global _agent
+    if _agent is None:
+        from .latency_determination import HumanLatencyAgent
+
+        _agent = HumanLatencyAgent()
+    return _agent
+
+
+def replay(
+    backends: List[str],
+    output,
+    batch_size: int = 50,
+    concurrency: int = 4,
+    resume: bool = False,
+    queryset=None,
+    limit: Optional[int] = None,
+    since: Optional[datetime] = None,
+) -> int:
+    """
+    Replay the decisions of ``backends`` into the JSONL file ``output``.
+
+    Args:
+        backends: Names from ``backend_names()``.
+        output: Path of the JSONL result file.
+        batch_size: Messages decided (and checkpointed) together.
+        concurrency: Requests of a backend in flight at once.
+        resume: Continue from the checkpoint of ``output`` if there is one.
+        queryset: Messages to replay, all stored messages by default.
+        limit: Stop after this many messages.
+        since: Only decide the messages received from then.
+
+    Returns:
+        The number of messages replayed by this call.
+
+    Raises:
+        ValueError: The checkpoint to resume was written by other backends.
+    """
+    output = Path(output)
+    checkpoint_file = checkpoint_path(output)
+    checkpoint = {}
+    if resume and checkpoint_file.exists():
+        checkpoint = json.loads(checkpoint_file.read_text())
+        # Rows of other backends would be mixed into one file
+        if checkpoint.get("backends") != backends:
+            raise ValueError(
+                f"The checkpoint of {output} was written by "
+                f"{', '.join(checkpoint.get('backends') or [])}, "
+                f"not {', '.join(backends)}"
+            )
+        logger.info("Resuming after message %s", checkpoint["message_pk"])
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    mode = "r+" if checkpoint else "w"
+    count = 0
+    with open(output, mode, encoding="utf-8") as f:
+        if checkpoint:
+            # Drop lines written after the last checkpoint
+            f.seek(checkpoint["offset"])
+            f.truncate()
+
+        pending = _skip_done(
+            iter_as_of(queryset, checkpoint.get("conversation_id", 0), since=since),
+            checkpoint,
+        )
+        if limit is not None:
+            pending = itertools.islice(pending, limit)
+        while True:
+            batch = list(itertools.islice(pending, batch_size))
+            if not batch:
+                return count
+            messages = [message for message, _ in batch]
+            histories = [history for _, history in batch]
+            results = {
+                name: decide(name, messages, histories, concurrency)
+                for name in backends
+            }
+            for index, (message, history) in enumerate(batch):
+                row = {
+                    "message_id": message.message_id,
+                    "message_pk": message.pk,
+                    "conversation_id": message.conversation_id,
+                    "timestamp": (
+                        message.timestamp.isoformat() if message.timestamp else None
+                    ),
+                    "history_length": len(history),
+                }
+                for name in backends:
+                    row[name] = asdict(results[name][index])
+                f.write(json.dumps(row) + "\n")
+            f.flush()
+            count += len(batch)
+            _write_checkpoint(
+                checkpoint_file,
+                {
+                    "conversation_id": messages[-1].conversation_id,
+                    "message_pk": messages[-1].pk,
+                    "offset": f.tell(),
+                    "backends": backends,
+                },
+            )
+            logger.info("Replayed %d messages", count)
+
+
+def _skip_done(pending, checkpoint):
+    """Skip the messages up to the one of the checkpoint."""
+    if not checkpoint:
+        yield from pending
+        return
+    done = False
+    for message, history in pending:
+        if done:
+            yield message, history
+        elif message.pk == checkpoint["message_pk"]:
+            done = True
+        elif message.conversation_id > checkpoint["conversation_id"]:
+            # The checkpointed message is gone, start from the next conversation
+            done = True
+            yield message, history
+
+
+def _write_checkpoint(path: Path, data: dict):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+def read_results(path) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def summarize(path, backends: List[str]) -> dict:
+    """
+    Statistics of a result file.
+
+    Returns, for each backend, the number of decisions and errors, the
+    latency distribution in minutes and the urgent and stuck rates (None
+    when the backend does not decide them), and for each pair of backends
+    the share of messages where their latencies are within
+    ``AGREEMENT_FACTOR`` of each other and where they agree on urgency.
+    """
+    latencies = {name: [] for name in backends}
+    errors = dict.fromkeys(backends, 0)
+    flags = {name: {"urgent": [], "stuck": []} for name in backends}
+    pairs = list(itertools.combinations(backends, 2))
+    agreement = {
+        pair: {"compared": 0, "latency": 0, "urgent": [0, 0]} for pair in pairs
+    }
+
+    for row in read_results(path):
+        for name in backends:
+            result = row.get(name, {})
+            if result.get("error"):
+                errors[name] += 1
+            elif result.get("latency_minutes") is not None:
+                latencies[name].append(result["latency_minutes"])
+            for flag in ("urgent", "stuck"):
+                if result.get(flag) is not None:
+                    flags[name][flag].append(result[flag])
+        for a, b in pairs:
+            first, second = row.get(a, {}), row.get(b, {})
+            x, y = first.get("latency_minutes"), second.get("latency_minutes")
+            if x is None or y is None:
+                continue
+            counts = agreement[(a, b)]
+            counts["compared"] += 1
+            if _close(x, y):
+                counts["latency"] += 1
+            if first.get("urgent") is not None and second.get("urgent") is not None:
+                counts["urgent"][0] += 1
+                counts["urgent"][1] += first["urgent"] == second["urgent"]
+
+    summary = {"backends": {}, "agreement": {}}
+    for name in backends:
+        values = sorted(latencies[name])
+        summary["backends"][name] = {
+            "decisions": len(values),
+            "errors": errors[name],
+            "latency_minutes": {
+                "mean": sum(values) / len(values) if values else 0.0,
+                "p50": percentile(values, 50),
+                "p90": percentile(values, 90),
+                "p99": percentile(values, 99),
+                "max": values[-1] if values else 0,
+            },
+            **{
+                f"{flag}_rate": _rate(flags[name][flag]) for flag in ("urgent", "stuck")
+            },
+        }
+    for (a, b), counts in agreement.items():
+        compared, urgent = counts["compared"], counts["urgent"]
+        summary["agreement"][f"{a}/{b}"] = {
+            "compared": compared,
+            "latency": counts["latency"] / compared if compared else None,
+            "urgent": urgent[1] / urgent[0] if urgent[0] else None,
+        }
+    return summary
+
+
+def _close(x: int, y: int) -> bool:
+    return abs(math.log(max(x, 1) / max(y, 1))) <= math.log(AGREEMENT_FACTOR)
+
+
+def _rate(values: List[bool]) -> Optional[float]:
+    return sum(values) / len(values) if values else None
+
+
+def to_parquet(path, parquet_path, backends: List[str]):
+    """
+    Convert a result file to Parquet, one column per backend and field.
+
+    Requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    message_fields = [
+        ("message_id", pa.string()),
+        ("message_pk", pa.int64()),
+        ("conversation_id", pa.int64()),
+        ("timestamp", pa.string()),
+        ("history_length", pa.int64()),
+    ]
+    result_fields = [
+        ("latency_minutes", pa.int64()),
+        ("urgent", pa.bool_()),
+        ("stuck", pa.bool_()),
+        ("error", pa.string()),
+    ]
+    schema = pa.schema(
+        message_fields
+        + [
+            (f"{name}.{field}", type)
+            for name in backends
+            for field, type in result_fields
+        ]
+    )
+    rows = read_results(path)
+    with pq.ParquetWriter(str(parquet_path), schema) as writer:
+        while True:
+            chunk = list(itertools.islice(rows, 10000))
+            if not chunk:
+                return
+            columns = {key: [row[key] for row in chunk] for key, _ in message_fields}
+            for name in backends:
+                for field, _ in result_fields:
+                    columns[f"{name}.{field}"] = [
+                        row.get(name, {}).get(field) for row in chunk
+                    ]
+            writer.write_table(pa.table(columns, schema=schema))
@@ -0,0 +1,304 @@
+# conversation/services/search.py
+"""
+Full-text search over stored messages.
+
+SQLite uses an FTS5 virtual table and Postgres a ``tsvector`` side table with
+a GIN index. Both are keyed by ``Message.id`` and index the subject and the
+trimmed content. Rows are indexed from Python when messages are saved (see
+``conversation.signals``), and removed by the database when the message row
+is deleted. Other backends fall back to a plain ``icontains`` scan.
+
+Search only needs the message ID and rank, so on SQLite 3.43 and later the
+FTS5 table is contentless (``content=''``, ``contentless_delete=1``): it
+holds the index but no copy of the text, which would undo the compression
+of ``Message.content``. Older SQLite versions cannot delete rows from a
+contentless table, so there the table keeps an uncompressed copy of the
+subject and content.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Iterable, List, Sequence, Tuple
+
+from django.db import connections, transaction
+
+from ..models import Message
+
+SQLITE_TABLE = "conversation_message_fts"
+POSTGRES_TABLE = "conversation_message_search"
+POSTGRES_CONFIG = "english"
+
+_TERM_RE = re.compile(r"\w+\*?", re.UNICODE)
+
+
+@dataclass
+class SearchHit:
+    message: Message
+    rank: float
+
+
+@dataclass
+class SearchPage:
+    hits: List[SearchHit]
+    page: int
+    page_size: int
+    has_next: bool
+
+
+class SearchBackend:
+    """Base class for the database-specific search implementations."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def index(self, rows: Sequence[Tuple[int, str, str]]):
+        """Add or replace the index entries for (id, subject, content) rows."""
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove every entry from the index."""
+        raise NotImplementedError
+
+    def search(self, query: str, limit: int, offset: int) -> List[Tuple[int, float]]:
+        """Return (message id, rank) pairs, best match first."""
+        raise NotImplementedError
+
+
+class SQLiteSearchBackend(SearchBackend):
+    def index(self, rows):
+        with self.connection.cursor() as cursor:
+            # Contentless tables replace a row by a delete and an insert
+            cursor.executemany(
+                f"DELETE FROM {SQLITE_TABLE} WHERE rowid = %s",
+                [(row[0],) for row in rows],
+            )
+            cursor.executemany(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, subject, content) "
+                "VALUES (%s, %s, %s)",
+                rows,
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SQLITE_TABLE}")
+
+    def search(self, query, limit, offset):
+        match = self.to_match_expression(query)
+        if not match:
+            return []
+        with self.connection.cursor() as cursor:
+            # bm25() is lower for better matches; subject hits weigh double
+            cursor.execute(
+                f"SELECT rowid, bm25({SQLITE_TABLE}, 2.0, 1.0) AS rank "
+                f"FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s "
+                "ORDER BY rank LIMIT %s OFFSET %s",
+                [match, limit, offset],
+            )
+            return [(row[0], -row[1]) for row in cursor.fetchall()]
+
+    @staticmethod
+    def to_match_expression(query: str) -> str:
+        """Turn free text into an FTS5 query matching all terms."""
+        terms = []
+        for term in _TERM_RE.findall(query):
+            if term.endswith("*"):
+                terms.append(f'"{term[:-1]}"*')
+            else:
+                terms.append(f'"{term}"')
+        return " ".join(terms)
+
+
+class PostgresSearchBackend(SearchBackend):
+    def index(self, rows):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {POSTGRES_TABLE} (message_id, document) VALUES "
+                f"(%s, setweight(to_tsvector('{POSTGRES_CONFIG}', %s), 'A') || "
+                f"setweight(to_tsvector('{POSTGRES_CONFIG}', %s), 'B')) "
+                "ON CONFLICT (message_id) DO UPDATE SET document = EXCLUDED.document",
+                rows,
+            )
+
+    def clear(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {POSTGRES_TABLE}")
+
+    def search(self, query, limit, offset):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT message_id, ts_rank_cd(document, q) AS rank "
+                f"FROM {POSTGRES_TABLE}, "
+                f"websearch_to_tsquery('{POSTGRES_CONFIG}', %s) q "
+                "WHERE document @@ q ORDER BY rank DESC LIMIT %s OFFSET %s",
+                [query, limit, offset],
+            )
+            return cursor.fetchall()
+
+
+class FallbackSearchBackend(SearchBackend):
+    """
+    Unindexed search for databases without a full-text engine.
+
+    Message content is stored compressed, so only subjects can be matched.
+    """
+
+    def index(self, rows):
+        pass
+
+    def clear(self):
+        pass
+
+    def search(self, query, limit, offset):
+        ids = (
+            Message.objects.using(self.connection.alias)
+            .filter(subject__icontains=query)
+            .order_by("-id")
+            .values_list("id", flat=True)[offset : offset + limit]
+        )
+        return [(message_id, 0.0) for message_id in ids]
+
+
+BACKENDS = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_search_backend(using: str = "default") -> SearchBackend:
+    """Return the search backend for a database alias."""
+    connection = connections[using]
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)(connection)
+
+
+def index_messages(messages: Iterable[Message], using: str = "default"):
+    """
+    Add messages to the search index, replacing existing entries.
+
+    Must be called explicitly after ``bulk_create``, which does not send the
+    ``post_save`` signal used to index single saves.
+    """
+    rows = [(m.pk, m.subject or "", m.content or "") for m in messages]
+    if rows:
+        get_search_backend(using).index(rows)
+
+
+def search_messages(
+    query: str, page: int = 1, page_size: int = 20, using: str = "default"
+) -> SearchPage:
+    """
+    Search messages by subject and content, best match first.
+
+    Args:
+        query: Free text. All terms must match; ``term*`` matches a prefix.
+        page: 1-based page number.
+        page_size: Number of hits per page.
+        using: Database alias to search.
+
+    Returns:
+        A SearchPage with the hits of the requested page.
+    """
+    page = max(page, 1)
+    backend = get_search_backend(using)
+    # Fetch one extra row to know whether there is a next page
+    ranked = backend.search(query, page_size + 1, (page - 1) * page_size)
+    has_next = len(ranked) > page_size
+    ranked = ranked[:page_size]
+
+    messages = (
+        Message.objects.using(using)
+        .select_related("conversation")
+        .in_bulk([message_id for message_id, _ in ranked])
+    )
+    hits = [
+        SearchHit(message=messages[message_id], rank=rank)
+        for message_id, rank in ranked
+        if message_id in messages
+    ]
+    return SearchPage(hits=hits, page=page, page_size=page_size, has_next=has_next)
+
+
+def rebuild_index(chunk_size: int = 1000, using: str = "default", progress=None) -> int:
+    """
+    Rebuild the search index from the message table.
+
+    Messages are read in primary key order, one chunk per transaction, so
+    the rebuild runs in constant memory and does not hold long write locks.
+
+    Args:
+        chunk_size: Number of messages indexed per transaction.
+        using: Database alias to rebuild.
+        progress: Optional callable receiving the running count.
+
+    Returns:
+        The number of messages indexed.
+    """
+    backend = get_search_backend(using)
+    with transaction.atomic(using=using):
+        backend.clear()
+
+    total = 0
+    last_id = 0
+    while True:
+        chunk = list(
+            Message.objects.using(using)
+            .filter(pk__gt=last_id)
+            .order_by("pk")
+            .only("id", "subject", "content")[:chunk_size]
+        )
+        if not chunk:
+            return total
+
+        with transaction.atomic(using=using):
+            index_messages(chunk, using=using)
+        total += len(chunk)
+        last_id = chunk[-1].pk
+        if progress:
+            progress(total)
+
+
+def ensure_index_schema(using: str = "default"):
+    """
+    Create the search table and delete trigger if they are missing.
+
+    SQLite drops triggers when a migration rebuilds ``conversation_message``,
+    so this runs after every ``migrate`` to put the trigger back.
+    """
+    connection = connections[using]
+    statements = CREATE_INDEX_SQL.get(connection.vendor, [])
+    if connection.vendor == "sqlite":
+        statements = [
+            statement.format(options=sqlite_fts_options(connection))
+            for statement in statements
+        ]
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def sqlite_fts_options(connection) -> str:
+    """Options making the FTS5 table contentless where SQLite supports it"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_version()")
+        version = tuple(int(part) for part in cursor.fetchone()[0].split("."))
+    return ", content='', contentless_delete=1" if version >= (3, 43) else ""
+
+
+CREATE_INDEX_SQL = {
+    "sqlite": [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING fts5("
+        "subject, content, tokenize='porter unicode61'{options})",
+        # Drop index entries together with their message
+        f"CREATE TRIGGER IF NOT EXISTS {SQLITE_TABLE}_delete "
+        f"AFTER DELETE ON conversation_message BEGIN "
+        f"DELETE FROM {SQLITE_TABLE} WHERE rowid = old.id; END",
+    ],
+    "postgresql": [
+        f"CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ("
+        "message_id bigint PRIMARY KEY "
+        "REFERENCES conversation_message (id) ON DELETE CASCADE "
+        "DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document_gin "
+        f"ON {POSTGRES_TABLE} USING GIN (document)",
+    ],
+}
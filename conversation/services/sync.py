@@ -0,0 +1,124 @@
+# conversation/services/sync.py
+"""
+Incremental mailbox sync driven by Gmail push notifications.
+
+Gmail publishes a notification to a Pub/Sub topic when the watched inbox
+changes (see ``GmailService.watch``). Notifications only carry the mailbox
+address and its new history ID, so the receiver (``views.gmail_push``)
+schedules a sync of that mailbox, which lists the messages added since the
+history ID stored on its ``Mailbox`` and ingests them.
+
+Syncs are debounced: the first notification of a burst schedules one sync
+``GMAIL_PUSH_DEBOUNCE`` seconds later, the others are dropped.
+"""
+
+import logging
+from datetime import datetime, timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from ..models import ArchivedConversation, Conversation, Mailbox
+
+logger = logging.getLogger(__name__)
+
+
+def new_message_ids(gmail, start_history_id: str) -> Tuple[List[str], Optional[str]]:
+    """
+    IDs of the messages added to the inbox since a history ID.
+
+    Returns the IDs in history order and the history ID to resume from.
+    Raises ``HistoryExpired`` when the start history ID is too old.
+    """
+    ids = []
+    seen = set()
+    history_id = None
+    page_token = None
+    while True:
+        records, page_token, page_history_id = gmail.list_history_page(
+            start_history_id, page_token
+        )
+        history_id = page_history_id or history_id
+        for record in records:
+            for added in record.get("messagesAdded", []):
+                message = added["message"]
+                # Our own replies are added to the thread too
+                if "INBOX" not in message.get("labelIds", ["INBOX"]):
+                    continue
+                if message["id"] not in seen:
+                    seen.add(message["id"])
+                    ids.append(message["id"])
+        if not page_token:
+            return ids, history_id
+
+
+def schedule_sync(email_address: str) -> bool:
+    """
+    Queue a sync of the mailbox unless one is already pending.
+
+    Returns True if a sync was queued.
+    """
+    from ..tasks import sync_mailbox
+
+    debounce = settings.GMAIL_PUSH_DEBOUNCE
+    if not cache.add(f"gmail_push:{email_address}", 1, debounce):
+        return False
+    mailbox_id = (
+        Mailbox.objects.filter(email_address=email_address, active=True)
+        .values_list("pk", flat=True)
+        .first()
+    )
+    if mailbox_id is None:
+        logger.warning("Not watching %s, ignoring notification", email_address)
+        return False
+    sync_mailbox.apply_async((mailbox_id,), countdown=debounce)
+    return True
+
+
+def renew_watch(gmail, topic_name: str) -> Optional[Mailbox]:
+    """
+    Start or renew the push watch of the mailbox and record it.
+
+    The mailbox of ``gmail`` is created if needed (for the account of the
+    token file, which then owns the conversations without a mailbox). A new
+    mailbox starts syncing from the history ID of the watch; the history ID
+    of a known mailbox is kept so no change is skipped.
+    """
+    profile = gmail.get_profile()
+    response = gmail.watch(topic_name)
+    if not profile or not response:
+        return None
+
+    expiration = datetime.fromtimestamp(
+        int(response["expiration"]) / 1000, dt_timezone.utc
+    )
+    mailbox = gmail.mailbox
+    if mailbox is None:
+        mailbox, created = Mailbox.objects.get_or_create(
+            email_address=profile["emailAddress"]
+        )
+        if created:
+            # The token file account takes over the mail stored before it
+            # had a mailbox
+            Conversation.objects.filter(mailbox=None).update(mailbox=mailbox)
+            ArchivedConversation.objects.filter(mailbox=None).update(mailbox=mailbox)
+    mailbox.watch_expiration = expiration
+    if not mailbox.history_id:
+        mailbox.history_id = response["historyId"]
+    mailbox.save(update_fields=["watch_expiration", "history_id"])
+    logger.info(
+        "Watching %s until %s (history %s)",
+        mailbox.email_address,
+        expiration,
+        mailbox.history_id,
+    )
+    return mailbox
+
+
+def mark_synced(mailbox: Mailbox, history_id: Optional[str]):
+    if history_id:
+        mailbox.history_id = history_id
+    mailbox.last_synced = timezone.now()
+    mailbox.save(update_fields=["history_id", "last_synced"])
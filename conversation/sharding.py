@@ -0,0 +1,72 @@
+# conversation/sharding.py
+"""
+Assignment of mailboxes to worker shards by consistent hashing.
+
+Each shard named in ``MAILBOX_SHARDS`` has its own ``ingest.<shard>`` and
+``send.<shard>`` queues, consumed by its workers (see the Procfile). Tasks
+working on one mailbox take its ID as their first argument and are routed
+to the queues of the shard owning it. Shards are placed at many points of
+a hash ring, so adding or removing one only moves the mailboxes between it
+and its neighbours, about 1/N of them, and every mailbox is always served
+by the same workers.
+"""
+
+import bisect
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+
+# Points per shard on the ring, to even out the share of each
+REPLICAS = 100
+
+# Stage of each mailbox task, see route_task
+SHARDED_TASKS = {
+    "conversation.tasks.poll_mailbox": "ingest",
+    "conversation.tasks.fetch_unread_page": "ingest",
+    "conversation.tasks.process_email": "ingest",
+    "conversation.tasks.sync_mailbox": "ingest",
+    "conversation.tasks.send_scheduled_message": "send",
+}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(value.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    def __init__(self, nodes, replicas: int = REPLICAS):
+        points = sorted(
+            (_hash(f"{node}#{index}"), node)
+            for node in nodes
+            for index in range(replicas)
+        )
+        self._keys = [key for key, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key) -> str:
+        """The node owning ``key``: the first point clockwise of its hash."""
+        if not self._nodes:
+            raise ValueError("Empty hash ring")
+        index = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._nodes[index]
+
+
+@lru_cache(maxsize=8)
+def _ring(nodes: tuple) -> HashRing:
+    return HashRing(nodes)
+
+
+def shard_for(mailbox_id) -> str:
+    return _ring(tuple(settings.MAILBOX_SHARDS)).node_for(mailbox_id)
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """Celery router sending mailbox tasks to the queues of their shard."""
+    stage = SHARDED_TASKS.get(name)
+    if stage is None or not settings.MAILBOX_SHARDS:
+        return None
+    mailbox_id = args[0] if args else kwargs.get("mailbox_id")
+    return {"queue": f"{stage}.{shard_for(mailbox_id)}"}
@@ -0,0 +1,50 @@
+# conversation/signals.py
+import time
+
+from celery.signals import task_failure, task_postrun, task_prerun
+from django.db.models.signals import post_migrate, post_save
+from django.dispatch import receiver
+
+from . import metrics
+from .models import Message
+from .services.search import ensure_index_schema, index_messages
+
+
+@receiver(post_save, sender=Message, dispatch_uid="index_saved_message")
+def index_saved_message(sender, instance, using, raw=False, **kwargs):
+    """Keep the full-text index in sync with single message saves"""
+    if not raw:
+        index_messages([instance], using=using)
+
+
+def ensure_search_schema(sender, using, **kwargs):
+    """Recreate search objects dropped by table rebuilds during migrate"""
+    ensure_index_schema(using)
+
+
+def connect_migrate_signals(app_config):
+    post_migrate.connect(
+        ensure_search_schema, sender=app_config, dispatch_uid="ensure_search_schema"
+    )
+
+
+# Start times of running Celery tasks by task ID
+_task_started = {}
+
+
+@task_prerun.connect
+def time_task_start(task_id, task, **kwargs):
+    if metrics.enabled():
+        _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def time_task_end(task_id, task, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        metrics.TASK_SECONDS.observe(time.perf_counter() - started, task=task.name)
+
+
+@task_failure.connect
+def count_task_failure(sender, **kwargs):
+    metrics.TASK_FAILURES.inc(task=sender.name)
@@ -1,19 +1,215 @@
 # conversation/tasks.py
-from celery import shared_task
-from .services.email_processor import EmailProcessor
+"""
+Background tasks, split by stage so each queue can be scaled on its own
+(see CELERY_TASK_ROUTES and the Procfile):
+
+- ``ingest``: listing unread mail (or syncing the mailbox history after a
+  push notification) and storing each message
+- ``llm``: generating and scheduling the response to a stored message
+- ``send``: sending one due scheduled message
+
+Tasks working on one mailbox take its ID (None for the token file account
+when no mailbox is configured) as their first argument; with MAILBOX_SHARDS
+their ingest and send queues are split by shard (see sharding.py). A task
+over the Gmail quota budget of its mailbox is retried when the budget
+window ends. A failed response decision is retried with an exponential
+backoff, up to six times.
+
+The periodic sweeps only enqueue work and hold a singleton lock, so beat
+runs never overlap. Tasks are acknowledged late and may run again after a
+worker crash, so each one checks whether its work is already done.
+
+Every task can be profiled by listing it in PROFILE_TASKS.
+"""
+
+import logging
+
+from celery import Task, shared_task
+from django.conf import settings
+
+from . import tracing
+from .locks import singleton
+from .profiling import profiled
+from .models import Mailbox, Message
+from .quota import QuotaExceeded
+from .services import archive, sync
+from .services.email_processor import EmailProcessor, due_scheduled_messages
+from .services.gmail_service import HistoryExpired
+
+logger = logging.getLogger(__name__)
+
+# EmailProcessor of each mailbox, by mailbox ID
+_processors = {}
+
+
+def get_processor(mailbox_id=None) -> EmailProcessor:
+    """EmailProcessor of a mailbox, shared by the tasks of a worker process"""
+    processor = _processors.get(mailbox_id)
+    if processor is None:
+        mailbox = Mailbox.objects.get(pk=mailbox_id) if mailbox_id else None
+        processor = _processors[mailbox_id] = EmailProcessor(mailbox=mailbox)
+    return processor
+
+
+def active_mailbox_ids():
+    """IDs of the mailboxes to serve, [None] when none is configured"""
+    ids = list(Mailbox.objects.filter(active=True).values_list("pk", flat=True))
+    if not ids and not Mailbox.objects.exists():
+        return [None]
+    return ids
+
+
+class MailboxTask(Task):
+    """Retries the task once the Gmail quota budget of its mailbox refills"""
+
+    def __call__(self, *args, **kwargs):
+        try:
+            return super().__call__(*args, **kwargs)
+        except QuotaExceeded as e:
+            logger.info("%s, retrying", e)
+            raise self.retry(exc=e, countdown=e.retry_after, max_retries=None)
 
 
 @shared_task
+@profiled
 def check_for_new_emails():
-    """Background task to check for and process new emails"""
-    processor = EmailProcessor()
-    print("[DEBUG] Checking for new emails...")
-    processor.process_new_emails()
+    """Background task to queue a poll of every mailbox for unread email"""
+    for mailbox_id in active_mailbox_ids():
+        poll_mailbox.delay(mailbox_id)
+
+
+@shared_task(base=MailboxTask)
+@profiled
+def poll_mailbox(mailbox_id):
+    """Queue every unread email of a mailbox for processing"""
+    with singleton(f"poll_mailbox:{mailbox_id}") as acquired:
+        if not acquired:
+            logger.info("Previous poll of mailbox %s still running", mailbox_id)
+            return
+        logger.debug("Checking mailbox %s for new emails", mailbox_id)
+        page_token = fetch_unread_page(mailbox_id)
+        while page_token:
+            page_token = fetch_unread_page(mailbox_id, page_token)
+
+
+@shared_task(base=MailboxTask)
+@profiled
+def fetch_unread_page(mailbox_id, page_token=None):
+    """Queue one page of unread emails, returns the next page token"""
+    gmail = get_processor(mailbox_id).gmail
+    messages, next_page_token = gmail.list_unread_page(page_token)
+    for message_data in messages:
+        process_email.delay(mailbox_id, message_data["id"])
+    return next_page_token
+
+
+@shared_task(base=MailboxTask)
+@profiled
+def sync_mailbox(mailbox_id):
+    """Queue the emails added to the mailbox since its last sync"""
+    with singleton(f"sync_mailbox:{mailbox_id}") as acquired:
+        if not acquired:
+            # The running sync may have listed the history already
+            sync_mailbox.apply_async(
+                (mailbox_id,), countdown=settings.GMAIL_PUSH_DEBOUNCE
+            )
+            return
+        mailbox = Mailbox.objects.filter(pk=mailbox_id, active=True).first()
+        if mailbox is None:
+            logger.warning("Mailbox %s is not active, not syncing", mailbox_id)
+            return
+
+        gmail = get_processor(mailbox_id).gmail
+        try:
+            message_ids, history_id = sync.new_message_ids(gmail, mailbox.history_id)
+        except HistoryExpired:
+            logger.warning("History %s expired, polling instead", mailbox.history_id)
+            history_id = gmail.get_profile().get("historyId")
+            poll_mailbox.delay(mailbox_id)
+            sync.mark_synced(mailbox, history_id)
+            return
+
+        for message_id in message_ids:
+            process_email.delay(mailbox_id, message_id)
+        # Saved after queueing: a crash before this replays the same history
+        sync.mark_synced(mailbox, history_id)
+        logger.info("Synced %d new emails of %s", len(message_ids), mailbox)
+
+
+@shared_task
+@profiled
+def renew_gmail_watch():
+    """Background task to keep the push notifications of every mailbox on"""
+    if not settings.GMAIL_PUBSUB_TOPIC:
+        return
+    for mailbox_id in active_mailbox_ids():
+        sync.renew_watch(get_processor(mailbox_id).gmail, settings.GMAIL_PUBSUB_TOPIC)
+
+
+@shared_task(base=MailboxTask)
+@profiled
+def process_email(mailbox_id, gmail_message_id):
+    """Store one email, then queue the response decision"""
+    with singleton(f"process_email:{gmail_message_id}") as acquired:
+        if not acquired:
+            return
+        # Root span of the email's trace, continued by decide_response
+        with tracing.start_span("email") as span:
+            message = get_processor(mailbox_id).ingest_email(gmail_message_id)
+    if message is not None:
+        decide_response.delay(message.pk, span.traceparent)
+
+
+@shared_task(
+    base=MailboxTask,
+    # LLM errors are mostly transient (timeouts, rate limits, 5xx)
+    autoretry_for=(Exception,),
+    dont_autoretry_for=(QuotaExceeded, Message.DoesNotExist),
+    retry_backoff=30,
+    retry_backoff_max=1800,
+    max_retries=6,
+)
+@profiled
+def decide_response(message_pk, traceparent=None):
+    """Generate, time and schedule the response to one stored email"""
+    with singleton(f"decide_response:{message_pk}") as acquired:
+        if not acquired:
+            return
+        message = Message.objects.select_related("conversation__contact").get(
+            pk=message_pk
+        )
+        processor = get_processor(message.conversation.mailbox_id)
+        processor.schedule_response(message, traceparent)
 
 
 @shared_task
+@profiled
 def send_scheduled_emails():
-    """Background task to send scheduled email responses"""
-    processor = EmailProcessor()
-    print("[DEBUG] Sending scheduled responses...")
-    processor.send_scheduled_messages()
+    """Background task to queue the scheduled responses that are due"""
+    with singleton("send_scheduled_emails") as acquired:
+        if not acquired:
+            logger.info("Previous send sweep still running")
+            return
+        logger.debug("Queueing due scheduled messages")
+        # Rows already queued by a previous sweep are skipped once claimed
+        due = due_scheduled_messages().values_list("pk", "conversation__mailbox_id")
+        for message_pk, mailbox_id in due.iterator():
+            send_scheduled_message.delay(mailbox_id, message_pk)
+
+
+@shared_task(base=MailboxTask)
+@profiled
+def send_scheduled_message(mailbox_id, message_pk):
+    """Send one scheduled message if it is still pending"""
+    get_processor(mailbox_id).send_scheduled_message(message_pk)
+
+
+@shared_task
+@profiled
+def archive_idle_conversations():
+    """Background task to move idle conversations into the archive tables"""
+    with singleton("archive_idle_conversations", timeout=6 * 3600) as acquired:
+        if not acquired:
+            return
+        logger.info("Archiving idle conversations")
+        archive.archive_idle_conversations(settings.ARCHIVE_AFTER_DAYS)
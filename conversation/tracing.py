@@ -0,0 +1,203 @@
+# conversation/tracing.py
+"""
+Minimal OpenTelemetry-style tracing for the lifecycle of an email.
+
+Spans form one trace per email: ingest -> decide -> draft, then the send
+span, possibly days later in another process. Context crosses process
+boundaries as a W3C ``traceparent`` string: passed as a task argument
+between ingest and decide, and stored on ``ScheduledMessage.trace_context``
+for the send.
+
+Finished spans are written by the exporter named by ``TRACING_EXPORTER``:
+``"file"`` appends JSON lines to ``TRACING_FILE``, ``"console"`` writes them
+to stderr. With no exporter spans are not recorded and ``traceparent`` is
+None, so nothing is stored either.
+"""
+
+import contextvars
+import json
+import math
+import os
+import secrets
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_ns: int = 0
+    end_ns: int = 0
+    status: str = "OK"
+    attributes: Dict[str, object] = field(default_factory=dict)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+
+class _NoopSpan:
+    traceparent = None
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, "TRACING_EXPORTER", ""))
+
+
+def parse_traceparent(value: Optional[str]):
+    """Return (trace_id, span_id) of a W3C traceparent, or None if invalid."""
+    parts = (value or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2]
+
+
+def current_traceparent() -> Optional[str]:
+    span = _current.get()
+    return span.traceparent if span is not None else None
+
+
+@contextmanager
+def start_span(name: str, parent: Optional[str] = None, attributes=None):
+    """
+    Record a span around the block.
+
+    Args:
+        name: The span name.
+        parent: traceparent of a remote parent. Defaults to the current
+            span of this context, and starts a new trace if there is none.
+        attributes: Initial span attributes.
+    """
+    if not enabled():
+        yield NOOP_SPAN
+        return
+
+    remote = parse_traceparent(parent)
+    local = _current.get()
+    if remote is not None:
+        trace_id, parent_id = remote
+    elif local is not None:
+        trace_id, parent_id = local.trace_id, local.span_id
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+
+    span = Span(
+        name=name,
+        trace_id=trace_id,
+        span_id=secrets.token_hex(8),
+        parent_id=parent_id,
+        start_ns=time.time_ns(),
+        attributes=dict(attributes or {}),
+    )
+    token = _current.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.status = "ERROR"
+        span.set_attribute("exception", repr(e)[:200])
+        raise
+    finally:
+        _current.reset(token)
+        span.end_ns = time.time_ns()
+        export(span)
+
+
+def export(span: Span):
+    line = json.dumps(asdict(span), default=str) + "\n"
+    exporter = getattr(settings, "TRACING_EXPORTER", "")
+    if exporter == "console":
+        sys.stderr.write(line)
+    elif exporter == "file":
+        path = Path(settings.TRACING_FILE)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Single appends of a line are not interleaved between processes
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+
+def read_spans(path) -> List[dict]:
+    """Load the spans written by the file exporter."""
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue  # Line cut by a crash
+    return spans
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of a sorted list, q in [0, 100]."""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(spans: List[dict], since_ns: int = 0) -> dict:
+    """
+    Aggregate exported spans.
+
+    Returns the distribution of the schedule drift of sent messages, of each
+    span's duration by name, and of the time from the start of an email's
+    trace to each send in it, all in seconds.
+    """
+    # Traces start before the cut-off when a send is due days after ingest
+    trace_start = {}
+    for span in spans:
+        start = trace_start.get(span["trace_id"])
+        if start is None or span["start_ns"] < start:
+            trace_start[span["trace_id"]] = span["start_ns"]
+    spans = [s for s in spans if s["start_ns"] >= since_ns]
+
+    durations, drift, end_to_end = {}, [], []
+    for span in spans:
+        seconds = (span["end_ns"] - span["start_ns"]) / 1e9
+        durations.setdefault(span["name"], []).append(seconds)
+        if span["name"] == "send" and "schedule_drift_seconds" in span["attributes"]:
+            drift.append(span["attributes"]["schedule_drift_seconds"])
+            end_to_end.append((span["end_ns"] - trace_start[span["trace_id"]]) / 1e9)
+
+    summary = {"schedule_drift": _distribution(drift)}
+    summary["end_to_end"] = _distribution(end_to_end)
+    summary["spans"] = {name: _distribution(v) for name, v in sorted(durations.items())}
+    return summary
+
+
+def _distribution(values: List[float]) -> dict:
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": values[-1] if values else 0.0,
+    }
@@ -0,0 +1,18 @@
+# conversation/urls.py
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from . import api, views
+
+router = DefaultRouter()
+router.register("contacts", api.ContactViewSet)
+router.register("conversations", api.ConversationViewSet)
+router.register("messages", api.MessageViewSet)
+router.register("schedule", api.ScheduleViewSet, basename="schedule")
+
+urlpatterns = [
+    path("api/", include(router.urls)),
+    path("metrics", views.metrics, name="metrics"),
+    path("gmail/push", views.gmail_push, name="gmail_push"),
+    path("events", views.events, name="events"),
+]
@@ -1,3 +1,119 @@
-from django.shortcuts import render
+# conversation/views.py
+import base64
+import hmac
+import json
+import logging
 
-# Create your views here.
+from django.conf import settings
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    StreamingHttpResponse,
+)
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import metrics as pipeline_metrics
+from .events import hub
+from .log import log_context
+from .models import ScheduledMessage
+from .services import sync
+
+logger = logging.getLogger(__name__)
+
+
+@require_GET
+def metrics(request):
+    """Pipeline metrics of every process, in the Prometheus text format"""
+    if not pipeline_metrics.enabled():
+        raise Http404("Metrics are disabled")
+
+    # Queue depth is read from the database at scrape time
+    pending = ScheduledMessage.objects.filter(sent=False, canceled=False)
+    pipeline_metrics.SCHEDULED_PENDING.set(pending.count())
+    pipeline_metrics.SCHEDULED_DUE.set(
+        pending.filter(scheduled_send_time__lte=timezone.now()).count()
+    )
+    pipeline_metrics.flush()
+
+    return HttpResponse(
+        pipeline_metrics.render(pipeline_metrics.collect()),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@csrf_exempt
+@require_POST
+def gmail_push(request):
+    """
+    Receive a Gmail watch notification pushed by Pub/Sub.
+
+    The subscription's push endpoint carries ``?token=GMAIL_PUSH_TOKEN``.
+    Any 2xx response acknowledges the notification, so it is answered as
+    soon as the sync is queued.
+    """
+    token = settings.GMAIL_PUSH_TOKEN
+    if not token:
+        raise Http404("Push notifications are disabled")
+    if not hmac.compare_digest(request.GET.get("token", ""), token):
+        return HttpResponseForbidden("Invalid token")
+
+    try:
+        envelope = json.loads(request.body)
+        data = json.loads(base64.b64decode(envelope["message"]["data"]))
+        email_address = data["emailAddress"]
+        history_id = data["historyId"]
+    except (ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest("Invalid notification")
+
+    with log_context(pubsub_message_id=envelope["message"].get("messageId")):
+        queued = sync.schedule_sync(email_address)
+        logger.debug(
+            "Notification for %s at history %s, %s",
+            email_address,
+            history_id,
+            "sync queued" if queued else "sync already pending",
+        )
+    return HttpResponse(status=204)
+
+
+@require_GET
+async def events(request):
+    """
+    Live pipeline events as Server-Sent Events, for staff users.
+
+    Events are buffered per client; when a client falls behind, the oldest
+    are dropped and a ``dropped`` event tells how many.
+    """
+    user = await request.auser()
+    if not user.is_staff:
+        return HttpResponseForbidden("Staff only")
+
+    subscription = hub.subscribe()
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                events, dropped = await subscription.get(
+                    timeout=settings.LIVE_FEED_HEARTBEAT
+                )
+                if dropped:
+                    yield f"event: dropped\ndata: {json.dumps({'count': dropped})}\n\n"
+                for event in events:
+                    kind = json.loads(event)["type"]
+                    yield f"event: {kind}\ndata: {event}\n\n"
+                if not events:
+                    # Keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+        finally:
+            hub.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response